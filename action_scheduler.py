@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import logging
+import time
+from metrics import Histogram
+
+
+class ScheduledAction:
+    __slots__ = ("name", "factory", "not_before", "scheduled_at", "cancelled")
+
+    def __init__(self, name, factory, not_before, scheduled_at):
+        self.name = name
+        self.factory = factory
+        self.not_before = not_before
+        self.scheduled_at = scheduled_at
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ActionScheduler:
+    """
+    Per-charger queue of follow-up actions that run after an OCPP response was sent.
+
+    Handlers schedule CSMS-initiated calls (e.g. SetChargingProfile after
+    StartTransaction) instead of awaiting them, so the charger gets its response at
+    once. Actions run one at a time in scheduling order; `delay` postpones an action
+    without blocking the handler. `cancel_all` drops everything when the connection
+    goes away.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        # Time from the requested start until the action actually started, and run time
+        self.lag = Histogram()
+        self.duration = Histogram()
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def schedule(self, name, factory, delay=0.0):
+        """
+        Queue `factory()` (a coroutine function) to run after `delay` seconds. Returns the action.
+        """
+        now = time.monotonic()
+        action = ScheduledAction(name, factory, now + delay, now)
+        self._queue.append(action)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return action
+
+    def cancel_all(self):
+        for action in self._queue:
+            action.cancel()
+        self.cancelled += len(self._queue)
+        self._queue.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            action = self._queue[0]
+            wait = action.not_before - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._queue.popleft()
+            if action.cancelled:
+                self.cancelled += 1
+                continue
+            started = time.monotonic()
+            self.lag.observe(max(0.0, started - action.not_before))
+            try:
+                await action.factory()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"{self.name}: scheduled {action.name} failed: {e}")
+            finally:
+                self.duration.observe(time.monotonic() - started)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            "pending": len(self._queue),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "lag": self.lag.summary(),
+            "duration": self.duration.summary(),
+        }
@@ -0,0 +1,74 @@
+"""
+JSON codec benchmark over the OCPP frames recorded in logs/ocpp_server.log: decode and
+encode per backend (stdlib json vs orjson), the full frame unpack the handler does, MQTT
+payload encoding and Home Assistant discovery announces.
+
+    python bench/bench_codec.py --repeat 20
+"""
+import argparse
+import json
+import time
+
+import common  # noqa: F401  (sets up sys.path)
+import codec
+from common import CountingMQTT, LOG_FILE
+from evcharger_handler import SensorDescriptor, _unpack
+from ocpp.messages import unpack
+from ocpp_trace import trace_from_log
+
+
+def timed(fn, items, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - t0) / (repeat * len(items)) * 1e6
+
+
+def discovery_configs(n):
+    return [
+        SensorDescriptor(f"CP_{i:03d}", "power_active_import", "power_active_import_outlet", "W", "power",
+                         "measurement").config_payload()
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("log", nargs="?", default=LOG_FILE)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    raw = [message for _, _, _, message in trace_from_log(args.log) if message.startswith("[")]
+    frames = [json.loads(message) for message in raw]
+    payloads = [frame[-1] for frame in frames if isinstance(frame[-1], dict)]
+    size = sum(len(message) for message in raw) / len(raw)
+    print(f"{len(raw)} recorded frames, {size:.0f} bytes on average, x{args.repeat}")
+    print(f"  {'backend':<8}{'loads':>9}{'dumps':>9}{'unpack':>9}{'payload':>9}{'sorted':>9}   (us/item)")
+
+    configs = discovery_configs(200)
+    backends = ["json", "orjson"] if codec.orjson is not None else ["json"]
+    for backend in backends:
+        codec.use(backend)
+        loads = timed(codec.loads, raw, args.repeat)
+        dumps = timed(codec.dumps, frames, args.repeat)
+        frame_unpack = timed(_unpack, raw, args.repeat)
+        payload = timed(codec.dumpb, payloads, args.repeat)
+        sort = timed(lambda c: codec.dumpb(c, sort_keys=True), configs, args.repeat)
+        print(f"  {backend:<8}{loads:>9.2f}{dumps:>9.2f}{frame_unpack:>9.2f}{payload:>9.2f}{sort:>9.2f}")
+    print(f"  {'ocpp lib':<8}{'':>9}{'':>9}{timed(unpack, raw, args.repeat):>9.2f}   (ocpp.messages.unpack)")
+
+    # Discovery: a charger re-announcing its constant configs on every message
+    mqtt = CountingMQTT()
+    for config in configs:
+        mqtt.discovery.announce(f"homeassistant/sensor/{config['unique_id']}/config", config)
+    same = timed(lambda c: mqtt.discovery.announce(f"homeassistant/sensor/{c['unique_id']}/config", c),
+                 configs, args.repeat)
+    rebuilt = timed(lambda c: mqtt.discovery.announce(f"homeassistant/sensor/{c['unique_id']}/config", dict(c)),
+                    configs, args.repeat)
+    print(f"discovery re-announce ({codec.BACKEND}): same object {same:.2f} us, rebuilt equal dict {rebuilt:.2f} us, "
+          f"{mqtt.published} published")
+
+
+if __name__ == "__main__":
+    main()
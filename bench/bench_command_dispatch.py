@@ -0,0 +1,99 @@
+"""
+MQTT command routing cost against fleet size: the old path (scan the command prefixes,
+look the charger up by id, then compare the topic against one f-string per command)
+vs the dispatch table (one dict lookup for the CommandRoute, then its handler).
+Also reports the MQTT subscriptions needed, per-charger topics vs the wildcards.
+
+    python bench/bench_command_dispatch.py --fleet 10 100 1000 5000
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from common import CountingMQTT, load_config
+from charge_point_registry import ChargePointRegistry
+from evcharger_handler import EVChargePoint
+from mqtt_commands import COMMAND_TOPICS, command_routes
+
+# The routing this replaced, for comparison
+LEGACY_PREFIXES = ("current_limit_", "unlock_cable_", "availability_", "suspend_", "resume_")
+LEGACY_TOPICS_PER_CHARGER = 4
+
+
+def legacy_route(charge_points, topic):
+    head = topic.split("/", 1)[0]
+    for prefix in LEGACY_PREFIXES:
+        if head.startswith(prefix):
+            return charge_points.get(head[len(prefix):])
+    return None
+
+
+def legacy_handle(cp, topic, payload):
+    device_id = cp.id
+    if topic == f"suspend_{device_id}/set":
+        return "suspend"
+    elif topic == f"resume_{device_id}/set":
+        return "resume"
+    elif topic == f"unlock_cable_{device_id}/press":
+        return "unlock_cable"
+    elif topic == f"availability_{device_id}/set":
+        return "availability"
+    elif topic == f"current_limit_{device_id}/set":
+        return "current_limit"
+
+
+class NullConnection:
+    async def send(self, message):
+        pass
+
+
+def timed(fn, topics):
+    t0 = time.perf_counter()
+    for topic in topics:
+        fn(topic)
+    return (time.perf_counter() - t0) / len(topics) * 1e9
+
+
+async def run(fleet, n):
+    config = load_config()
+    mqtt = CountingMQTT()
+    registry = ChargePointRegistry()
+    by_id = {}
+    for i in range(fleet):
+        cp = EVChargePoint(f"CP_{i:05d}", NullConnection(), mqtt, config)
+        registry.register(cp)
+        by_id[cp.id] = cp
+    rng = random.Random(fleet)
+    commands = [(name, verb) for name, verb, _, _ in command_routes(EVChargePoint)]
+    topics = []
+    for _ in range(n):
+        name, verb = rng.choice(commands)
+        topics.append(f"{name}_CP_{rng.randrange(fleet):05d}/{verb}")
+
+    legacy = timed(lambda topic: legacy_handle(legacy_route(by_id, topic), topic, "16"), topics)
+    table = timed(registry.route_command, topics)
+    # Full dispatch: lookup plus the handler (coalescer submit for the slider commands)
+    routes = [topic for topic in topics if topic.startswith("current_limit_")]
+    dispatched = timed(lambda topic: registry.route_command(topic).run("16", config), routes)
+    for cp in by_id.values():
+        cp.coalescer.cancel()
+    return legacy, table, dispatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("-n", type=int, default=200000, help="commands routed per fleet size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print(f"  {'chargers':>8}{'legacy ns':>11}{'table ns':>10}{'dispatch ns':>13}{'subs before':>13}{'subs now':>10}")
+    for fleet in args.fleet:
+        legacy, table, dispatched = asyncio.run(run(fleet, args.n))
+        print(f"  {fleet:>8}{legacy:>11.0f}{table:>10.0f}{dispatched:>13.0f}"
+              f"{fleet * LEGACY_TOPICS_PER_CHARGER:>13}{len(COMMAND_TOPICS):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Home Assistant discovery for a fleet: one device config per charger vs one config per entity.
+Each charger announces its controls, session and status sensors and a set of meter value
+sensors. Reports the retained discovery topics and bytes on the broker, the messages the
+server resends when HA restarts, and the time to decode them all (a floor for HA's own
+startup processing, which does far more per message than parse JSON).
+
+    python bench/bench_discovery.py --fleet 10 100 1000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from common import CountingMQTT, load_config
+from evcharger_handler import EVChargePoint
+
+# (measurand, phase) of a typical three-phase charger's MeterValues
+MEASURANDS = [("Energy.Active.Import.Register", None), ("Power.Active.Import", None)] + [
+    (measurand, phase)
+    for measurand in ("Current.Import", "Voltage", "Power.Active.Import")
+    for phase in ("L1", "L2", "L3")
+]
+
+
+class RetainingMQTT(CountingMQTT):
+    """
+    CountingMQTT that also keeps the last payload per topic, like the broker's retained store.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.retained = {}
+
+    def publish(self, topic, payload, **kwargs):
+        super().publish(topic, payload, **kwargs)
+        if payload:
+            self.retained[topic] = payload
+        else:
+            # An empty retained message deletes the topic (migrated per-entity configs)
+            self.retained.pop(topic, None)
+
+
+class NullConnection:
+    async def send(self, message):
+        pass
+
+
+async def run(mode, fleet, config):
+    mqtt = RetainingMQTT()
+    mqtt.discovery.mode = mode
+    charge_points = [EVChargePoint(f"CP_{i:05d}", NullConnection(), mqtt, config) for i in range(fleet)]
+    t0 = time.perf_counter()
+    for cp in charge_points:
+        cp.publish_control_discovery()
+        cp.publish_last_charging_start_sensor()
+        cp.publish_session_energy_discovery()
+        cp.publish_connection(True)
+        await cp.send_status("Available")
+        await cp.on_heartbeat()
+        for measurand, phase in MEASURANDS:
+            cp._sensor_descriptor(measurand, phase, "Outlet", None)
+        # Batched device configs go out on the next loop iteration
+        await asyncio.sleep(0)
+    build = (time.perf_counter() - t0) / fleet * 1e6
+    for cp in charge_points:
+        cp.coalescer.cancel()
+
+    configs = {topic: payload for topic, payload in mqtt.retained.items() if topic.startswith("homeassistant/")}
+    size = sum(len(payload) for payload in configs.values())
+    entities = sum(len(cp.discovery) for cp in charge_points)
+    published = mqtt.published
+    mqtt.discovery.republish_all()
+    resent = mqtt.published - published
+    t0 = time.perf_counter()
+    for payload in configs.values():
+        json.loads(payload)
+    decode = (time.perf_counter() - t0) * 1e3
+    return entities, len(configs), size, resent, decode, build
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fleet", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    config = load_config()
+    print(f"  {'mode':<8}{'chargers':>9}{'entities':>10}{'topics':>8}{'KiB':>9}{'HA restart msgs':>17}"
+          f"{'decode ms':>11}{'setup us/cp':>13}")
+    for fleet in args.fleet:
+        for mode in ("entity", "device"):
+            entities, topics, size, resent, decode, build = asyncio.run(run(mode, fleet, config))
+            print(f"  {mode:<8}{fleet:>9}{entities:>10}{topics:>8}{size / 1024:>9.1f}{resent:>17}"
+                  f"{decode:>11.1f}{build:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Energy accounting benchmark: backfills months of Energy.Active.Import.Register readings
+(30 s interval, with reporting gaps and register resets) and prices them with a
+time-of-use tariff. Compares against pricing every reading on its own.
+
+    python bench/bench_energy_accounting.py --days 180
+"""
+import argparse
+import random
+import time
+from array import array
+from datetime import datetime
+
+import common  # noqa: F401  (sets up sys.path)
+from energy_accounting import TariffTable, backfill
+
+TARIFF = {
+    "currency": "EUR",
+    "price": 0.22,
+    "periods": [
+        {"from": 7, "to": 23, "price": 0.31, "days": [0, 1, 2, 3, 4]},
+        {"from": 17, "to": 20, "price": 0.42},
+    ],
+}
+
+
+def generate(days, interval, rng):
+    """
+    Register stream: a charger drawing 0-11 kW, with gaps and the occasional reboot to 0.
+    """
+    timestamps, readings = array("d"), array("d")
+    ts = 1_700_000_000.0
+    end = ts + days * 86400
+    register = 1_000_000.0
+    true_wh = 0.0
+    power = 0.0
+    while ts < end:
+        if rng.random() < 0.01:
+            power = rng.choice((0.0, 0.0, 3700.0, 7400.0, 11000.0))
+        step = interval if rng.random() > 0.001 else interval * rng.randint(10, 200)  # reporting gap
+        ts += step
+        wh = power * step / 3600
+        true_wh += wh
+        register += wh
+        if rng.random() < 0.00005:
+            register = wh  # meter rebooted to 0 (energy since the reboot is on the new register)
+        timestamps.append(ts)
+        readings.append(register)
+    return timestamps, readings, true_wh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=float, default=180)
+    parser.add_argument("--interval", type=float, default=30)
+    args = parser.parse_args()
+
+    timestamps, readings, true_wh = generate(args.days, args.interval, random.Random(1))
+    tariff = TariffTable(TARIFF)
+
+    t0 = time.perf_counter()
+    energy, cost = backfill(timestamps, readings, tariff)
+    elapsed = time.perf_counter() - t0
+
+    # Reference: price every delta at its reading's local time
+    t0 = time.perf_counter()
+    naive_cost = 0.0
+    for i in range(1, len(readings)):
+        delta = readings[i] - readings[i - 1]
+        if delta < 0:
+            delta = readings[i]
+        local = datetime.fromtimestamp(timestamps[i - 1])
+        naive_cost += delta / 1000 * tariff.prices[local.weekday() * 24 + local.hour]
+    naive = time.perf_counter() - t0
+
+    n = len(readings)
+    print(
+        f"{n} readings over {args.days:g} days, {energy.stats()}\n"
+        f"  energy:  {energy.kwh:.1f} kWh accounted, {true_wh / 1000:.1f} kWh drawn\n"
+        f"  cost:    {cost:.2f} {tariff.currency} (per-reading pricing: {naive_cost:.2f})\n"
+        f"  backfill: {elapsed * 1000:.0f} ms ({n / elapsed:,.0f} readings/s), "
+        f"per-reading pricing {naive * 1000:.0f} ms ({naive / elapsed:.1f}x slower)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Site load manager benchmark: N concurrent sessions behind one site budget, fed with
+MeterValues-like readings. Reports cost per event and how many profile pushes it caused.
+
+    python bench/bench_load_manager.py --sessions 1000 --events 50000
+"""
+import argparse
+import random
+import time
+
+import common  # noqa: F401  (sets up sys.path)
+from load_manager import PHASES, SiteLoadManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--budget", type=float, default=None, help="Amps per phase (default: 10 A per session)")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    pushes = []
+    budget = args.budget or args.sessions * 10.0
+    manager = SiteLoadManager(budget, min_current=6, on_change=lambda cp_id, amps: pushes.append(cp_id))
+    ids = [f"CP_{i:05d}" for i in range(args.sessions)]
+
+    t0 = time.perf_counter()
+    for cp_id in ids:
+        manager.update(cp_id, 16)
+    ramp = time.perf_counter() - t0
+    ramp_pushes = len(pushes)
+
+    pushes.clear()
+    t0 = time.perf_counter()
+    for _ in range(args.events):
+        cp_id = rng.choice(ids)
+        allocation = manager.allocation(cp_id) or 0
+        # Most EVs draw what they are offered; some are limited by their onboard charger
+        drawn = allocation if rng.random() < 0.8 else rng.choice((6, 10, 13))
+        imports = {p: min(drawn, allocation) for p in (PHASES if rng.random() < 0.7 else PHASES[:1])}
+        manager.update(cp_id, 16, imports, allocation)
+    elapsed = time.perf_counter() - t0
+
+    print(
+        f"sessions={args.sessions} budget={budget:.0f} A/phase\n"
+        f"  ramp-up: {ramp * 1000:.1f} ms ({ramp / args.sessions * 1e6:.1f} us/session), {ramp_pushes} profile pushes\n"
+        f"  steady:  {args.events} events in {elapsed * 1000:.1f} ms ({elapsed / args.events * 1e6:.1f} us/event), "
+        f"{len(pushes)} profile pushes ({len(pushes) / args.events:.2f}/event)"
+    )
+
+
+if __name__ == "__main__":
+    main()
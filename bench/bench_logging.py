@@ -0,0 +1,166 @@
+"""
+Logging cost on the event loop: N in-process chargers (running the real ChargePoint
+receive loop) send the MeterValues frames recorded in logs/ocpp_server.log. The run is
+repeated per logging setup. Reports the time the loop spent inside logging calls
+(total per frame and the longest single call) and the wall time per frame.
+
+    python bench/bench_logging.py --chargers 100 --frames 50 --mode off direct queue
+    python bench/bench_logging.py --mode direct queue --rotate-bytes 1000000
+    python bench/bench_logging.py --mode queue --sample 10 --format json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import threading
+import uuid
+
+from common import CountingMQTT, load_config, recorded_frames
+from evcharger_handler import EVChargePoint
+
+
+class CallTimer:
+    """
+    Times Logger.handle calls made on the event loop thread (filters, handlers, I/O).
+    """
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.total = 0.0
+        self.longest = 0.0
+        self._handle = logging.Logger.handle
+        timer = self
+
+        def handle(logger, record):
+            if threading.get_ident() != timer.thread:
+                return timer._handle(logger, record)
+            t0 = time.perf_counter()
+            try:
+                return timer._handle(logger, record)
+            finally:
+                spent = time.perf_counter() - t0
+                timer.total += spent
+                timer.longest = max(timer.longest, spent)
+        logging.Logger.handle = handle
+
+    def restore(self):
+        logging.Logger.handle = self._handle
+
+
+class QueueConnection:
+    """
+    Charger side of an in-process connection: frames are put into `inbound`.
+    """
+
+    def __init__(self, done):
+        self.inbound = asyncio.Queue()
+        self.remote_address = ("127.0.0.1", 0)
+        self.done = done
+
+    async def recv(self):
+        return await self.inbound.get()
+
+    async def send(self, message):
+        self.done()
+
+
+def configure(mode, log_file, sample, log_format, rotate_bytes):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    if mode == "off":
+        root.setLevel(logging.CRITICAL)
+        return None
+    if mode == "direct" and not sample and log_format == "text" and not rotate_bytes:
+        # What server.py did before log_setup: synchronous FileHandler on the loop
+        handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        return None
+    from log_setup import setup_logging
+    config = {"file": log_file, "level": "INFO", "to_console_level": "CRITICAL", "mode": mode,
+              "format": log_format}
+    if sample:
+        config["sample"] = {"MeterValues": sample}
+    if rotate_bytes:
+        config["rotate"] = {"max_bytes": rotate_bytes, "backup_count": 3}
+    return setup_logging(config)
+
+
+async def run(n_chargers, frames):
+    config = load_config()
+    mqtt = CountingMQTT()
+    expected = n_chargers * len(frames)
+    answered = 0
+    finished = asyncio.Event()
+
+    def done():
+        nonlocal answered
+        answered += 1
+        if answered == expected:
+            finished.set()
+
+    connections = [QueueConnection(done) for _ in range(n_chargers)]
+    chargers = [EVChargePoint(f"CP_{i:05d}", conn, mqtt, config) for i, conn in enumerate(connections)]
+    for cp in chargers:
+        cp.current_transaction_id = 1
+    tasks = [asyncio.create_task(cp.start()) for cp in chargers]
+
+    t0 = time.perf_counter()
+    for frame in frames:
+        for conn in connections:
+            conn.inbound.put_nowait(frame)
+    await finished.wait()
+    elapsed = time.perf_counter() - t0
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chargers", type=int, default=100)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--mode", nargs="+", default=["off", "direct", "queue"])
+    parser.add_argument("--sample", type=int, default=0, help="Log 1 in N MeterValues frames")
+    parser.add_argument("--format", default="text", choices=("text", "json"))
+    parser.add_argument("--rotate-bytes", type=int, default=0, help="Rotate (and gzip) the log at this size")
+    args = parser.parse_args()
+
+    recorded = list(recorded_frames("MeterValues"))
+    frames = [json.dumps([2, str(uuid.uuid4()), "MeterValues", recorded[i % len(recorded)][3]])
+              for i in range(args.frames)]
+    samples = args.chargers * sum(len(mv["sampledValue"]) for f in frames for mv in json.loads(f)[3]["meterValue"])
+    n = args.chargers * len(frames)
+
+    # Warm up (schema validators, descriptor caches) so the first mode is not penalised
+    configure("off", None, 0, "text", 0)
+    asyncio.run(run(args.chargers, frames[:5]))
+
+    for mode in args.mode:
+        with tempfile.TemporaryDirectory() as tmp:
+            log_file = os.path.join(tmp, "ocpp_server.log")
+            listener = configure(mode, log_file, args.sample, args.format, args.rotate_bytes)
+            timer = CallTimer()
+            elapsed = asyncio.run(run(args.chargers, frames))
+            timer.restore()
+            t0 = time.perf_counter()
+            if listener is not None:
+                listener.stop()
+            drain = time.perf_counter() - t0
+            size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+            logging.getLogger().handlers.clear()
+        print(
+            f"{mode:>6}: {n} frames, {elapsed / n * 1e6:.0f} us/frame wall; in logging calls "
+            f"{timer.total / n * 1e6:.1f} us/frame, longest call {timer.longest * 1000:.2f} ms; "
+            f"listener drain {drain * 1000:.0f} ms; log {size / samples:.0f} bytes/sample on disk"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Microbenchmark for the MeterValues hot path: replays the MeterValues frames recorded in
+logs/ocpp_server.log through EVChargePoint.on_meter_values and reports samples/sec.
+
+    python bench/bench_meter_values.py --repeat 20
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from ocpp.charge_point import camel_to_snake_case
+
+from common import CountingMQTT, load_config, recorded_frames
+from evcharger_handler import EVChargePoint
+
+
+async def run(payloads, repeat):
+    cp = EVChargePoint("FH_CHARGE", None, CountingMQTT(), load_config())
+    # Avoid measuring the persisted transaction lookup
+    cp.current_transaction_id = 1
+    samples = sum(len(mv["sampled_value"]) for p in payloads for mv in p["meter_value"])
+    # Warm up caches (discovery, descriptors)
+    for p in payloads[:1]:
+        await cp.on_meter_values(**p)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for p in payloads:
+            await cp.on_meter_values(**p)
+    elapsed = time.perf_counter() - t0
+    total = samples * repeat
+    print(
+        f"frames={len(payloads) * repeat} samples={total} in {elapsed:.3f} s = "
+        f"{total / elapsed:,.0f} samples/s ({elapsed / (len(payloads) * repeat) * 1e6:.1f} us/frame)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    payloads = [camel_to_snake_case(f[3]) for f in recorded_frames("MeterValues")]
+    print(f"{len(payloads)} MeterValues frames recorded in the log")
+    asyncio.run(run(payloads, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
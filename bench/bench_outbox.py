@@ -0,0 +1,105 @@
+"""
+MQTT outbox over a broker outage: a fleet of chargers keeps publishing retained state
+and meter values while the broker is down, the process restarts once mid-outage, then
+the broker comes back. Reports the cost per held publish, outbox depth and file size
+(per-topic compaction), the flush duration and the publish rate the broker saw,
+and checks the broker ends up with the latest value of every topic.
+
+    python bench/bench_outbox.py --chargers 200 --updates 30 --rate 500
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (sets up sys.path)
+from common import free_port
+from mini_broker import MiniBroker
+from mqtt_client import PRIORITY_METER, PRIORITY_STATE, create_mqtt_client
+
+TOPICS_PER_CHARGER = (("status", PRIORITY_STATE), ("power_active_import", PRIORITY_METER),
+                      ("current_import", PRIORITY_METER), ("energy_active_import_register", PRIORITY_METER),
+                      ("voltage", PRIORITY_METER))
+
+
+def client_config(port, path, args, transport):
+    return {"broker": "127.0.0.1", "port": port, "transport": transport, "reconnect_min": 0.1, "reconnect_max": 0.2,
+            "outbox": {"path": path, "rate": args.rate, "batch_size": args.batch_size}}
+
+
+async def shutdown(client):
+    client.close()
+    if hasattr(client, "stop"):
+        await client.stop()
+    else:
+        client._connect_task.cancel()
+        client.client.loop_stop()
+
+
+def publish_fleet(client, args, round_):
+    expected = {}
+    for cp in range(args.chargers):
+        for name, priority in TOPICS_PER_CHARGER:
+            topic = f"ocpp/{name}_CP_{cp:04d}"
+            payload = f"{round_}.{cp}"
+            client.publish(topic, payload, priority=priority)
+            expected[topic] = payload.encode()
+    return expected
+
+
+async def run(args, transport):
+    path = os.path.join(tempfile.mkdtemp(prefix="ocpp-outbox-"), "mqtt_outbox.bin")
+    port = free_port()
+    expected = {}
+    published = 0
+    t0 = time.perf_counter()
+    # Broker down; the first process gives up half way through the outage
+    for run_ in range(2):
+        client = create_mqtt_client(client_config(port, path, args, transport))
+        await client.start()
+        for round_ in range(args.updates // 2):
+            expected.update(publish_fleet(client, args, f"{run_}.{round_}"))
+            published += args.chargers * len(TOPICS_PER_CHARGER)
+        held = len(client.outbox)
+        await shutdown(client)
+    held_us = (time.perf_counter() - t0) / published * 1e6
+    size = os.path.getsize(path)
+
+    client = create_mqtt_client(client_config(port, path, args, transport))
+    loaded = len(client.outbox)
+    await client.start()
+    broker = await MiniBroker(port=port).start()
+    up = time.perf_counter()
+    deadline = up + 60
+    while (len(client.outbox) or len(broker.retained) < len(expected)) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    flushed = time.perf_counter() - up
+    missing = sum(1 for topic, payload in expected.items() if broker.retained.get(topic) != payload)
+    await broker.stop()
+    await shutdown(client)
+    return published, held_us, held, size, loaded, flushed, broker.received, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chargers", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=30, help="publish rounds during the outage")
+    parser.add_argument("--rate", type=int, default=500, help="flush rate, messages/s")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--transport", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print(f"{args.chargers} chargers x {len(TOPICS_PER_CHARGER)} topics, {args.updates} rounds while the broker is "
+          f"down, restart half way, flush at {args.rate}/s")
+    print(f"  {'transport':<10}{'published':>10}{'us/held':>9}{'held':>7}{'file KiB':>10}{'reloaded':>10}"
+          f"{'flush s':>9}{'rate/s':>8}{'received':>10}{'stale':>7}")
+    for transport in args.transport:
+        published, held_us, held, size, loaded, flushed, received, missing = asyncio.run(run(args, transport))
+        print(f"  {transport:<10}{published:>10}{held_us:>9.2f}{held:>7}{size / 1024:>10.1f}{loaded:>10}"
+              f"{flushed:>9.2f}{received / flushed:>8.0f}{received:>10}{missing:>7}")
+
+
+if __name__ == "__main__":
+    main()
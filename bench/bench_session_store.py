@@ -0,0 +1,60 @@
+"""
+Session store benchmark: thousands of chargers starting and stopping transactions concurrently.
+
+    python bench/bench_session_store.py --chargers 2000 --cycles 5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (sets up sys.path)
+from session_store import SessionStore
+
+
+async def charger(store, cp_id, cycles):
+    latencies = []
+    for i in range(cycles):
+        t0 = time.perf_counter()
+        session = store.start_transaction(cp_id, 1, "tag", i * 1000, "2025-08-31T21:28:38Z")
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0)
+        t0 = time.perf_counter()
+        store.stop_transaction(cp_id, session.transaction_id, i * 1000 + 500, "2025-08-31T22:28:38Z")
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0)
+    return latencies
+
+
+async def run(n_chargers, cycles):
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    store = SessionStore(path)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(charger(store, f"CP_{i:05d}", cycles) for i in range(n_chargers)))
+    t_events = time.perf_counter() - t0
+    await store.flush()
+    t_total = time.perf_counter() - t0
+    latencies = sorted(l for r in results for l in r)
+    events = len(latencies)
+    p = lambda q: latencies[int(q * (events - 1))] * 1e6
+    rows = len(await store.history("CP_00000", limit=cycles + 1))
+    print(
+        f"chargers={n_chargers} events={events} loop_time={t_events * 1000:.1f} ms "
+        f"durable_after={t_total * 1000:.1f} ms ({events / t_total:,.0f} events/s) "
+        f"commits={store.commits} call p50={p(0.5):.1f} us p99={p(0.99):.1f} us "
+        f"rows_for_CP_00000={rows}"
+    )
+    await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chargers", type=int, default=2000)
+    parser.add_argument("--cycles", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.chargers, args.cycles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+StartTransaction round-trip: time from the frame arriving at EVChargePoint.route_message
+until the CALLRESULT is sent back to the charger.
+
+    python bench/bench_start_transaction.py --count 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from common import CountingMQTT, RecordingConnection, load_config
+from evcharger_handler import EVChargePoint
+
+
+async def run(count):
+    connection = RecordingConnection()
+    cp = EVChargePoint("FH_CHARGE", connection, CountingMQTT(), load_config())
+    payload = {"connectorId": 1, "idTag": "tag", "meterStart": 3531149, "timestamp": "2025-08-31T21:28:38Z"}
+    rtts = []
+    for i in range(count):
+        frame = json.dumps([2, f"start-{i}", "StartTransaction", payload])
+        t0 = time.perf_counter()
+        routed = asyncio.create_task(cp.route_message(frame))
+        while True:
+            await connection.wait_sent()
+            if any(f.startswith(f'[3,"start-{i}"') for f in connection.sent):
+                break
+        rtts.append(time.perf_counter() - t0)
+        await routed
+    rtts.sort()
+    print(
+        f"StartTransaction x{count}: median={statistics.median(rtts) * 1000:.2f} ms "
+        f"max={rtts[-1] * 1000:.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(args.count))
+
+
+if __name__ == "__main__":
+    main()
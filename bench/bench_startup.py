@@ -0,0 +1,95 @@
+"""
+Startup with the MQTT broker down, as after a power cut: starts server.py while nothing
+listens on the broker port and a charger keeps retrying its WebSocket connection, then
+brings a MiniBroker up after --broker-delay seconds.
+
+Reports, from process start: OCPP port listening, first WebSocket accepted, first
+BootNotification answered, and how long after the broker came up MQTT was connected
+(/healthz 200) and discovery was republished.
+
+    python bench/bench_startup.py --broker-delay 5 --transport thread asyncio
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+from common import ServerProcess, free_port
+from mini_broker import MiniBroker
+
+
+async def first_boot(url, timings, start_key):
+    # A charger retrying every 20 ms until it gets a BootNotification answered
+    while True:
+        try:
+            async with websockets.connect(url, subprotocols=["ocpp1.6"], open_timeout=2) as ws:
+                timings["first_websocket"] = time.monotonic() - timings[start_key]
+                await ws.send(json.dumps([2, "boot-1", "BootNotification",
+                                          {"chargePointVendor": "Futurehome", "chargePointModel": "Charge"}]))
+                await ws.recv()
+                timings["first_boot"] = time.monotonic() - timings[start_key]
+                await asyncio.sleep(3600)
+        except (OSError, websockets.exceptions.WebSocketException, asyncio.TimeoutError):
+            await asyncio.sleep(0.02)
+
+
+def healthz(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+async def run(transport, broker_delay):
+    broker_port = free_port()
+    server = ServerProcess(broker_port, {"mqtt": {"transport": transport, "reconnect_max": 5}})
+    timings = {}
+    loop = asyncio.get_running_loop()
+    charger = None
+    try:
+        async with server:
+            timings["spawned"] = server.spawned
+            timings["listening"] = time.monotonic() - server.spawned
+            charger = asyncio.create_task(first_boot(f"ws://127.0.0.1:{server.port}/CP_1", timings, "spawned"))
+            await asyncio.sleep(max(0.0, broker_delay - timings["listening"]))
+            statuses = {await loop.run_in_executor(None, healthz, server.port)}
+            broker = await MiniBroker(port=broker_port).start()
+            broker_up = time.monotonic()
+            try:
+                while await loop.run_in_executor(None, healthz, server.port) != 200:
+                    await asyncio.sleep(0.05)
+                timings["mqtt_connected"] = time.monotonic() - broker_up
+                while not any(topic.startswith("homeassistant/") for topic in broker.retained):
+                    await asyncio.sleep(0.05)
+                timings["discovery"] = time.monotonic() - broker_up
+            finally:
+                await broker.stop()
+    finally:
+        if charger is not None:
+            charger.cancel()
+    return timings, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker-delay", type=float, default=5)
+    parser.add_argument("--transport", nargs="+", default=["thread", "asyncio"])
+    args = parser.parse_args()
+    print(f"  {'transport':<10}{'listening':>10}{'first ws':>10}{'first boot':>12}"
+          f"{'healthz (no broker)':>21}{'mqtt up':>9}{'discovery':>11}   (s; mqtt/discovery after broker start)")
+    for transport in args.transport:
+        t, statuses = asyncio.run(run(transport, args.broker_delay))
+        print(f"  {transport:<10}{t['listening']:>10.2f}{t.get('first_websocket', float('nan')):>10.2f}"
+              f"{t.get('first_boot', float('nan')):>12.2f}{str(sorted(statuses)):>21}"
+              f"{t['mqtt_connected']:>9.2f}{t['discovery']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Meter history benchmark: feeds one charger's MeterHistory with 30 days of 30 s samples
+for the tracked sensors and reports memory per charger, append cost and query cost.
+
+    python bench/bench_timeseries.py --days 30 --interval 30
+"""
+import argparse
+import math
+import random
+import time
+import tracemalloc
+
+import common  # noqa: F401  (sets up sys.path)
+from timeseries import MeterHistory
+
+# Sensors a three-phase charger reports for the default tracked measurands
+SENSORS = ("power_active_import_outlet", "energy_active_import_register_outlet")
+
+
+def feed(history, days, interval, rng):
+    start = 1_700_000_000.0
+    energy = 0.0
+    n = int(days * 86400 / interval)
+    for k in range(n):
+        ts = start + k * interval
+        # Daily charging window with a noisy power curve
+        power = 11000 * max(0.0, math.sin(2 * math.pi * (ts % 86400) / 86400)) + rng.random() * 50
+        energy += power * interval / 3600
+        history.append(SENSORS[0], ts, power)
+        history.append(SENSORS[1], ts, energy)
+    return start, start + n * interval, n * len(SENSORS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=30)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    # Memory run under tracemalloc, timed run without it (tracing slows every allocation)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    traced = MeterHistory()
+    feed(traced, args.days, args.interval, rng)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del traced
+
+    history = MeterHistory()
+    t0 = time.perf_counter()
+    start, end, samples = feed(history, args.days, args.interval, rng)
+    elapsed = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(args.queries):
+        t = rng.uniform(start, end - 86400)
+        history.aggregate(SENSORS[0], t, t + 3600, "avg")
+    aggregate = (time.perf_counter() - t0) / args.queries
+
+    t0 = time.perf_counter()
+    points = 0
+    for _ in range(args.queries // 10):
+        points += len(history.query(SENSORS[0], start, end, "max"))
+    series = (time.perf_counter() - t0) / (args.queries // 10)
+
+    print(
+        f"{samples} samples ({len(SENSORS)} sensors, {args.days:g} days at {args.interval:g}s)\n"
+        f"  memory:    {history.nbytes() / 1024:.0f} KiB in arrays, {allocated / 1024:.0f} KiB allocated per charger\n"
+        f"  append:    {elapsed / samples * 1e6:.2f} us/sample (including sample generation)\n"
+        f"  aggregate: {aggregate * 1e6:.1f} us per 1 h avg\n"
+        f"  query:     {series * 1000:.2f} ms for the full range ({points // (args.queries // 10)} points)"
+    )
+
+
+if __name__ == "__main__":
+    main()
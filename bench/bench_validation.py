@@ -0,0 +1,62 @@
+"""
+CPU per MeterValues frame under each schema validation policy: the frames recorded in
+logs/ocpp_server.log go through the full EVChargePoint.route_message path (parse,
+validation, handler, response) with the validation policy set to full, sample and off,
+and with the library's executor-thread validation vs inline validation.
+
+    python bench/bench_validation.py --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import ocpp.messages
+
+from common import CountingMQTT, load_config, recorded_frames
+from evcharger_handler import EVChargePoint
+from validation_policy import ValidationPolicy, configure_validation
+
+
+class NullConnection:
+    async def send(self, message):
+        pass
+
+
+async def run(frames, policy, repeat):
+    cp = EVChargePoint("FH_CHARGE", NullConnection(), CountingMQTT(), load_config())
+    cp.current_transaction_id = 1
+    cp.validation = policy
+    # Warm up caches (validators, discovery, descriptors)
+    for frame in frames[:5]:
+        await cp.route_message(frame)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            await cp.route_message(frame)
+    n = repeat * len(frames)
+    return (time.process_time() - cpu0) / n * 1e6, (time.perf_counter() - wall0) / n * 1e6, policy.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--first", type=int, default=20)
+    parser.add_argument("--sample-every", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    frames = [json.dumps([2, f"mv-{i}", "MeterValues", f[3]]) for i, f in enumerate(recorded_frames("MeterValues"))]
+    print(f"{len(frames)} MeterValues frames x{args.repeat}")
+    print(f"  {'validation':<11}{'mode':<8}{'cpu us/frame':>14}{'wall us/frame':>15}   validated/skipped")
+    for inline in (False, True):
+        configure_validation({"inline": inline})
+        for mode in ("full", "sample", "off"):
+            policy = ValidationPolicy(mode, args.first, args.sample_every)
+            cpu, wall, stats = asyncio.run(run(frames, policy, args.repeat))
+            where = "inline" if not ocpp.messages.ASYNC_VALIDATION else "executor"
+            print(f"  {where:<11}{mode:<8}{cpu:>14.1f}{wall:>15.1f}   {stats['validated']}/{stats['skipped']}")
+
+
+if __name__ == "__main__":
+    main()
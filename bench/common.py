@@ -0,0 +1,145 @@
+"""
+Shared helpers for the benchmark / load-test scripts in this folder.
+
+Run scripts from the repository root, e.g. `python bench/load_test_fleet.py`.
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+LOG_FILE = os.path.join(ROOT, "logs", "ocpp_server.log")
+
+
+def load_config():
+    with open(os.path.join(ROOT, "config", "config.json")) as f:
+        return json.load(f)
+
+
+def recorded_frames(action=None, path=LOG_FILE):
+    """
+    Yield inbound OCPP CALL frames ("receive message [2,...]") recorded in the server log.
+    """
+    marker = "receive message "
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            idx = line.find(marker)
+            if idx < 0:
+                continue
+            raw = line[idx + len(marker):].strip()
+            try:
+                frame = json.loads(raw)
+            except ValueError:
+                continue
+            if frame[0] != 2 or (action and frame[2] != action):
+                continue
+            yield frame
+
+
+class CountingMQTT:
+    """
+    MQTT sink with the MQTTClient publish interface that only counts messages.
+    """
+
+    def __init__(self):
+        from discovery import DiscoveryRegistry
+        self.published = 0
+        self.topics = {}
+        self.discovery = DiscoveryRegistry(self)
+
+    def publish(self, topic, payload, **kwargs):
+        self.published += 1
+        self.topics[topic] = self.topics.get(topic, 0) + 1
+
+
+class RecordingConnection:
+    """
+    Stand-in for a charger WebSocket: records frames the server sends.
+    """
+
+    def __init__(self):
+        import asyncio
+        self.sent = []
+        self._sent_event = asyncio.Event()
+        self.remote_address = ("127.0.0.1", 0)
+
+    async def send(self, message):
+        self.sent.append(message)
+        self._sent_event.set()
+
+    async def wait_sent(self):
+        await self._sent_event.wait()
+        self._sent_event.clear()
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    """
+    Runs server.py in a subprocess from a scratch directory with its own config.json
+    (OCPP on a free local port, MQTT pointed at `broker_port`, logs and sessions.db
+    in the scratch directory). `overrides` are merged into the config sections.
+
+        async with ServerProcess(broker.port) as server:
+            ws://127.0.0.1:{server.port}/<cp_id>
+    """
+
+    def __init__(self, broker_port, overrides=None, log_level="WARNING"):
+        import tempfile
+        self.port = free_port()
+        self.broker_port = broker_port
+        self.overrides = overrides or {}
+        self.log_level = log_level
+        self.workdir = tempfile.mkdtemp(prefix="ocpp-bench-")
+        self.process = None
+        # time.monotonic() when the subprocess was started
+        self.spawned = None
+
+    def write_config(self):
+        config = load_config()
+        config["ocpp"].update({"host": "127.0.0.1", "port": self.port})
+        config["mqtt"].update({"broker": "127.0.0.1", "port": self.broker_port, "username": "", "password": ""})
+        config["logging"].update({"level": self.log_level, "file": "logs/ocpp_server.log", "to_console_level": "CRITICAL"})
+        for section, values in self.overrides.items():
+            if isinstance(values, dict):
+                config.setdefault(section, {}).update(values)
+            else:
+                config[section] = values
+        os.makedirs(os.path.join(self.workdir, "config"), exist_ok=True)
+        with open(os.path.join(self.workdir, "config", "config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+
+    async def __aenter__(self):
+        import asyncio
+        import subprocess
+        import time
+        self.write_config()
+        self.spawned = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py")], cwd=self.workdir)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                return self
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"server.py did not start (see {self.workdir}/logs)")
+                await asyncio.sleep(0.05)
+
+    async def __aexit__(self, *exc):
+        import asyncio
+        import subprocess
+        self.process.terminate()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.process.wait, 10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
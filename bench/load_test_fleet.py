@@ -0,0 +1,82 @@
+"""
+Fleet load test: N chargers connect to one server process on ws://host/<cp_id>,
+each boots and sends MeterValues frames. Reports connection count and message throughput.
+
+    python bench/load_test_fleet.py --chargers 10 100 500 --frames 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import websockets
+
+from common import CountingMQTT, load_config, recorded_frames
+from charge_point_registry import ChargePointRegistry, charge_point_id_from_path, request_path
+from evcharger_handler import EVChargePoint
+
+
+async def run_fleet(n_chargers, n_frames, meter_payload):
+    config = load_config()
+    mqtt = CountingMQTT()
+    registry = ChargePointRegistry()
+    connected = asyncio.Event()
+
+    async def on_connect(websocket):
+        cp_id = charge_point_id_from_path(request_path(websocket), config["ocpp"]["charge_point_id"])
+        charge_point = EVChargePoint(cp_id, websocket, mqtt, config)
+        registry.register(charge_point)
+        if len(registry) == n_chargers:
+            connected.set()
+        try:
+            await charge_point.start()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def charger(cp_id):
+        async with websockets.connect(f"ws://127.0.0.1:{port}/{cp_id}", subprotocols=["ocpp1.6"]) as ws:
+            boot = {"chargePointVendor": "Futurehome", "chargePointModel": "Charge"}
+            await ws.send(json.dumps([2, str(uuid.uuid4()), "BootNotification", boot]))
+            await ws.recv()
+            await connected.wait()
+            for _ in range(n_frames):
+                await ws.send(json.dumps([2, str(uuid.uuid4()), "MeterValues", meter_payload]))
+                await ws.recv()
+
+    server = await websockets.serve(on_connect, "127.0.0.1", 0, subprotocols=["ocpp1.6"], max_queue=None)
+    port = server.sockets[0].getsockname()[1]
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(charger(f"CP_{i:05d}")) for i in range(n_chargers)]
+    await connected.wait()
+    t_connected = time.perf_counter() - t0
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    server.close()
+    await server.wait_closed()
+
+    messages = n_chargers * (n_frames + 1)
+    print(
+        f"chargers={n_chargers:5d} registered={len(registry):5d} "
+        f"connect_all={t_connected * 1000:8.1f} ms  "
+        f"frames={messages:7d} in {elapsed:6.2f} s = {messages / elapsed:8.0f} frames/s  "
+        f"mqtt_publishes={mqtt.published}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chargers", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--frames", type=int, default=20, help="MeterValues frames per charger")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger("ocpp").setLevel(logging.ERROR)
+    meter_payload = next(recorded_frames("MeterValues"))[3]
+    for n in args.chargers:
+        asyncio.run(run_fleet(n, args.frames, meter_payload))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Finds the fleet size where latency degrades: for each charger count, starts a MiniBroker
+and server.py (common.ServerProcess) and runs simulator.VirtualCharger fleets with
+accelerated rates, while publishing Home Assistant current-limit commands on the
+broker. Reports call latency percentiles per step and the end-to-end time from an MQTT
+command to the SetChargingProfile reaching the charger.
+
+    python bench/load_test_simulator.py --chargers 10 50 100 200 --duration 30
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import common  # noqa: F401  (sets up sys.path)
+from common import ServerProcess
+from mini_broker import MiniBroker
+from simulator import SimulationRates, SimulationStats, run_fleet
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else float("nan")
+
+
+async def send_commands(broker, stats, interval, stop, rng):
+    """
+    Publish a new current limit for a random charging charger every `interval` seconds.
+    """
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        charging = [cp_id for cp_id, c in stats.chargers.items() if c.status == "Charging"]
+        if not charging:
+            continue
+        cp_id = rng.choice(charging)
+        stats.pending_commands[(cp_id, "SetChargingProfile")] = time.monotonic()
+        broker.publish(f"ocpp/current_limit_{cp_id}/set", str(rng.randint(6, 16)))
+
+
+async def step(n, args):
+    broker = await MiniBroker().start()
+    rates = SimulationRates(heartbeat=args.heartbeat, meter=args.meter, idle=args.idle, session=args.session)
+    stats = SimulationStats()
+    stop = asyncio.Event()
+    try:
+        async with ServerProcess(broker.port) as server:
+            commands = asyncio.create_task(send_commands(broker, stats, args.command_interval, stop, random.Random(n)))
+            started = time.monotonic()
+            await run_fleet(f"ws://127.0.0.1:{server.port}", n, rates, args.duration, ramp=args.ramp, stats=stats)
+            elapsed = time.monotonic() - started
+            stop.set()
+            commands.cancel()
+    finally:
+        await broker.stop()
+    return stats, elapsed, broker.received
+
+
+async def main_async(args):
+    print(f"{'chargers':>8}{'calls/s':>9}{'errors':>8}{'MV p50':>9}{'MV p99':>9}{'HB p99':>9}"
+          f"{'cmd p50':>9}{'cmd p99':>9}{'mqtt/s':>9}   (latencies in ms)")
+    baseline = None
+    for n in args.chargers:
+        stats, elapsed, published = await step(n, args)
+        mv = stats.latency.get("MeterValues", [])
+        hb = stats.latency.get("Heartbeat", [])
+        cmd = stats.latency.get("mqtt->SetChargingProfile", [])
+        p99 = percentile(mv, 0.99)
+        print(f"{stats.connected:>8}{stats.calls() / elapsed:>9.0f}{sum(stats.errors.values()):>8}"
+              f"{percentile(mv, 0.5):>9.1f}{p99:>9.1f}{percentile(hb, 0.99):>9.1f}"
+              f"{percentile(cmd, 0.5):>9.1f}{percentile(cmd, 0.99):>9.1f}{published / elapsed:>9.0f}")
+        if baseline is None:
+            baseline = p99
+        elif p99 > args.degraded * baseline:
+            print(f"MeterValues p99 is {p99 / baseline:.1f}x the {args.chargers[0]}-charger baseline at {n} chargers")
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chargers", type=int, nargs="+", default=[10, 50, 100, 200, 400])
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--ramp", type=float, default=5)
+    parser.add_argument("--heartbeat", type=float, default=10)
+    parser.add_argument("--meter", type=float, default=2)
+    parser.add_argument("--idle", type=float, default=5)
+    parser.add_argument("--session", type=float, default=20)
+    parser.add_argument("--command-interval", type=float, default=0.5)
+    parser.add_argument("--degraded", type=float, default=5, help="Stop once MeterValues p99 exceeds this x baseline")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
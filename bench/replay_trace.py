@@ -0,0 +1,165 @@
+"""
+Deterministic replay of recorded OCPP traffic against server.py.
+
+Starts a MiniBroker and server.py (see common.ServerProcess), then drives one fake
+charger per recorded charge point (times --copies) over WebSocket. Each charger sends
+its recorded CALLs in order, one in flight at a time like a real charger, at the
+recorded pace divided by --speed (0 = as fast as the server answers). Calls from the
+server (SetChargingProfile, ...) get the response the charger recorded for that
+action, or {"status": "Accepted"}. Unique ids are deterministic (<cp>-<n>).
+
+Reports per-action latency percentiles and frames/s.
+
+    python bench/replay_trace.py                              # logs/ocpp_server.log, as fast as possible
+    python bench/replay_trace.py trace.jsonl --speed 1000 --copies 50
+    python bench/replay_trace.py --record replayed.jsonl     # server-side trace of the run
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import websockets
+
+from common import LOG_FILE, ServerProcess
+from mini_broker import MiniBroker
+from ocpp_trace import INBOUND, OUTBOUND, read_trace, trace_from_log
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def load(path):
+    """
+    Per charge point: list of (t, action, payload) CALLs it sent, and action -> response payload
+    it gave to server calls.
+    """
+    entries = list(read_trace(path) if path.endswith(".jsonl") else trace_from_log(path))
+    calls, responses, server_calls = {}, {}, {}
+    for t, cp_id, direction, message in entries:
+        try:
+            frame = json.loads(message)
+        except ValueError:
+            continue
+        if direction == INBOUND and frame[0] == 2:
+            calls.setdefault(cp_id, []).append((t, frame[2], frame[3]))
+        elif direction == OUTBOUND and frame[0] == 2:
+            server_calls[frame[1]] = frame[2]
+        elif direction == INBOUND and frame[0] == 3 and frame[1] in server_calls:
+            responses.setdefault(server_calls.pop(frame[1]), frame[2])
+    return calls, responses
+
+
+class FakeCharger:
+    def __init__(self, cp_id, url, calls, responses, speed, latency, timeout=30):
+        self.cp_id = cp_id
+        self.url = url
+        self.calls = calls
+        self.responses = responses
+        self.speed = speed
+        self.latency = latency
+        self.timeout = timeout
+        self._pending = {}
+        self.sent = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.server_calls = 0
+
+    async def run(self, start):
+        async with websockets.connect(f"{self.url}/{self.cp_id}", subprotocols=["ocpp1.6"], max_queue=None) as ws:
+            reader = asyncio.create_task(self._read(ws))
+            try:
+                base = self.calls[0][0] if self.calls else 0.0
+                for n, (t, action, payload) in enumerate(self.calls):
+                    if self.speed:
+                        delay = start + (t - base) / self.speed - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    await self._call(ws, f"{self.cp_id}-{n}", action, payload)
+            finally:
+                reader.cancel()
+
+    async def _call(self, ws, unique_id, action, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending[unique_id] = future
+        sent = time.monotonic()
+        await ws.send(json.dumps([2, unique_id, action, payload], separators=(",", ":")))
+        self.sent += 1
+        try:
+            frame = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+        finally:
+            self._pending.pop(unique_id, None)
+        self.latency.setdefault(action, []).append(time.monotonic() - sent)
+        if frame[0] == 4:
+            self.errors += 1
+
+    async def _read(self, ws):
+        async for message in ws:
+            frame = json.loads(message)
+            if frame[0] == 2:
+                # Server-initiated call: answer like the recorded charger did
+                self.server_calls += 1
+                payload = self.responses.get(frame[2], {"status": "Accepted"})
+                await ws.send(json.dumps([3, frame[1], payload], separators=(",", ":")))
+                continue
+            future = self._pending.get(frame[1])
+            if future is not None and not future.done():
+                future.set_result(frame)
+
+
+async def replay(args):
+    calls, responses = load(args.trace)
+    if args.limit:
+        calls = {cp_id: frames[:args.limit] for cp_id, frames in calls.items()}
+    broker = await MiniBroker().start()
+    latency = {}
+    try:
+        overrides = {"trace": {"file": os.path.abspath(args.record)}} if args.record else None
+        async with ServerProcess(broker.port, overrides) as server:
+            url = f"ws://127.0.0.1:{server.port}"
+            chargers = [
+                FakeCharger(cp_id if copies == 0 else f"{cp_id}_{copies}", url, frames, responses, args.speed, latency)
+                for cp_id, frames in calls.items()
+                for copies in range(args.copies)
+            ]
+            start = time.monotonic()
+            await asyncio.gather(*(charger.run(start) for charger in chargers))
+            elapsed = time.monotonic() - start
+    finally:
+        await broker.stop()
+
+    frames = sum(c.sent for c in chargers)
+    print(
+        f"{len(chargers)} chargers, {frames} calls in {elapsed:.2f} s = {frames / elapsed:,.0f} frames/s "
+        f"(speed {args.speed or 'max'}); {sum(c.errors for c in chargers)} CALLERRORs, "
+        f"{sum(c.timeouts for c in chargers)} timeouts, {sum(c.server_calls for c in chargers)} server calls answered, "
+        f"{broker.received} MQTT publishes"
+    )
+    print(f"  {'action':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, values in sorted(latency.items()):
+        values.sort()
+        print(
+            f"  {action:<22}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}"
+            f"{percentile(values, 0.95) * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}"
+            f"{values[-1] * 1000:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", nargs="?", default=LOG_FILE, help="Trace (.jsonl) or text server log")
+    parser.add_argument("--speed", type=float, default=0, help="Replay speed factor (0 = as fast as possible)")
+    parser.add_argument("--copies", type=int, default=1, help="Fake chargers per recorded charge point")
+    parser.add_argument("--limit", type=int, default=0, help="Only the first N calls per charger")
+    parser.add_argument("--record", help="Have the server record its own trace of the replay to this file")
+    args = parser.parse_args()
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Connection lifecycle soak test: thousands of connect/disconnect cycles against server.py
+with a MiniBroker. Each round, a pool of charger ids connects concurrently and leaves
+in one of four ways: clean close, TCP reset, going quiet (idle timeout) or a half-open
+socket that stops reading (WebSocket ping timeout). Some ids reconnect while their old
+connection is still open.
+
+After every round it reports the server's RSS and registry size from /metrics and checks
+that nothing is left registered or watched, and that every charger's connection topic
+ended up "offline" on the broker. Fails (exit 1) when RSS keeps growing after warm-up.
+
+    python bench/soak_lifecycle.py --rounds 20 --chargers 200
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import urllib.request
+
+import websockets
+
+import common  # noqa: F401  (sets up sys.path)
+from common import ServerProcess
+from mini_broker import MiniBroker
+
+BOOT = {"chargePointVendor": "Futurehome", "chargePointModel": "Charge"}
+MODES = ("close", "reset", "quiet", "half-open", "replaced")
+
+
+def metrics(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        values = {}
+        for line in response.read().decode().splitlines():
+            if line and not line.startswith("#"):
+                name, _, value = line.rpartition(" ")
+                values[name] = float(value)
+        return values
+
+
+def rss_mib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+
+async def call(ws, unique_id, action, payload):
+    await ws.send(json.dumps([2, unique_id, action, payload]))
+    return json.loads(await ws.recv())
+
+
+async def charger(url, cp_id, mode, rng, ramp):
+    await asyncio.sleep(rng.uniform(0, ramp))
+    ws = await websockets.connect(f"{url}/{cp_id}", subprotocols=["ocpp1.6"], ping_interval=None)
+    await call(ws, "1", "BootNotification", BOOT)
+    await call(ws, "2", "StatusNotification", {"connectorId": 1, "errorCode": "NoError", "status": "Available"})
+    for i in range(rng.randint(1, 5)):
+        await call(ws, f"mv{i}", "MeterValues", {"connectorId": 1, "meterValue": [{
+            "timestamp": "2024-01-01T00:00:00Z",
+            "sampledValue": [{"value": str(rng.uniform(0, 11000)), "measurand": "Power.Active.Import", "unit": "W"}],
+        }]})
+        await call(ws, f"hb{i}", "Heartbeat", {})
+    if mode == "close":
+        await ws.close()
+    elif mode == "reset":
+        ws.transport.abort()
+    elif mode == "quiet":
+        # Answers pings but sends nothing: the idle timeout closes it
+        await ws.wait_closed()
+    elif mode == "half-open":
+        # Stops reading and never answers pings, like a charger whose link dropped
+        ws.transport.pause_reading()
+        await asyncio.sleep(3600)
+    elif mode == "replaced":
+        # Reconnects while the old socket is still open; the server closes the old one
+        second = await websockets.connect(f"{url}/{cp_id}", subprotocols=["ocpp1.6"], ping_interval=None)
+        await call(second, "1", "BootNotification", BOOT)
+        await ws.wait_closed()
+        await second.close()
+
+
+async def wait_drained(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        values = metrics(port)
+        if not values.get("ocpp_registered_chargers") and not values.get("ocpp_liveness_watched") \
+                and not values.get("ocpp_connected_chargers"):
+            return values
+        await asyncio.sleep(0.2)
+    return metrics(port)
+
+
+async def soak(args):
+    broker = await MiniBroker().start()
+    overrides = {"ocpp": {"idle_timeout": args.idle_timeout, "ping_interval": 2, "ping_timeout": 2}}
+    rng = random.Random(1)
+    failed = False
+    rows = []
+    try:
+        async with ServerProcess(broker.port, overrides) as server:
+            url = f"ws://127.0.0.1:{server.port}"
+            print(f"  {'round':>5}{'cycles':>8}{'secs':>6}{'rss MiB':>9}{'registered':>12}{'watched':>9}"
+                  f"{'idle closed':>13}{'online':>8}")
+            cycles = 0
+            for round_ in range(1, args.rounds + 1):
+                started = time.monotonic()
+                tasks = [
+                    asyncio.create_task(charger(url, f"CP_{i:04d}", MODES[(i + round_) % len(MODES)], rng, args.ramp))
+                    for i in range(args.chargers)
+                ]
+                # Everything but the half-open chargers finishes by itself
+                finishing = [task for i, task in enumerate(tasks) if MODES[(i + round_) % len(MODES)] != "half-open"]
+                await asyncio.wait(finishing, timeout=args.ramp + args.idle_timeout + 30)
+                values = await wait_drained(server.port, 30)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                cycles += args.chargers
+                # The last "offline" publishes may still be on their way to the broker
+                for _ in range(50):
+                    online = sum(1 for topic, payload in broker.retained.items()
+                                 if topic.startswith("ocpp/connection_") and payload != b"offline")
+                    if not online:
+                        break
+                    await asyncio.sleep(0.1)
+                rss = rss_mib(server.process.pid)
+                rows.append(rss)
+                registered = values.get("ocpp_registered_chargers", 0)
+                watched = values.get("ocpp_liveness_watched", 0)
+                print(f"  {round_:>5}{cycles:>8}{time.monotonic() - started:>6.1f}{rss:>9.1f}{registered:>12.0f}"
+                      f"{watched:>9.0f}{values.get('ocpp_idle_closed_total', 0):>13.0f}{online:>8}")
+                if registered or watched or online:
+                    failed = True
+    finally:
+        await broker.stop()
+    # Flat memory: per-charger state (discovery, meter history, last published values)
+    # exists once per id and every id has gone through every mode by half time, so the
+    # second half must not grow beyond allocator noise
+    warm = rows[len(rows) // 2]
+    growth = rows[-1] - warm
+    print(f"RSS at half time {warm:.1f} MiB, at the end {rows[-1]:.1f} MiB ({growth:+.1f} MiB)")
+    if growth > args.max_growth:
+        failed = True
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--chargers", type=int, default=200)
+    parser.add_argument("--idle-timeout", type=float, default=10)
+    parser.add_argument("--ramp", type=float, default=3, help="spread connects over this many seconds")
+    parser.add_argument("--max-growth", type=float, default=5.0, help="allowed RSS growth after warm-up, MiB")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(soak(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import logging
+from urllib.parse import unquote, urlsplit
+from mqtt_commands import command_table
+
+
+def charge_point_id_from_path(path, default=None):
+    """
+    Derive the charge point id from the WebSocket request path.
+
+    Chargers connect to ws://host:9000/<cp_id>, so the last path segment is the id.
+    Falls back to `default` when the charger connects to the bare root.
+    """
+    if not path:
+        return default
+    segments = [s for s in urlsplit(path).path.split("/") if s]
+    if not segments:
+        return default
+    return unquote(segments[-1])
+
+
+def valid_charge_point_id(cp_id):
+    """
+    True if `cp_id` can be used in MQTT topics and metric labels: not empty, and no
+    MQTT wildcards, topic separators or control characters.
+    """
+    if not cp_id or not cp_id.strip():
+        return False
+    return not any(c in "+#/" or ord(c) < 32 or ord(c) == 127 for c in cp_id)
+
+
+def request_path(websocket):
+    """
+    Return the HTTP request path of a WebSocket connection (new and legacy websockets APIs).
+    """
+    request = getattr(websocket, "request", None)
+    if request is not None and getattr(request, "path", None):
+        return request.path
+    return getattr(websocket, "path", None)
+
+
+class ChargePointRegistry:
+    """
+    Registry of connected charge points keyed by charge point id.
+
+    Also holds the MQTT command dispatch table: every @command of a registered
+    charge point under its full topic, so routing a command is one dict lookup.
+    """
+
+    def __init__(self):
+        self._charge_points = {}
+        # "<command>_<cp_id>/<verb>" -> mqtt_commands.CommandRoute
+        self._commands = {}
+        # cp_id -> topics of its entries in _commands
+        self._command_topics = {}
+
+    def register(self, charge_point):
+        previous = self._charge_points.get(charge_point.id)
+        if previous is not None and previous is not charge_point:
+            logging.warning(f"{charge_point.id}: replacing existing connection in registry")
+            self._remove_commands(charge_point.id)
+        self._charge_points[charge_point.id] = charge_point
+        table = command_table(charge_point)
+        self._commands.update(table)
+        self._command_topics[charge_point.id] = list(table)
+        return previous
+
+    def unregister(self, charge_point):
+        # Only remove the entry if it still points at this instance; a reconnect
+        # may already have replaced it with a newer connection.
+        if self._charge_points.get(charge_point.id) is charge_point:
+            del self._charge_points[charge_point.id]
+            self._remove_commands(charge_point.id)
+            return True
+        return False
+
+    def _remove_commands(self, cp_id):
+        for topic in self._command_topics.pop(cp_id, ()):
+            self._commands.pop(topic, None)
+
+    def get(self, cp_id):
+        return self._charge_points.get(cp_id)
+
+    def route_command(self, topic):
+        """
+        Resolve an MQTT command topic (without the "ocpp/" prefix) to its handler.
+
+        Returns the mqtt_commands.CommandRoute or None if no connected charger has that command.
+        """
+        return self._commands.get(topic)
+
+    def __contains__(self, cp_id):
+        return cp_id in self._charge_points
+
+    def __iter__(self):
+        return iter(list(self._charge_points.values()))
+
+    def __len__(self):
+        return len(self._charge_points)
@@ -0,0 +1,54 @@
+import decimal
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON for OCPP frames and MQTT payloads: orjson when it is installed, the stdlib
+# otherwise (OCPP_JSON=json or use("json") forces the stdlib). Both backends give
+# compact output without ASCII escaping and encode Decimal as float.
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def _orjson_dumpb(obj, sort_keys=False):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+def _orjson_dumps(obj, sort_keys=False):
+    return _orjson_dumpb(obj, sort_keys).decode("utf-8")
+
+
+def _json_dumps(obj, sort_keys=False):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=sort_keys, default=_default)
+
+
+def _json_dumpb(obj, sort_keys=False):
+    return _json_dumps(obj, sort_keys).encode("utf-8")
+
+
+def use(backend):
+    """
+    Switch the backend ("orjson" or "json") for the whole process.
+    """
+    global BACKEND, dumps, dumpb, loads
+    if backend == "orjson" and orjson is not None:
+        dumps, dumpb, loads = _orjson_dumps, _orjson_dumpb, orjson.loads
+    elif backend in ("json", "orjson"):
+        backend = "json"
+        dumps, dumpb, loads = _json_dumps, _json_dumpb, json.loads
+    else:
+        raise ValueError(f"Unknown JSON backend {backend!r}")
+    BACKEND = backend
+
+
+# dumps(obj, sort_keys=False) -> str, dumpb(obj, sort_keys=False) -> bytes, loads(str or bytes);
+# loads raises ValueError on invalid input with both backends
+use(os.environ.get("OCPP_JSON", "orjson"))
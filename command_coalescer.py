@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+
+
+class CommandCoalescer:
+    """
+    Per-charger coalescing of idempotent "last value wins" commands.
+
+    Each command key (current limit, suspend, availability) keeps only its latest
+    value. Values are applied once no new command arrived for `settle` seconds (or
+    after `max_delay` at the latest while commands keep coming), one at a time, so
+    there is never more than one charger update in flight.
+    """
+
+    def __init__(self, name, settle=0.3, max_delay=2.0):
+        self.name = name
+        self.settle = settle
+        self.max_delay = max_delay
+        # key -> (value, apply); dict order is the order keys were (re)submitted
+        self._latest = {}
+        self._first_submit = None
+        self._last_submit = None
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self.submitted = 0
+        self.applied = 0
+
+    @property
+    def collapsed(self):
+        return self.submitted - self.applied - len(self._latest)
+
+    def submit(self, key, value, apply):
+        """
+        Queue `apply(value)` (a coroutine function) for `key`, replacing any pending value.
+        """
+        now = time.monotonic()
+        self.submitted += 1
+        self._latest.pop(key, None)
+        self._latest[key] = (value, apply)
+        if self._first_submit is None:
+            self._first_submit = now
+        self._last_submit = now
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while not self._latest:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # Wait for the burst to settle
+            while True:
+                deadline = min(self._last_submit + self.settle, self._first_submit + self.max_delay)
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            pending, self._latest = self._latest, {}
+            self._first_submit = None
+            for key, (value, apply) in pending.items():
+                self.applied += 1
+                try:
+                    await apply(value)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.exception(f"{self.name}: applying {key}={value} failed: {e}")
+            logging.info(f"{self.name}: applied {len(pending)} command(s), {self.collapsed} collapsed so far")
+
+    def cancel(self):
+        self._latest.clear()
+        self._first_submit = None
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from types import MappingProxyType
+
+
+def freeze(value):
+    """
+    Return a read-only copy of a parsed JSON value (dicts become mapping proxies, lists tuples).
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, MappingProxyType):
+        items = {}
+        for k, v in value.items():
+            items.update(_flatten(v, f"{prefix}{k}."))
+        return items
+    return {prefix[:-1]: value}
+
+
+def changed_fields(old, new):
+    """
+    Dotted paths (e.g. "ev.min_current") whose value differs between two snapshots.
+    """
+    old_flat, new_flat = _flatten(old), _flatten(new)
+    return sorted(k for k in old_flat.keys() | new_flat.keys() if old_flat.get(k) != new_flat.get(k))
+
+
+class ConfigManager:
+    """
+    Holds an immutable snapshot of config.json and reloads it when the file changes.
+
+    The file is stat()ed at most once per `check_interval` seconds and only re-parsed
+    when its mtime, inode or size changed. Listeners are called on the event loop with
+    (snapshot, changed_fields) after a successful reload.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._listeners = []
+        self._last_check = time.monotonic()
+        self._stat_key = self._stat()
+        self.snapshot = self._load()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _load(self):
+        with open(self.path) as f:
+            return freeze(json.load(f))
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def check(self):
+        """
+        Reload the snapshot if the file changed. Returns the list of changed fields.
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return []
+        self._last_check = now
+        stat_key = self._stat()
+        if stat_key is None or stat_key == self._stat_key:
+            return []
+        self._stat_key = stat_key
+        try:
+            snapshot = self._load()
+        except (OSError, ValueError) as e:
+            # Editors may leave a half-written file behind; keep the old snapshot
+            logging.error(f"Failed to reload {self.path}, keeping previous config: {e}")
+            return []
+        changed = changed_fields(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        if changed:
+            logging.info(f"Reloaded {self.path}, changed: {', '.join(changed)}")
+            for callback in self._listeners:
+                try:
+                    callback(snapshot, changed)
+                except Exception as e:
+                    logging.exception(f"Exception in config listener: {e}")
+        return changed
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.check()
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+import codec
+
+# Home Assistant publishes "online" here when it (re)starts; discovery must be resent then.
+HA_STATUS_TOPIC = "homeassistant/status"
+
+# Sent along with device-based discovery configs
+ORIGIN = {"name": "FH_CHARGE-OCPP-server"}
+
+
+class DiscoveryRegistry:
+    """
+    Remembers which Home Assistant discovery configs were already announced.
+
+    A config is published on first sight of its unique_id or when its serialized
+    content changes. `republish_all` resends everything after a broker or HA restart.
+
+    Announcing the very same dict object again is a no-op without serializing it:
+    callers keep constant configs around and must not mutate one after announcing it.
+
+    Charge points add their entities through `device(id, availability)`, which
+    bundles them into one config per charger ("device" mode, HA 2024.11+) or
+    announces them one by one ("entity" mode, older HA).
+    """
+
+    def __init__(self, mqtt_client, mode="device", migrate=None):
+        self.mqtt_client = mqtt_client
+        self.mode = mode
+        # Move entities announced per entity by an older version over to the device config;
+        # on by default in device mode, otherwise an upgrade shows every entity twice
+        self.migrate = mode == "device" if migrate is None else migrate
+        # unique_id (config topic for device configs) -> (config_topic, serialized payload, payload object)
+        self._entries = {}
+        # device id -> DeviceDiscovery
+        self._devices = {}
+        # announce() runs on the event loop, republish_all() from the paho thread
+        self._lock = threading.Lock()
+        self.published = 0
+        self.skipped = 0
+
+    def device(self, device_id, availability):
+        """
+        The DeviceDiscovery of a charger; kept across reconnects so nothing is rebuilt.
+        """
+        device = self._devices.get(device_id)
+        if device is None:
+            device = self._devices[device_id] = DeviceDiscovery(self, device_id, availability, self.mode)
+        return device
+
+    def announce(self, config_topic, config_payload, key=None):
+        """
+        Publish a discovery config unless the identical config was already sent.
+
+        `key` defaults to the config's unique_id. Returns True if a message was published.
+        """
+        unique_id = key or config_payload["unique_id"]
+        entry = self._entries.get(unique_id)
+        if entry is not None and entry[2] is config_payload and entry[0] == config_topic:
+            self.skipped += 1
+            return False
+        serialized = codec.dumpb(config_payload, sort_keys=True)
+        with self._lock:
+            entry = self._entries.get(unique_id)
+            if entry is not None and entry[0] == config_topic and entry[1] == serialized:
+                # Same content in a new object: remember it for the fast path
+                self._entries[unique_id] = (config_topic, serialized, config_payload)
+                self.skipped += 1
+                return False
+            self._entries[unique_id] = (config_topic, serialized, config_payload)
+            self.published += 1
+        self.mqtt_client.publish(config_topic, serialized)
+        return True
+
+    def forget(self, unique_id):
+        with self._lock:
+            self._entries.pop(unique_id, None)
+
+    def republish_all(self):
+        """
+        Resend every known discovery config (HA birth message or broker reconnect).
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self.published += len(entries)
+        logging.info(f"Republishing {len(entries)} Home Assistant discovery configs")
+        for config_topic, serialized, _ in entries:
+            self.mqtt_client.publish(config_topic, serialized)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DeviceDiscovery:
+    """
+    Discovery builder for one charger.
+
+    In "device" mode every entity becomes a component of one retained
+    homeassistant/device/<id>/config message carrying the device, origin and
+    availability once. Adding an entity that is already there (same object, or an
+    equal config) costs a lookup; a new or changed entity rebuilds and serializes the
+    bundle once per event loop iteration, so a charger's first MeterValues with a
+    dozen new sensors is still one publish.
+
+    In "entity" mode each entity gets its own homeassistant/<platform>/<unique_id>/config
+    with the device and availability blocks merged in, for HA before 2024.11.
+    """
+
+    def __init__(self, registry, device_id, availability, mode="device"):
+        self.registry = registry
+        self.device_id = device_id
+        self.mode = mode
+        self.device = {"identifiers": [device_id], "name": device_id, "manufacturer": "OCPP Charger"}
+        # [{"topic": ...}, ...], shared by all entities unless one brings its own
+        self.availability = availability
+        self.config_topic = f"homeassistant/device/{device_id}/config"
+        # unique_id -> (platform, config)
+        self._components = {}
+        # Components whose per-entity topic still has to be migrated (registry.migrate)
+        self._migrating = []
+        self._scheduled = False
+        self.rebuilt = 0
+
+    def add(self, platform, config):
+        """
+        Add or update an entity; callers must not mutate `config` afterwards.
+        """
+        unique_id = config["unique_id"]
+        entry = self._components.get(unique_id)
+        if entry is not None and entry[1] is config:
+            return
+        if entry is not None and entry == (platform, config):
+            # Equal content in a new object: remember it for the fast path
+            self._components[unique_id] = (platform, config)
+            return
+        self._components[unique_id] = (platform, config)
+        if self.mode == "entity":
+            self.registry.announce(self.entity_topic(platform, unique_id), self.entity_payload(config))
+            return
+        if entry is None and self.registry.migrate:
+            self._migrating.append((platform, unique_id))
+        self._schedule()
+
+    def entity_topic(self, platform, unique_id):
+        return f"homeassistant/{platform}/{unique_id}/config"
+
+    def entity_payload(self, config):
+        payload = {**config, "device": self.device}
+        if "availability" not in config:
+            payload["availability"] = self.availability
+            payload["availability_mode"] = "all"
+        return payload
+
+    def payload(self):
+        return {
+            "device": self.device,
+            "origin": ORIGIN,
+            "availability": self.availability,
+            "availability_mode": "all",
+            "components": {
+                unique_id: {"platform": platform, **config}
+                for unique_id, (platform, config) in self._components.items()
+            },
+        }
+
+    def _schedule(self):
+        if self._scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._scheduled = True
+        loop.call_soon(self.flush)
+
+    def flush(self):
+        """
+        Publish the device config if its components changed since the last flush.
+        """
+        self._scheduled = False
+        migrating, self._migrating = self._migrating, []
+        mqtt_client = self.registry.mqtt_client
+        # HA's documented migration: tell the old entity config it moves, then publish the
+        # device config, then clear the old retained topic
+        for platform, unique_id in migrating:
+            mqtt_client.publish(self.entity_topic(platform, unique_id), {"migrate_discovery": True})
+        if self.registry.announce(self.config_topic, self.payload(), key=self.config_topic):
+            self.rebuilt += 1
+        for platform, unique_id in migrating:
+            mqtt_client.publish(self.entity_topic(platform, unique_id), b"")
+
+    def __len__(self):
+        return len(self._components)
@@ -0,0 +1,166 @@
+import time
+from array import array
+
+HOUR = 3600
+
+
+class TariffTable:
+    """
+    Time-of-use energy prices per hour of the week, in local time.
+
+    Config: {"currency": "EUR", "price": 0.30,
+             "periods": [{"from": 7, "to": 23, "price": 0.35, "days": [0, 1, 2, 3, 4]}]}
+    Periods are whole hours with `to` exclusive and may wrap past midnight; days are
+    0=Monday (default: every day). Later periods win where they overlap, `price`
+    applies everywhere else. Prices are per kWh.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.currency = config.get("currency", "EUR")
+        self.prices = array("d", [float(config.get("price", 0.0))] * 168)
+        for period in config.get("periods", ()):
+            start, end = int(period["from"]) % 24, int(period["to"]) % 24
+            if start < end:
+                hours = range(start, end)
+            else:
+                hours = list(range(start, 24)) + list(range(0, end))
+            for day in period.get("days", range(7)):
+                for hour in hours:
+                    self.prices[day * 24 + hour] = float(period["price"])
+        # hour index (epoch // 3600) -> hour of the week; local time needs a lookup per hour
+        self._slots = {}
+
+    def slot(self, hour):
+        slot = self._slots.get(hour)
+        if slot is None:
+            if len(self._slots) > 100000:
+                self._slots.clear()
+            t = time.localtime(hour * HOUR)
+            slot = self._slots[hour] = t.tm_wday * 24 + t.tm_hour
+        return slot
+
+    def price(self, ts):
+        return self.prices[self.slot(int(ts // HOUR))]
+
+    def cost(self, hours, energy_wh):
+        """
+        Cost of `energy_wh[i]` consumed in hour bucket `hours[i]`, in one pass over both columns.
+        """
+        prices = self.prices
+        slot = self.slot
+        return sum(wh * prices[slot(hour)] for hour, wh in zip(hours, energy_wh)) / 1000
+
+
+class SessionEnergy:
+    """
+    Energy of one charging session from the cumulative Energy.Active.Import.Register.
+
+    The delta between consecutive readings is spread evenly over the time between
+    them and split at hour boundaries, so energy reported after a gap still lands in
+    the right hours. A reading below the previous one is a register reset (meter
+    rebooted to 0): the new reading counts as energy since the reset when that is
+    plausible. A jump needing more than `max_power` W is a glitch and only rebases.
+    """
+
+    def __init__(self, transaction_id=None, max_power=50000.0, gap=900.0):
+        self.transaction_id = transaction_id
+        self.max_power = max_power
+        self.gap = gap
+        self.last_ts = None
+        self.last_wh = None
+        # hour index (epoch // 3600) -> Wh
+        self.hourly = {}
+        self.energy_wh = 0.0
+        self.readings = 0
+        self.resets = 0
+        self.glitches = 0
+        self.gaps = 0
+
+    @property
+    def kwh(self):
+        return self.energy_wh / 1000
+
+    def feed(self, timestamps, readings):
+        """
+        Integrate parallel columns of register readings (epoch seconds, Wh), oldest first.
+
+        Returns the Wh added.
+        """
+        last_ts, last_wh = self.last_ts, self.last_wh
+        hourly = self.hourly
+        max_rate = self.max_power / HOUR  # Wh per second
+        gap = self.gap
+        added = 0.0
+        n = 0
+        for ts, wh in zip(timestamps, readings):
+            n += 1
+            if last_ts is None:
+                last_ts, last_wh = ts, wh
+                continue
+            dt = ts - last_ts
+            if dt <= 0:
+                continue  # duplicate or out of order
+            delta = wh - last_wh
+            if delta < 0:
+                self.resets += 1
+                delta = wh if wh <= max_rate * dt else 0.0
+            elif delta > max_rate * dt:
+                self.glitches += 1
+                delta = 0.0
+            if dt > gap:
+                self.gaps += 1
+            if delta:
+                added += delta
+                hour = int(last_ts // HOUR)
+                if int(ts // HOUR) == hour:
+                    hourly[hour] = hourly.get(hour, 0.0) + delta
+                else:
+                    self._spread(last_ts, ts, delta)
+            last_ts, last_wh = ts, wh
+        self.last_ts, self.last_wh = last_ts, last_wh
+        self.energy_wh += added
+        self.readings += n
+        return added
+
+    def _spread(self, t0, t1, delta):
+        rate = delta / (t1 - t0)
+        hourly = self.hourly
+        t = t0
+        while t < t1:
+            hour = int(t // HOUR)
+            end = min(t1, (hour + 1) * HOUR)
+            hourly[hour] = hourly.get(hour, 0.0) + rate * (end - t)
+            t = end
+
+    def hourly_kwh(self):
+        """
+        [(hour start epoch, kWh)] in time order.
+        """
+        return [(hour * HOUR, wh / 1000) for hour, wh in sorted(self.hourly.items())]
+
+    def cost(self, tariff):
+        return tariff.cost(self.hourly.keys(), self.hourly.values())
+
+    def stats(self):
+        return {
+            "transaction_id": self.transaction_id,
+            "kwh": round(self.kwh, 3),
+            "hours": len(self.hourly),
+            "readings": self.readings,
+            "resets": self.resets,
+            "glitches": self.glitches,
+            "gaps": self.gaps,
+        }
+
+
+def backfill(timestamps, readings, tariff=None, max_power=50000.0):
+    """
+    Account a historical register stream (e.g. months of recorded MeterValues).
+
+    Takes parallel columns (arrays, lists or iterators). Returns the SessionEnergy,
+    and its cost when a tariff is given.
+    """
+    energy = SessionEnergy(max_power=max_power)
+    energy.feed(timestamps, readings)
+    return energy, (energy.cost(tariff) if tariff is not None else None)
@@ -1,57 +1,271 @@
 import logging
-import json
-from datetime import datetime
 from ocpp.v16 import ChargePoint as cp
 from ocpp.v16 import call_result
-from ocpp.v16 import call
-from ocpp.messages import Call
-import uuid
-from ocpp.routing import on
-import traceback
+from ocpp.messages import Call, CallError, CallResult, MessageType
+from ocpp.exceptions import FormatViolationError, OCPPError, PropertyConstraintViolationError, ProtocolError
+from ocpp.exceptions import NotImplementedError as OCPPNotImplementedError
+from ocpp.routing import on, after
 from datetime import datetime, timezone
-import asyncio
+import math
+import time
+import codec
+from mqtt_client import PRIORITY_COMMAND, PRIORITY_METER, SERVER_STATUS_TOPIC
+from state_publisher import StatePublisher
+from session_store import SessionStore
+from action_scheduler import ActionScheduler
+from command_coalescer import CommandCoalescer
+from outbound_calls import OutboundCallManager, RetryPolicy
+from timeseries import MeterHistory, parse_timestamp
+from energy_accounting import SessionEnergy, TariffTable
+from ocpp_trace import INBOUND, OUTBOUND
+from validation_policy import ValidationPolicy
+from mqtt_commands import command
+
+
+# Map OCPP measurands (normalized) to Home Assistant device classes
+DEVICE_CLASSES = {
+    "voltage": "voltage",
+    "current_import": "current",
+    "current_offered": "current",
+    "power_active_import": "power",
+    "energy_active_import_register": "energy",
+    "frequency": "frequency",
+    "temperature": "temperature",
+    "soc": "battery",
+}
+
+# Measurands read as numbers on every MeterValues: site load manager and energy accounting
+NUMERIC_MEASURANDS = frozenset(("current_import", "current_offered", "energy_active_import_register"))
+
+
+def connection_topic(device_id):
+    # "online" while the charger's WebSocket is up, "offline" after it closed or went quiet
+    return f"ocpp/connection_{device_id}"
+
+
+def availability(device_id):
+    """
+    HA availability of a charger's entities: available only while the charger is
+    connected and this server is connected to the broker.
+    """
+    return [{"topic": connection_topic(device_id)}, {"topic": SERVER_STATUS_TOPIC}]
+
+
+class SensorDescriptor:
+    """
+    Precomputed names and topics for one meter sensor of a charge point.
+    """
+    __slots__ = ("sensor_name", "state_topic", "unique_id", "name", "unit",
+                 "device_id", "measurand", "device_class", "state_class")
+
+    def __init__(self, device_id, measurand, sensor_name, unit, device_class, state_class):
+        self.device_id = device_id
+        self.measurand = measurand
+        self.sensor_name = sensor_name
+        self.state_topic = f"ocpp/meter_{device_id}_{sensor_name}"
+        self.unique_id = f"{device_id}_{sensor_name}"
+        self.name = f"{device_id} {sensor_name}"
+        self.unit = unit
+        self.device_class = device_class
+        self.state_class = state_class
+
+    def config_payload(self):
+        return {
+            "name": self.name,
+            "state_topic": self.state_topic,
+            "unique_id": self.unique_id,
+            "unit_of_measurement": self.unit,
+            "device_class": self.device_class,
+            "state_class": self.state_class,
+            "force_update": True
+        }
+
+
+MESSAGE_TYPES = {cls.message_type_id: cls for cls in (Call, CallResult, CallError)}
+
+
+def _unpack(raw):
+    """
+    ocpp.messages.unpack on top of codec.loads (orjson when installed).
+    """
+    try:
+        frame = codec.loads(raw)
+    except ValueError:
+        raise FormatViolationError(details={"cause": "Message is not valid JSON", "ocpp_message": raw})
+    if not isinstance(frame, list) or not frame:
+        raise ProtocolError(details={"cause": f"OCPP message should be a non-empty list, got {type(frame)}"})
+    cls = MESSAGE_TYPES.get(frame[0]) if isinstance(frame[0], int) else None
+    if cls is None:
+        raise PropertyConstraintViolationError(details={"cause": f"MessageTypeId '{frame[0]}' isn't valid"})
+    try:
+        return cls(*frame[1:])
+    except TypeError:
+        raise ProtocolError(details={"cause": "Message is missing elements."})
 
 
+def _frame_action(msg, route_map):
+    # Action of a CALL without parsing the whole frame: [2,"<unique id>","<Action>",{...}];
+    # responses to our own calls count as CALLRESULT/CALLERROR. The action is a metric
+    # label, so anything the charger makes up counts as "unknown"
+    parts = msg[:200].split('"', 4)
+    head = parts[0].lstrip("[ ")[:1]
+    if head == "2" and len(parts) > 4:
+        return parts[3] if parts[3] in route_map else "unknown"
+    return {"3": "CALLRESULT", "4": "CALLERROR"}.get(head, "invalid")
+
 
 class EVChargePoint(cp):
 
 
-    def __init__(self, id, websocket, mqtt_client, config):
+    def __init__(self, id, websocket, mqtt_client, config, state_publisher=None, session_store=None,
+                 load_manager=None, history=None, tracer=None, metrics=None, liveness=None):
         super().__init__(id, websocket)
         self.mqtt_client = mqtt_client
+        # Suppresses unchanged retained state; shared across the fleet when passed in
+        self.state_publisher = state_publisher or StatePublisher(mqtt_client, config.get("state_publisher"))
         self.status = "init"  # Default initial status
         self.idTag = "it's ok"
+        # Durable per-charger sessions; an in-memory store when none is shared
+        self.session_store = session_store or SessionStore(":memory:")
         self.current_transaction_id = None
         self.config = config
         self.minimum_current_ev = config["ev"]["min_current"]
         self.maximum_current_charger = 32  # Assuming a max current of 32A for the charger
         self.maximum_current_now = 16  # Default selected max current, set by HA 
+        # Site-level allocation (SiteLoadManager); None when no site budget is configured
+        self.load_manager = load_manager
+        self.site_limit = None
         self.last_charging_start = None
+        # Follow-up CSMS calls that run after a response was sent
+        self.scheduler = ActionScheduler(id)
+        # Collapses bursts of HA commands (slider drags) into one charger update
+        command_config = config.get("commands", {})
+        self.coalescer = CommandCoalescer(id, command_config.get("settle", 0.3), command_config.get("max_delay", 2.0))
+        # CSMS-initiated calls with response correlation, timeouts and retries
+        ocpp_config = config["ocpp"]
+        # Fleet-wide metrics.ServerMetrics for /metrics; None outside server.py
+        self.metrics = metrics
+        # Fleet-wide liveness.LivenessMonitor, told about every inbound frame
+        self.liveness = liveness
+        self.outbound = OutboundCallManager(
+            self,
+            timeout=ocpp_config.get("call_timeout", 30),
+            retry_policy=RetryPolicy(attempts=ocpp_config.get("call_attempts", 1)),
+            on_timeout=metrics.outbound_timeout if metrics is not None else None,
+        )
+        # (measurand, phase, location, unit) -> SensorDescriptor
+        self._sensor_descriptors = {}
+        # Sensors that sent a non-numeric reading (warned once)
+        self._bad_samples = set()
+        # Power/energy history; passed in so it survives reconnects
+        self.history = history if history is not None else MeterHistory(config.get("timeseries"))
+        # Energy and cost of the running session, from the energy register
+        self.accounting_config = config.get("accounting", {})
+        self.tariff = TariffTable(self.accounting_config.get("tariff"))
+        self.session_energy = None
+        # Optional ocpp_trace.TraceRecorder capturing every frame in and out
+        self.tracer = tracer
+        # action -> extra= for per-frame log records (see log_setup.ActionSampler)
+        self._log_tags = {}
+        # All HA entities of this charger, published as one device config (or per entity)
+        self.discovery = mqtt_client.discovery.device(id, availability(id))
+        # unique_id -> discovery config that is constant for this charger
+        self._discovery_configs = {}
+        # Schema validation of inbound calls: full, sampled or off for this charger
+        self.validation = ValidationPolicy.from_config(config.get("validation"), id)
         
+    def _log_tag(self, action):
+        # Tags a record with its frame so log sampling keeps or drops it with the raw frame
+        tag = self._log_tags.get(action)
+        if tag is None:
+            tag = self._log_tags[action] = {"action": action, "charge_point": self.id}
+        return tag
+
+    def apply_config(self, config, changed=()):
+        """
+        Take over a reloaded config snapshot (see ConfigManager).
+        """
+        self.config = config
+        self.minimum_current_ev = config["ev"]["min_current"]
+        self.accounting_config = config.get("accounting", {})
+        self.tariff = TariffTable(self.accounting_config.get("tariff"))
+        if any(field.startswith("validation.") for field in changed):
+            self.validation = ValidationPolicy.from_config(config.get("validation"), self.id)
+        if changed:
+            logging.info(f"{self.id}: config updated ({', '.join(changed)})")
+
     def publish_last_charging_start_sensor(self):
         """
         Publish Home Assistant MQTT discovery and state for last_charging_start as a sensor.
         """
         device_id = self.id
         unique_id = f"{device_id}_last_charging_start"
-        config_topic = f"homeassistant/sensor/{unique_id}/config"
         state_topic = f"ocpp/last_charging_start_{device_id}"
         config_payload = {
             "name": f"{device_id} Last Charging Start",
             "state_topic": state_topic,
             "unique_id": unique_id,
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
             "icon": "mdi:clock-start",
             "device_class": "timestamp"
         }
-        self.mqtt_client.publish(config_topic, json.dumps(config_payload))
+        self.discovery.add("sensor", config_payload)
         # Publish initial state if available
         if self.last_charging_start:
             self.mqtt_client.publish(state_topic, self.last_charging_start)
+
+    def publish_session_energy_discovery(self):
+        """
+        Publish Home Assistant MQTT discovery for the session energy and cost sensors.
+        """
+        device_id = self.id
+        self.discovery.add("sensor", {
+            "name": f"{device_id} Session Energy",
+            "state_topic": f"ocpp/session_energy_{device_id}",
+            "unique_id": f"{device_id}_session_energy",
+            "unit_of_measurement": "kWh",
+            "device_class": "energy",
+            "state_class": "total_increasing",
+        })
+        self.discovery.add("sensor", {
+            "name": f"{device_id} Session Cost",
+            "state_topic": f"ocpp/session_cost_{device_id}",
+            "unique_id": f"{device_id}_session_cost",
+            "unit_of_measurement": self.tariff.currency,
+            "device_class": "monetary",
+            "state_class": "total",
+        })
+
+    def publish_session_energy(self):
+        energy = self.session_energy
+        if energy is None:
+            return
+        self.state_publisher.publish(f"ocpp/session_energy_{self.id}", round(energy.kwh, 3), priority=PRIORITY_METER)
+        self.state_publisher.publish(f"ocpp/session_cost_{self.id}", round(energy.cost(self.tariff), 2), priority=PRIORITY_METER)
+
+    def _start_session_energy(self, transaction_id, timestamp=None, meter_start=None):
+        energy = SessionEnergy(
+            transaction_id,
+            max_power=self.accounting_config.get("max_power", 50000.0),
+            gap=self.accounting_config.get("gap", 900.0),
+        )
+        if meter_start is not None:
+            energy.feed((parse_timestamp(timestamp),), (float(meter_start),))
+        self.session_energy = energy
+        return energy
+
+    def _account_energy(self, timestamp, wh):
+        energy = self.session_energy
+        if energy is None or energy.transaction_id != self.current_transaction_id:
+            if self.current_transaction_id is None:
+                return
+            # Restarted mid-session: continue from the stored start reading when there is one
+            session = self.session_store.active_transaction(self.id)
+            if session is not None and session.transaction_id == self.current_transaction_id:
+                energy = self._start_session_energy(session.transaction_id, session.start_time, session.meter_start)
+            else:
+                energy = self._start_session_energy(self.current_transaction_id)
+        energy.feed((timestamp,), (wh,))
+
     def publish_control_discovery(self):
 
         """
@@ -65,14 +279,9 @@ class EVChargePoint(cp):
             "command_topic": f"ocpp/availability_{device_id}/set",
             "state_topic": f"ocpp/availability_{device_id}/state",
             "unique_id": f"availability_{device_id}",
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
             "icon": "mdi:power-settings"
         }
-        self.mqtt_client.publish(f"homeassistant/switch/availability_{device_id}/config", json.dumps(availability_config))
+        self.discovery.add("switch", availability_config)
         self.mqtt_client.publish(f"ocpp/availability_{device_id}/state", "ON")
         # Suspend/Resume Charging (switch)
         suspend_config = {
@@ -80,15 +289,9 @@ class EVChargePoint(cp):
             "command_topic": f"ocpp/suspend_{device_id}/set",
             "state_topic": f"ocpp/suspend_{device_id}/state",
             "unique_id": f"suspend_{device_id}",
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
             "icon": "mdi:power"
         }
-        # Discovery topic uses homeassistant prefix
-        self.mqtt_client.publish(f"homeassistant/switch/suspend_{device_id}/config", json.dumps(suspend_config))
+        self.discovery.add("switch", suspend_config)
         # State topic uses ocpp prefix
         self.mqtt_client.publish(f"ocpp/suspend_{device_id}/state", False)
 
@@ -97,15 +300,10 @@ class EVChargePoint(cp):
             "name": f"{device_id} Unlock Cable",
             "command_topic": f"ocpp/unlock_cable_{device_id}/press",
             "unique_id": f"unlock_cable_{device_id}",
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
             "icon": "mdi:lock-open"
         }
-        # Discovery topic uses homeassistant/button for a stateless button
-        self.mqtt_client.publish(f"homeassistant/button/unlock_cable_{device_id}/config", json.dumps(unlock_button_config))
+        # A stateless button
+        self.discovery.add("button", unlock_button_config)
 
         # Set Current Limit (number)
         current_config = {
@@ -113,11 +311,6 @@ class EVChargePoint(cp):
             "command_topic": f"ocpp/current_limit_{device_id}/set",
             "state_topic": f"ocpp/current_limit_{device_id}/state",
             "unique_id": f"current_limit_{device_id}",
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
             "min": 6,
             "max": 32,
             "step": 1,
@@ -125,61 +318,116 @@ class EVChargePoint(cp):
             "unit_of_measurement": "A",
             "icon": "mdi:current-ac"
         }
-        self.mqtt_client.publish(f"homeassistant/number/current_limit_{device_id}/config", json.dumps(current_config))
+        self.discovery.add("number", current_config)
         # State topic uses ocpp prefix
         self.mqtt_client.publish(f"ocpp/current_limit_{device_id}/state", 16)
+
+    def publish_connection(self, online):
+        """
+        Publish whether the charger is connected; all its HA entities follow this availability.
+        """
+        if online:
+            self.discovery.add("binary_sensor", {
+                "name": f"{self.id} Connection",
+                "state_topic": connection_topic(self.id),
+                "unique_id": f"{self.id}_connection",
+                # Only the server's status: this entity has to show "offline" itself
+                "availability": [{"topic": SERVER_STATUS_TOPIC}],
+                "payload_on": "online",
+                "payload_off": "offline",
+                "device_class": "connectivity",
+            })
+        self.mqtt_client.publish(connection_topic(self.id), "online" if online else "offline", priority=PRIORITY_COMMAND)
+
+    async def start(self):
+        try:
+            await super().start()
+        finally:
+            # Connection dropped: pending follow-up calls have nowhere to go
+            self.scheduler.cancel_all()
+            self.coalescer.cancel()
+            self.release_site_allocation()
+            self.outbound.cancel_all()
+            for action, histogram in self.outbound.latency.items():
+                logging.info(f"{self.id}: {action} response time {histogram.summary()}")
+
+    async def _send(self, message):
+        if self.tracer is not None:
+            self.tracer.record(self.id, OUTBOUND, message)
+        await super()._send(message)
+
     async def route_message(self, msg):
+        if self.tracer is not None:
+            self.tracer.record(self.id, INBOUND, msg)
+        if self.liveness is not None:
+            self.liveness.seen(self)
+        if self.metrics is None:
+            return await self._route_message(msg)
+        started = time.perf_counter()
         try:
-            return await super().route_message(msg)
-        except NotImplementedError as e:
-            # Log the action that was not handled
-            import json
-            try:
-                action = json.loads(msg)[2]
-            except Exception:
-                action = "Unknown"
-            logging.warning(f"{self.id}: No handler registered for OCPP action: {action}")
-            raise
-    async def handle_mqtt_command(self, topic, payload, config):
-        logging.info(f"ENTER handle_mqtt_command: topic={topic}, payload={payload}")
+            return await self._route_message(msg)
+        finally:
+            self.metrics.observe_message(_frame_action(msg, self.route_map), time.perf_counter() - started)
+
+    async def _route_message(self, raw):
+        # ChargePoint.route_message, with the frame parsed once through codec
         try:
-            device_id = self.id
-            writeback = config.get("allow_writeback", False)
-            if topic == f"suspend_{device_id}/set":
-                if writeback:
-                    if payload == "ON":
-                        await self.suspend_charging()
-                    else:
-                        await self.resume_charging()
-                else:
-                    logging.info("Writeback disabled: suspend charging command ignored.")
-            elif topic == f"resume_{device_id}/set":
-                if writeback:
-                    await self.resume_charging()
-                else:
-                    logging.info("Writeback disabled: resume charging command ignored.")
-            elif topic == f"unlock_cable_{device_id}/press":
-                # Button press for unlock cable
-                if writeback:
-                    await self.unlock_cable()
-                else:
-                    logging.info("Writeback disabled: unlock cable button command ignored.")
-            elif topic == f"availability_{device_id}/set":
-                # Toggle availability: ON = Operative, OFF = Inoperative
-                if writeback:
-                    if payload == "ON":
-                        await self.change_availability("Operative")
-                        self.mqtt_client.publish(f"ocpp/availability_{device_id}/state", "ON")
-                    else:
-                        await self.change_availability("Inoperative")
-                        self.mqtt_client.publish(f"ocpp/availability_{device_id}/state", "OFF")
-                else:
-                    logging.info("Writeback disabled: availability command ignored.")
-            elif topic == f"current_limit_{device_id}/set":
-                value = int(payload)
-                await self.set_current_limit(value)
-        except Exception as e:
-            logging.exception(f"Exception in handle_mqtt_command: {e}")
+            msg = _unpack(raw)
+        except OCPPError as e:
+            logging.error(f"{self.id}: Unable to parse message {raw}: {e}")
+            return
+        if msg.message_type_id != MessageType.Call:
+            # Responses to our own calls (CALLRESULT / CALLERROR) complete the pending future
+            if not self.outbound.resolve(msg):
+                # Late (after the call timed out) or not ours at all. Every call goes
+                # through self.outbound, so nothing would ever read it from a queue
+                logging.warning(f"{self.id}: dropping response {msg.unique_id!r} that matches no pending call")
+            return
+        self.validation.apply(self.route_map, msg.action)
+        try:
+            await self._handle_call(msg)
+        except OCPPError as error:
+            if isinstance(error, OCPPNotImplementedError):
+                logging.warning(f"{self.id}: No handler registered for OCPP action: {msg.action}")
+            else:
+                self.logger.exception("Error while handling request '%s'", msg)
+            await self._send(msg.create_call_error(error).to_json())
+
+    # ----------------------------
+    # MQTT commands (ocpp/<command>_<id>/<verb>, see mqtt_commands)
+    # ----------------------------
+
+    @command("suspend")
+    def on_suspend_command(self, payload):
+        self.coalescer.submit("suspend", payload == "ON", self.apply_suspend)
+
+    @command("resume")
+    def on_resume_command(self, payload):
+        self.coalescer.submit("suspend", False, self.apply_suspend)
+
+    @command("unlock_cable", verb="press")
+    async def on_unlock_cable_command(self, payload):
+        await self.unlock_cable()
+
+    @command("availability")
+    def on_availability_command(self, payload):
+        # ON = Operative, OFF = Inoperative
+        self.coalescer.submit("availability", payload == "ON", self.apply_availability)
+
+    @command("current_limit", writeback=False)
+    def on_current_limit_command(self, payload):
+        # Slider drags send bursts; only the last value is applied
+        self.coalescer.submit("current_limit", int(payload), self.set_current_limit)
+
+    async def apply_suspend(self, suspend):
+        if suspend:
+            await self.suspend_charging()
+        else:
+            await self.resume_charging()
+
+    async def apply_availability(self, operative):
+        await self.change_availability("Operative" if operative else "Inoperative")
+        self.mqtt_client.publish(f"ocpp/availability_{self.id}/state", "ON" if operative else "OFF", priority=PRIORITY_COMMAND)
 
     # OCPP command stubs (implement real OCPP calls as needed)
     async def RemoteStopTransaction(self, override_check=False):
@@ -187,13 +435,11 @@ class EVChargePoint(cp):
         if (self.status in ["Charging", "SuspendedEV", "init"] and self.current_transaction_id is not None) or override_check:
             # Send OCPP command to suspend charging (RemoteStopTransaction requires transactionId)
             if hasattr(self, "current_transaction_id"):
-                msg = Call(
-                    unique_id=str(uuid.uuid4()),
-                    action="RemoteStopTransaction",
-                    payload={"transactionId": self.current_transaction_id}
+                response = await self.outbound.call(
+                    "RemoteStopTransaction", {"transactionId": self.current_transaction_id}
                 )
-                await self._send(msg.to_json())
-                logging.info(f"{self.id}: Suspend charging OCPP message sent (transactionId={self.current_transaction_id})")
+                logging.info(f"{self.id}: RemoteStopTransaction (transactionId={self.current_transaction_id}) response: {response}")
+                return response
             else:
                 logging.error(f"{self.id}: No current_transaction_id set, cannot send RemoteStopTransaction!")
 
@@ -208,7 +454,7 @@ class EVChargePoint(cp):
 
     async def resume_charging(self):
         logging.info(f"{self.id}: Resuming charging")
-        await self.set_charging_profile(self.maximum_current_now)
+        await self.set_charging_profile(self.allowed_current())
 
 
 
@@ -216,36 +462,24 @@ class EVChargePoint(cp):
         #"only allow if status is one not charging"
         if self.status not in ["Charging","SuspendedEV"]:
             logging.info(f"{self.id}: Unlocking cable (sending OCPP UnlockConnector command)")
-            msg = Call(
-                unique_id=str(uuid.uuid4()),
-                action="UnlockConnector",
-                payload={"connectorId": 1}
-        )
-        await self._send(msg.to_json())
-        logging.info(f"{self.id}: Unlock cable OCPP message sent")
+            response = await self.outbound.call("UnlockConnector", {"connectorId": 1})
+            logging.info(f"{self.id}: UnlockConnector response: {response}")
+            return response
+        logging.info(f"{self.id}: Unlock cable ignored while {self.status}")
 
     async def change_availability(self, AvailabilityType):
         logging.info(f"{self.id}: Changing availability (sending OCPP ChangeAvailability command)")
-        msg = Call(
-            unique_id=str(uuid.uuid4()),
-            action="ChangeAvailability",
-            payload={"connectorId": 0, "type": AvailabilityType}
-        )
-        response = await self._send(msg.to_json())
+        response = await self.outbound.call("ChangeAvailability", {"connectorId": 0, "type": AvailabilityType})
         logging.info(f"{self.id}: ChangeAvailability response: {response}")
-        # Optionally, check if response is an error and log it
-        if isinstance(response, dict) and response.get("errorCode"):
-            logging.error(f"{self.id}: ChangeAvailability error: {response}")
+        if response.status == "Rejected":
+            logging.error(f"{self.id}: ChangeAvailability to {AvailabilityType} rejected by charger")
+        return response
 
     async def get_configuration(self):
         logging.info(f"{self.id}: Getting configuration (sending OCPP GetConfiguration command)")
-        msg = Call(
-            unique_id=str(uuid.uuid4()),
-            action="GetConfiguration",
-            payload={}
-        )
-        response = await self._send(msg.to_json())
+        response = await self.outbound.call("GetConfiguration", {})
         logging.info(f"{self.id}: GetConfiguration response: {response}")
+        return response
 
     def create_schedule(self, currentLimit):
         # Function that will create a one-item schedule to limit charging current or pause charging
@@ -262,7 +496,7 @@ class EVChargePoint(cp):
         # Create a schedule with the adjusted current limit
         schedule = [
             {"startPeriod": 0, "limit": currentLimit},
-            {"startPeriod": 86400, "limit": self.maximum_current_now}
+            {"startPeriod": 86400, "limit": self.allowed_current()}
         ]
         
         
@@ -273,8 +507,6 @@ class EVChargePoint(cp):
         logging.info(f"{self.id}: Setting charging profile (sending OCPP SetChargingProfile command)")
         # Simple test: pause for 5 minutes, then allow full current
         schedule = self.create_schedule(current_limit)
-        # Build a schedule starting at midnight UTC for 24 hours
-        start_of_day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat().replace('+00:00', 'Z')
         now = datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
         test_profile = {
             "chargingProfileId": 1,
@@ -287,31 +519,62 @@ class EVChargePoint(cp):
                 "chargingSchedulePeriod": schedule
             }
         }
-        msg = Call(
-            unique_id=str(uuid.uuid4()),
-            action="SetChargingProfile",
-            payload={
+        response = await self.outbound.call(
+            "SetChargingProfile",
+            {
                 "connectorId": 1,  # must match your actual connector
                 "csChargingProfiles": test_profile
             }
         )
-        response = await self._send(msg.to_json())
         logging.info(f"{self.id}: SetChargingProfile response: {response}")
+        if response.status != "Accepted":
+            logging.warning(f"{self.id}: SetChargingProfile {response.status} by charger")
+        return response
 
 
    
+    def allowed_current(self):
+        """
+        Current limit to apply: the HA selected limit, lowered to the site allocation if any.
+        """
+        if self.site_limit is None:
+            return self.maximum_current_now
+        return min(self.maximum_current_now, self.site_limit)
+
+    def apply_site_limit(self, amps):
+        """
+        Called by the site load manager when this charger's allocation changed.
+        """
+        logging.info(f"{self.id}: site allocation changed to {amps}A")
+        self.site_limit = amps
+        if self.status == "Charging":
+            self.coalescer.submit("site_limit", amps, self._apply_site_limit)
+
+    def release_site_allocation(self):
+        """
+        Session over: leave the site load manager and drop the allocation it gave us,
+        so the next session starts from the HA limit until it is allocated again.
+        """
+        if self.load_manager is not None:
+            # No-op once a newer connection of this charger has taken the session over
+            self.load_manager.remove(self.id, owner=self)
+        self.site_limit = None
+
+    async def _apply_site_limit(self, amps):
+        await self.set_charging_profile(self.allowed_current())
+
     async def set_current_limit(self, value):
         logging.info(f"{self.id}: Setting current limit to {value}A ")
         self.maximum_current_now = value
         
         # Update the charging profile with the new current limit
         if self.status == "Charging":
-            await self.set_charging_profile(self.maximum_current_now)
+            await self.set_charging_profile(self.allowed_current())
 
         
         # Publish updated state to HA
         device_id = self.id
-        self.mqtt_client.publish(f"ocpp/current_limit_{device_id}/state", value)        
+        self.mqtt_client.publish(f"ocpp/current_limit_{device_id}/state", value, priority=PRIORITY_COMMAND)
 
 
     def zero_metrics(self):
@@ -329,22 +592,23 @@ class EVChargePoint(cp):
             f"ocpp/meter_{device_id}_current_offered_outlet"
         ]
         for topic in zero_topics:
-            self.mqtt_client.publish(topic, 0)
+            self.state_publisher.publish(topic, 0)
         logging.info(f"{self.id}: Published 0 for all required meter topics due to suspend.")
 
 
     @on('StartTransaction')
     # charging session is started
     async def on_start_transaction(self, connector_id, id_tag, meter_start, timestamp, **kwargs):
-        logging.info(f"{self.id}: StartTransaction received: connector_id={connector_id}, id_tag={id_tag}, meter_start={meter_start}, timestamp={timestamp}, extra={kwargs}")
-        # Generate a unique transaction id per session
-        self.current_transaction_id = int(datetime.now(timezone.utc).timestamp())
+        logging.info("%s: StartTransaction received: connector_id=%s, id_tag=%s, meter_start=%s, timestamp=%s, extra=%s",
+                     self.id, connector_id, id_tag, meter_start, timestamp, kwargs, extra=self._log_tag("StartTransaction"))
+        # Generate a unique transaction id per session and persist it (off the event loop)
+        session = self.session_store.start_transaction(self.id, connector_id, id_tag, meter_start, timestamp)
+        self.current_transaction_id = session.transaction_id
+        self._start_session_energy(session.transaction_id, timestamp, meter_start)
         # record last charging start time in HA friendly format
         self.last_charging_start = datetime.now(timezone.utc).isoformat()
         # Publish to MQTT sensor
         self.mqtt_client.publish(f"ocpp/last_charging_start_{self.id}", self.last_charging_start)
-        # Persist the transaction ID
-        self.persist_transaction_id()
         response = call_result.StartTransaction(
             transaction_id=self.current_transaction_id,
             # always accepted
@@ -352,28 +616,61 @@ class EVChargePoint(cp):
                 "status": "Accepted"
             }
         )
-        logging.info(f"{self.id}: StartTransaction response: {response}")
-
-        #sleep 5 seconds and set charging profile
-        await asyncio.sleep(5)
-        await self.set_charging_profile(self.maximum_current_now)   
+        logging.info("%s: StartTransaction response: %s", self.id, response, extra=self._log_tag("StartTransaction"))
         return response
 
+    @after('StartTransaction')
+    def after_start_transaction(self, **kwargs):
+        # Runs once the StartTransaction response is sent: give the charger a few
+        # seconds to settle, then set the charging profile without holding up the socket
+        self.scheduler.schedule(
+            "SetChargingProfile",
+            lambda: self.set_charging_profile(self.allowed_current()),
+            delay=self.config["ocpp"].get("profile_delay", 5),
+        )
+
     @on("StopTransaction")
     async def on_stop_transaction(self, transaction_id, meter_stop, timestamp, **kwargs):
-        logging.info(f"{self.id}: StopTransaction received: transaction_id={transaction_id}, meter_stop={meter_stop}, timestamp={timestamp}, extra={kwargs}")
-
-        # Persist the transaction ID
-        self.persist_transaction_id()
+        logging.info("%s: StopTransaction received: transaction_id=%s, meter_stop=%s, timestamp=%s, extra=%s",
+                     self.id, transaction_id, meter_stop, timestamp, kwargs, extra=self._log_tag("StopTransaction"))
+
+        # Record the stop reading; the session is no longer active
+        self.session_store.stop_transaction(self.id, transaction_id, meter_stop, timestamp, kwargs.get("reason"))
+        energy = self.session_energy
+        if energy is not None and energy.transaction_id == transaction_id:
+            energy.feed((parse_timestamp(timestamp),), (float(meter_stop),))
+            cost = energy.cost(self.tariff)
+            self.session_store.record_energy(transaction_id, energy.energy_wh, cost)
+            self.publish_session_energy()
+            logging.info(f"{self.id}: transaction {transaction_id} used {energy.kwh:.3f} kWh, "
+                         f"cost {cost:.2f} {self.tariff.currency} ({energy.stats()})")
+            self.session_energy = None
+        if self.current_transaction_id == transaction_id:
+            self.current_transaction_id = None
+        self.release_site_allocation()
 
         response = call_result.StopTransaction(
             id_tag_info={
                 "status": "Accepted"
             }
         )
-        logging.info(f"{self.id}: StopTransaction response: {response}")
+        logging.info("%s: StopTransaction response: %s", self.id, response, extra=self._log_tag("StopTransaction"))
         return response
 
+    def _static_sensor_config(self, unique_id, name, state_topic, icon):
+        # Built once per charger: adding the same object again costs the discovery
+        # builder an identity check instead of a comparison on every message
+        config = self._discovery_configs.get(unique_id)
+        if config is None:
+            config = self._discovery_configs[unique_id] = {
+                "name": name,
+                "state_topic": state_topic,
+                "unique_id": unique_id,
+                "icon": icon,
+                "force_update": True
+            }
+        return config
+
     async def send_status(self, status):
         """
         Publish charging status to MQTT and Home Assistant discovery.
@@ -383,37 +680,20 @@ class EVChargePoint(cp):
         device_id = self.id
         state_topic = f"ocpp/status_{device_id}"
         unique_id = f"{device_id}_status"
-        config_topic = f"homeassistant/sensor/{unique_id}/config"
-        config_payload = {
-            "name": f"{device_id} Status",
-            "state_topic": state_topic,
-            "unique_id": unique_id,
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
-            "icon": "mdi:ev-station",
-            "force_update": True
-        }
-        self.mqtt_client.publish(config_topic, json.dumps(config_payload))
-        self.mqtt_client.publish(state_topic, status)
-        logging.debug(f"Published MQTT status: {status} to {state_topic} (discovery: {config_topic})")
-
-    #persisting transactionID
-    def persist_transaction_id(self):
-        with open("persist.json", "w") as f:
-            json.dump({"current_transaction_id": self.current_transaction_id}, f)
+        config_payload = self._static_sensor_config(unique_id, f"{device_id} Status", state_topic, "mdi:ev-station")
+        self.discovery.add("sensor", config_payload)
+        self.state_publisher.publish(state_topic, status)
+        logging.debug("Published MQTT status: %s to %s", status, state_topic)
 
-    def load_persisted_transaction_id(self):
-        try:
-            with open("persist.json", "r") as f:
-                data = json.load(f)
-                self.current_transaction_id = data.get("current_transaction_id", None)
-        except FileNotFoundError:
-            self.current_transaction_id = None
-        except json.JSONDecodeError:
-            self.current_transaction_id = None
+    def restore_transaction_id(self, reported_transaction_id=None):
+        """
+        Recover the open transaction id, e.g. after a server restart mid-session.
+        Served from the session store's cache; adopts the id the charger reports if we have none.
+        """
+        session = self.session_store.active_transaction(self.id)
+        if session is None and reported_transaction_id is not None:
+            session = self.session_store.adopt_transaction(self.id, reported_transaction_id)
+        self.current_transaction_id = session.transaction_id if session is not None else None
 
     # ----------------------------
     # OCPP Handlers
@@ -425,8 +705,8 @@ class EVChargePoint(cp):
     @on("BootNotification")
     async def on_boot_notification(self, charge_point_vendor, charge_point_model, **kwargs):
         logging.info(
-            f"{self.id}: BootNotification received "
-            f"(vendor={charge_point_vendor}, model={charge_point_model}, payload={kwargs})"
+            "%s: BootNotification received (vendor=%s, model=%s, payload=%s)",
+            self.id, charge_point_vendor, charge_point_model, kwargs, extra=self._log_tag("BootNotification"),
         )
 
         try:
@@ -437,7 +717,7 @@ class EVChargePoint(cp):
                 interval=30,
                 status="Accepted"
             )
-            logging.info(f"{self.id}: BootNotification response: {response}")
+            logging.info("%s: BootNotification response: %s", self.id, response, extra=self._log_tag("BootNotification"))
 
 
 
@@ -451,103 +731,119 @@ class EVChargePoint(cp):
     @on("Heartbeat")
     async def on_heartbeat(self):
         now = datetime.now(timezone.utc).isoformat()
-        logging.debug(f"{self.id}: Heartbeat received")
+        logging.debug("%s: Heartbeat received", self.id, extra=self._log_tag("Heartbeat"))
         # Home Assistant MQTT Discovery for heartbeat
         device_id = self.id
-        sensor_name = "heartbeat"
         state_topic = f"ocpp/heartbeat_{device_id}"
         unique_id = f"{device_id}_heartbeat"
-        config_topic = f"homeassistant/sensor/{unique_id}/config"
-        config_payload = {
-            "name": f"{device_id} Heartbeat",
-            "state_topic": state_topic,
-            "unique_id": unique_id,
-            "device": {
-                "identifiers": [device_id],
-                "name": device_id,
-                "manufacturer": "OCPP Charger"
-            },
-            "icon": "mdi:heart-pulse",
-            "force_update": True
-        }
-        self.mqtt_client.publish(config_topic, json.dumps(config_payload))
+        config_payload = self._static_sensor_config(unique_id, f"{device_id} Heartbeat", state_topic, "mdi:heart-pulse")
+        self.discovery.add("sensor", config_payload)
         # Publish heartbeat value to the correct state topic
         self.mqtt_client.publish(state_topic, now)
-        logging.debug(f"Published MQTT heartbeat: heartbeat {now}")
+        logging.debug("Published MQTT heartbeat: heartbeat %s", now, extra=self._log_tag("Heartbeat"))
         response = call_result.Heartbeat(current_time=now)
-        logging.debug(f"{self.id}: Heartbeat response: {response}")
+        logging.debug("%s: Heartbeat response: %s", self.id, response, extra=self._log_tag("Heartbeat"))
         return response
 
     @on("MeterValues")
     async def on_meter_values(self, connector_id, meter_value, **kwargs):
-        logging.info(f"{self.id}: MeterValues received: connector_id={connector_id}, meter_value={meter_value}, extra={kwargs}")
+        logging.info("%s: MeterValues received: connector_id=%s, meter_value=%s, extra=%s",
+                     self.id, connector_id, meter_value, kwargs, extra=self._log_tag("MeterValues"))
 
-        #if metrics is received, charging is ongoing. Check if transactionID is None, in that case read from file
+        #if metrics is received, charging is ongoing. Check if transactionID is None, in that case restore it
         if not self.current_transaction_id:
-            self.load_persisted_transaction_id()
+            self.restore_transaction_id(kwargs.get("transaction_id"))
         #set status to Charging
         self.status = "Charging"
 
         try:
             # Home Assistant MQTT Discovery and value publishing
-            device_id = self.id
+            descriptors = self._sensor_descriptors
+            current_import = {}
+            current_offered = None
+            register = None
+            history = self.history
             for entry in meter_value:
-                timestamp = entry.get("timestamp")
+                timestamp = None
                 for sv in entry.get("sampled_value", []):
-                    measurand = sv.get("measurand", "unknown").lower().replace(".", "_").replace(" ", "_")
-                    phase = sv.get("phase")
-                    location = sv.get("location")
-                    unit = sv.get("unit", "")
+                    key = (sv.get("measurand", "unknown"), sv.get("phase"), sv.get("location"), sv.get("unit", ""))
+                    descriptor = descriptors.get(key)
+                    if descriptor is None:
+                        descriptor = self._sensor_descriptor(*key)
                     value = sv.get("value")
-                    # Build a unique sensor name
-                    sensor_name = f"{measurand}"
-                    if phase:
-                        sensor_name += f"_{phase.lower()}"
-                    if location:
-                        sensor_name += f"_{location.lower()}"
-                    sensor_name = sensor_name.replace(" ", "_")
-                    state_topic = f"ocpp/meter_{device_id}_{sensor_name}"
-                    # Publish discovery config
-                    unique_id = f"{device_id}_{sensor_name}"
-                    config_topic = f"homeassistant/sensor/{unique_id}/config"
-                    config_payload = {
-                        "name": f"{device_id} {sensor_name}",
-                        "state_topic": state_topic,
-                        "unique_id": unique_id,
-                        "device": {
-                            "identifiers": [device_id],
-                            "name": device_id,
-                            "manufacturer": "OCPP Charger"
-                        },
-                        "unit_of_measurement": unit,
-                        "device_class": self._guess_device_class(measurand),
-                        "state_class": self._guess_state_class(measurand),
-                        "force_update": True
-                    }
-                    self.mqtt_client.publish(config_topic, json.dumps(config_payload))
                     # Publish value
-                    self.mqtt_client.publish(state_topic, value)
-                    logging.debug(f"Published {sensor_name}: {value} to {state_topic} (discovery: {config_topic})")
+                    self.state_publisher.publish(descriptor.state_topic, value, descriptor.measurand, PRIORITY_METER)
+                    logging.debug("Published %s: %s to %s", descriptor.sensor_name, value, descriptor.state_topic,
+                                  extra=self._log_tag("MeterValues"))
+                    tracked = history.tracks(descriptor.measurand)
+                    if not tracked and descriptor.measurand not in NUMERIC_MEASURANDS:
+                        continue
+                    # One bad reading skips that sample, not the whole MeterValues
+                    try:
+                        number = float(value)
+                    except (TypeError, ValueError):
+                        number = math.nan
+                    if not math.isfinite(number):
+                        self._bad_sample(descriptor, value)
+                        continue
+                    if tracked:
+                        if timestamp is None:
+                            timestamp = parse_timestamp(entry.get("timestamp"))
+                        history.append(descriptor.sensor_name, timestamp, number)
+                    # Live readings for the site load manager
+                    if descriptor.measurand == "current_import" and key[1]:
+                        current_import[key[1]] = number
+                    elif descriptor.measurand == "current_offered":
+                        current_offered = number
+                    elif descriptor.measurand == "energy_active_import_register" and not key[1]:
+                        if timestamp is None:
+                            timestamp = parse_timestamp(entry.get("timestamp"))
+                        register = (timestamp, number * (1000 if key[3] == "kWh" else 1))
+            if register is not None:
+                self._account_energy(*register)
+                self.publish_session_energy()
+            if self.load_manager is not None:
+                self.load_manager.update(self.id, self.maximum_current_now, current_import, current_offered, owner=self)
             response = call_result.MeterValues()
-            logging.info(f"{self.id}: MeterValues response: {response}")
+            logging.info("%s: MeterValues response: %s", self.id, response, extra=self._log_tag("MeterValues"))
             return response
         except Exception as e:
             logging.exception(f"Exception in on_meter_values: {e}")
             raise
 
+    def _bad_sample(self, descriptor, value):
+        # Warn once per sensor; a charger sending garbage would otherwise flood the log
+        if descriptor.sensor_name not in self._bad_samples:
+            self._bad_samples.add(descriptor.sensor_name)
+            logging.warning(f"{self.id}: skipping non-numeric {descriptor.sensor_name} reading {value!r} "
+                            f"(further ones are skipped silently)")
+
+    def _sensor_descriptor(self, measurand, phase, location, unit):
+        """
+        Build, announce and cache the descriptor for a (measurand, phase, location, unit) key.
+        """
+        key = (measurand, phase, location, unit)
+        # Build a unique sensor name
+        measurand = measurand.lower().replace(".", "_").replace(" ", "_")
+        sensor_name = measurand
+        if phase:
+            sensor_name += f"_{phase.lower()}"
+        if location:
+            sensor_name += f"_{location.lower()}"
+        sensor_name = sensor_name.replace(" ", "_")
+        descriptor = SensorDescriptor(
+            self.id, measurand, sensor_name, unit,
+            self._guess_device_class(measurand),
+            self._guess_state_class(measurand),
+        )
+        # Added to the discovery once per descriptor; the registry handles HA restarts
+        self.discovery.add("sensor", descriptor.config_payload())
+        self._sensor_descriptors[key] = descriptor
+        return descriptor
+
     def _guess_device_class(self, measurand):
         # Map OCPP measurands to Home Assistant device classes
-        mapping = {
-            "voltage": "voltage",
-            "current_import": "current",
-            "current_offered": "current",
-            "power_active_import": "power",
-            "energy_active_import_register": "energy",
-            "frequency": "frequency",
-            "temperature": "temperature",
-            "soc": "battery",
-        }
-        return mapping.get(measurand.lower(), None)
+        return DEVICE_CLASSES.get(measurand.lower(), None)
 
     def _guess_state_class(self, measurand):
         # Map OCPP measurands to Home Assistant state classes
@@ -563,14 +859,18 @@ class EVChargePoint(cp):
 
     @on('StatusNotification')
     async def on_status_notification(self, connector_id, status, error_code, **kwargs):
-        logging.info(f"{self.id}: StatusNotification received: connector={connector_id}, status={status}, error_code={error_code}, extra={kwargs}")
+        logging.info("%s: StatusNotification received: connector=%s, status=%s, error_code=%s, extra=%s",
+                     self.id, connector_id, status, error_code, kwargs, extra=self._log_tag("StatusNotification"))
         try:
             if status in ["SuspendedEV","SuspendedEVSE","Inoperative", "Finishing","Available"]:
                 self.zero_metrics()
+            if status in ["Finishing", "Available"]:
+                # Session over: hand its share back to the other chargers
+                self.release_site_allocation()
 
             await self.send_status(status)
             response = call_result.StatusNotification()
-            logging.info(f"{self.id}: StatusNotification response: {response}")
+            logging.info("%s: StatusNotification response: %s", self.id, response, extra=self._log_tag("StatusNotification"))
             return response
         except Exception as e:
             logging.exception(f"Exception in on_status_notification: {e}")
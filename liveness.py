@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import math
+import time
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: deadlines for many keys, advanced by one tick at a time.
+
+    `schedule(key, delay)` files the key under the slot of its deadline tick,
+    `advance()` moves one tick and returns the keys that expired. Rescheduling a key
+    whose deadline tick did not change is a dict lookup, so touching a key on every
+    message is cheap. Delays longer than one turn of the wheel wrap around; the key is
+    only expired once its own deadline tick has been reached.
+    """
+
+    def __init__(self, slots=128):
+        self._slots = [set() for _ in range(slots)]
+        # key -> deadline tick
+        self._deadlines = {}
+        self.tick = 0
+
+    def schedule(self, key, ticks):
+        deadline = self.tick + max(1, ticks)
+        previous = self._deadlines.get(key)
+        if previous == deadline:
+            return
+        if previous is not None:
+            self._slots[previous % len(self._slots)].discard(key)
+        self._deadlines[key] = deadline
+        self._slots[deadline % len(self._slots)].add(key)
+
+    def cancel(self, key):
+        deadline = self._deadlines.pop(key, None)
+        if deadline is not None:
+            self._slots[deadline % len(self._slots)].discard(key)
+
+    def advance(self):
+        self.tick += 1
+        slot = self._slots[self.tick % len(self._slots)]
+        expired = [key for key in slot if self._deadlines[key] <= self.tick]
+        for key in expired:
+            slot.discard(key)
+            del self._deadlines[key]
+        return expired
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+
+class LivenessMonitor:
+    """
+    Notices charge points that went quiet, with one timer wheel for the whole fleet
+    instead of a sleeping task per charger.
+
+    Every inbound frame (Heartbeat, MeterValues, ...) calls `seen(charge_point)`, which
+    pushes its deadline `timeout` seconds out. `run()` advances the wheel every `tick`
+    seconds and hands charge points that were silent for `timeout` to `on_idle`.
+    """
+
+    def __init__(self, timeout=90.0, on_idle=None, tick=1.0):
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.tick = tick
+        self._ticks = math.ceil(timeout / tick)
+        self.wheel = TimerWheel(slots=min(self._ticks + 1, 1024))
+        self.expired = 0
+
+    def seen(self, charge_point):
+        self.wheel.schedule(charge_point, self._ticks)
+
+    def forget(self, charge_point):
+        self.wheel.cancel(charge_point)
+
+    async def run(self):
+        # Sleep to absolute tick times so a slow tick does not shift every deadline
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            for charge_point in self.wheel.advance():
+                self.expired += 1
+                try:
+                    self.on_idle(charge_point)
+                except Exception as e:
+                    logging.exception(f"{charge_point.id}: idle handling failed: {e}")
+
+    def __len__(self):
+        return len(self.wheel)
@@ -0,0 +1,247 @@
+import bisect
+import itertools
+from collections.abc import Mapping
+import logging
+import math
+
+PHASES = ("L1", "L2", "L3")
+
+
+def _whole_amps(level):
+    return level if level == math.inf else int(level)
+
+
+class _Session:
+    __slots__ = ("cp_id", "seq", "cap", "phases", "allocation", "owner")
+
+    def __init__(self, cp_id, seq, owner=None):
+        self.cp_id = cp_id
+        self.owner = owner
+        self.seq = seq
+        self.cap = 0.0
+        self.phases = ()
+        self.allocation = None
+
+
+class _Phase:
+    """
+    Sessions drawing from one phase, with the fair-share level for that phase.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        # (seq, cp_id) of all sessions on this phase, oldest first
+        self.order = []
+        # (cap, cp_id) of admitted sessions, sorted by cap
+        self.caps = []
+        self.admitted = set()
+        # Distinct caps of admitted sessions (sorted) and how many sessions have each;
+        # the level only depends on these, and there are few distinct values
+        self.cap_values = []
+        self.cap_counts = {}
+        self.level = math.inf
+
+    def add_cap(self, cap, cp_id):
+        bisect.insort(self.caps, (cap, cp_id))
+        count = self.cap_counts.get(cap, 0)
+        if not count:
+            bisect.insort(self.cap_values, cap)
+        self.cap_counts[cap] = count + 1
+
+    def remove_cap(self, cap, cp_id):
+        del self.caps[bisect.bisect_left(self.caps, (cap, cp_id))]
+        count = self.cap_counts[cap] - 1
+        if count:
+            self.cap_counts[cap] = count
+        else:
+            del self.cap_counts[cap]
+            del self.cap_values[bisect.bisect_left(self.cap_values, cap)]
+
+
+class SiteLoadManager:
+    """
+    Divides a site current budget (per phase) fairly across active charging sessions.
+
+    Every session gets the same share of each phase it draws from (water-filling):
+    sessions whose cap is below the fair level keep their cap, the rest is split
+    evenly among the others. A session's cap is its charger limit, lowered to what
+    the EV actually draws (plus headroom) when the EV takes less than it is offered.
+    If a phase cannot give every session `min_current`, the newest sessions are paused
+    (allocated 0) until capacity frees up.
+
+    Updates are incremental: an event only re-levels the phases of the session that
+    changed and only revisits sessions whose allocation can have moved. `on_change`
+    is called with (cp_id, amps) for each session whose allocation changed.
+    """
+
+    def __init__(self, budget, min_current=6, headroom=2.0, on_change=None):
+        # A plain dict or the frozen mapping of a config snapshot
+        if not isinstance(budget, Mapping):
+            budget = {phase: budget for phase in PHASES}
+        self.min_current = min_current
+        self.headroom = headroom
+        self.on_change = on_change
+        self._phases = {phase: _Phase(float(budget[phase])) for phase in PHASES if phase in budget}
+        self._sessions = {}
+        self._seq = itertools.count()
+        self.events = 0
+        self.changes = 0
+
+    def allocation(self, cp_id):
+        session = self._sessions.get(cp_id)
+        return session.allocation if session is not None else None
+
+    def update(self, cp_id, max_current, current_import=None, current_offered=None, owner=None):
+        """
+        Feed the latest readings of a charging session. `current_import` maps phase -> amps.
+        `owner` (the charger's connection) takes the session over from an older one.
+
+        Returns the session's allocation.
+        """
+        self.events += 1
+        session = self._sessions.get(cp_id)
+        if session is None:
+            session = self._sessions[cp_id] = _Session(cp_id, next(self._seq), owner)
+        elif owner is not None:
+            session.owner = owner
+        cap, phases = self._demand(session, max_current, current_import, current_offered)
+        if cap == session.cap and phases == session.phases:
+            return session.allocation
+        affected = {cp_id}
+        for phase in set(session.phases) | set(phases):
+            state = self._phases.get(phase)
+            if state is None:
+                continue
+            self._leave(state, session)
+        old_phases, session.phases, session.cap = session.phases, phases, cap
+        for phase in set(old_phases) | set(phases):
+            state = self._phases.get(phase)
+            if state is None:
+                continue
+            if phase in phases:
+                bisect.insort(state.order, (session.seq, cp_id))
+            affected |= self._relevel(state, cp_id)
+        self._reallocate(affected)
+        return session.allocation
+
+    def remove(self, cp_id, owner=None):
+        """
+        End a session. With `owner`, only if that connection still owns it: the cleanup
+        of a replaced connection must not end the session of the one that replaced it.
+        """
+        session = self._sessions.get(cp_id)
+        if session is None or (owner is not None and session.owner is not owner):
+            return
+        del self._sessions[cp_id]
+        affected = set()
+        for phase in session.phases:
+            state = self._phases.get(phase)
+            if state is None:
+                continue
+            self._leave(state, session)
+            affected |= self._relevel(state, cp_id)
+        affected.discard(cp_id)
+        self._reallocate(affected)
+
+    def _demand(self, session, max_current, current_import, current_offered):
+        cap = float(max_current)
+        phases = session.phases or PHASES
+        if current_import:
+            drawing = tuple(p for p in PHASES if current_import.get(p, 0) >= 1)
+            if drawing:
+                phases = drawing
+                drawn = max(current_import[p] for p in drawing)
+                # EV takes noticeably less than offered: release the rest to other sessions
+                if current_offered is not None and current_offered - drawn > self.headroom:
+                    cap = min(cap, drawn + self.headroom)
+        return max(cap, float(self.min_current)), phases
+
+    def _leave(self, state, session):
+        cp_id = session.cp_id
+        i = bisect.bisect_left(state.order, (session.seq, cp_id))
+        if i < len(state.order) and state.order[i][1] == cp_id:
+            del state.order[i]
+        if cp_id in state.admitted:
+            state.admitted.discard(cp_id)
+            state.remove_cap(session.cap, cp_id)
+
+    def _relevel(self, state, cp_id):
+        """
+        Re-admit sessions and recompute the phase level after `cp_id` joined or left.
+
+        Returns the ids whose allocation may have changed.
+        """
+        affected = set()
+        order = state.order
+        max_admitted = int(state.budget // self.min_current) if self.min_current else len(order)
+        k = min(len(order), max_admitted)
+        # Admitted sessions are always order[:k]; one join or leave can only move the
+        # boundary entries (and the changed session itself) across it.
+        candidates = {entry[1] for entry in order[max(0, k - 2):k + 2]}
+        candidates.add(cp_id)
+        for candidate in candidates:
+            session = self._sessions.get(candidate)
+            if session is None:
+                continue
+            i = bisect.bisect_left(order, (session.seq, candidate))
+            should_admit = i < k and i < len(order) and order[i][1] == candidate
+            if should_admit and candidate not in state.admitted:
+                state.admitted.add(candidate)
+                state.add_cap(session.cap, candidate)
+                affected.add(candidate)
+            elif not should_admit and candidate in state.admitted:
+                state.admitted.discard(candidate)
+                state.remove_cap(session.cap, candidate)
+                affected.add(candidate)
+
+        old_level = state.level
+        state.level = self._water_level(state)
+        # Allocations are whole amps: a level move within the same amp changes nobody
+        if _whole_amps(state.level) != _whole_amps(old_level):
+            # Only sessions capped above the lower of both levels see a different share
+            threshold = min(old_level, state.level)
+            i = bisect.bisect_left(state.caps, (threshold, ""))
+            affected.update(entry[1] for entry in state.caps[i:])
+        return affected
+
+    @staticmethod
+    def _water_level(state):
+        # Walk the distinct cap values from low to high: sessions capped below the even
+        # share of what is left keep their cap, the share at the first cap above it is the level
+        remaining = state.budget
+        n = len(state.caps)
+        for cap in state.cap_values:
+            count = state.cap_counts[cap]
+            if cap * n > remaining:
+                return remaining / n
+            remaining -= cap * count
+            n -= count
+        return math.inf
+
+    def _reallocate(self, affected):
+        for cp_id in affected:
+            session = self._sessions.get(cp_id)
+            if session is None:
+                continue
+            allocation = session.cap
+            for phase in session.phases:
+                state = self._phases.get(phase)
+                if state is None:
+                    continue
+                if cp_id not in state.admitted:
+                    allocation = 0
+                    break
+                allocation = min(allocation, state.level)
+            # Chargers take whole amps; never round up past the share
+            allocation = int(allocation)
+            if allocation != session.allocation:
+                session.allocation = allocation
+                self.changes += 1
+                if self.on_change is not None:
+                    try:
+                        self.on_change(cp_id, allocation)
+                    except Exception as e:
+                        logging.exception(f"Exception in load manager callback for {cp_id}: {e}")
+
+    def __len__(self):
+        return len(self._sessions)
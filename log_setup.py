@@ -0,0 +1,188 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands the record over unformatted.
+
+    The stock handler merges msg % args on the calling thread; here that happens in
+    the listener thread, so the event loop only pays for creating the record. Callers
+    must not mutate objects they pass as log arguments afterwards.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """
+    One compact JSON object per line: ts, level, logger, msg, plus action/charge_point when tagged.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        action = getattr(record, "action", None)
+        if action is not None:
+            entry["action"] = action
+            entry["charge_point"] = getattr(record, "charge_point", None)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class ActionSampler(logging.Filter):
+    """
+    Keeps 1 in N frames per OCPP action and charger, e.g. {"MeterValues": 10}.
+
+    A frame's records are kept or dropped together: the decision is taken on the raw
+    frame the ocpp library logs ("receive message"/"send"), handler records tagged
+    with extra={"action": ..., "charge_point": ...} follow it, and so does the
+    CALLRESULT/CALLERROR with the same unique id. WARNING and above always pass.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._counters = {}
+        # (charge_point, action) -> keep the frame currently being handled
+        self._decisions = {}
+        # unique_id -> keep, for the response to a sampled call
+        self._unique_ids = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        # Already decided by another handler sharing this filter (direct mode)
+        keep = getattr(record, "sampled", None)
+        if keep is not None:
+            return keep
+        action = getattr(record, "action", None)
+        if action is not None:
+            keep = self._decisions.get((getattr(record, "charge_point", None), action), True)
+        elif record.name == "ocpp" and len(record.args) == 2 and isinstance(record.args[1], str):
+            keep = self._frame(record.args[0], record.args[1])
+        else:
+            return True
+        record.sampled = keep
+        if not keep:
+            self.dropped += 1
+        return keep
+
+    def _frame(self, charge_point, message):
+        # [2,"<unique id>","<Action>",{...}] or [3,"<unique id>",{...}]; only the head is looked at
+        kind = message.lstrip("[ ")[:1]
+        parts = message[:200].split('"', 4)
+        if len(parts) < 3:
+            return True
+        unique_id = parts[1]
+        if kind == "2" and len(parts) > 4:
+            action = parts[3]
+            rate = self.rates.get(action)
+            if not rate or rate <= 1:
+                return True
+            key = (charge_point, action)
+            count = self._counters.get(key, 0)
+            self._counters[key] = count + 1
+            keep = self._decisions[key] = count % rate == 0
+            if len(self._unique_ids) > 10000:
+                self._unique_ids.clear()
+            self._unique_ids[unique_id] = keep
+            return keep
+        if kind in ("3", "4"):
+            return self._unique_ids.pop(unique_id, True)
+        return True
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _file_handler(log_file, rotate):
+    if rotate.get("when"):
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=rotate["when"], backupCount=rotate.get("backup_count", 7), encoding='utf-8')
+    elif rotate.get("max_bytes"):
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, mode='a', maxBytes=rotate["max_bytes"], backupCount=rotate.get("backup_count", 7),
+            encoding='utf-8')
+    else:
+        return logging.FileHandler(log_file, mode='a', encoding='utf-8')
+    if rotate.get("compress", True):
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(config):
+    """
+    Configure the root logger from the "logging" config section.
+
+    In "queue" mode (default) the event loop only enqueues records; formatting,
+    file writes, rotation and compression run on a QueueListener thread. Returns
+    the listener (stop it on shutdown to flush), or None in "direct" mode.
+    """
+    log_file = config["file"]
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    log_level = getattr(logging, config["level"].upper())
+    if config.get("format", "text") == "json":
+        formatter = JSONLinesFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    file_handler = _file_handler(log_file, config.get("rotate", {}))
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(log_level)
+    console_stream = open(sys.stdout.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1,
+                          closefd=False)
+    console_handler = logging.StreamHandler(console_stream)
+    console_handler.setFormatter(formatter)
+    console_level = getattr(logging, config["to_console_level"].upper())
+    console_handler.setLevel(console_level)
+
+    root_logger = logging.getLogger()
+    # Remove all handlers associated with the root logger object.
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(log_level)
+
+    sampler = ActionSampler(config["sample"]) if config.get("sample") else None
+    if config.get("mode", "queue") == "direct":
+        for handler in (file_handler, console_handler):
+            if sampler is not None:
+                handler.addFilter(sampler)
+            root_logger.addHandler(handler)
+        return None
+
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    if sampler is not None:
+        # Sample before enqueueing so dropped frames cost next to nothing
+        queue_handler.addFilter(sampler)
+    root_logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,171 @@
+import asyncio
+import bisect
+import time
+
+# Default latency buckets in seconds (upper bounds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Finer buckets for in-process steps that take microseconds (MQTT command routing)
+FAST_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01, 0.1)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with constant memory, for latencies in seconds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One extra slot for observations above the last bound (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (0 < q <= 1); max for the +Inf bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+def _escape(value):
+    # Label values in the text format: backslash, double quote and newline are escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_histogram(name, histogram, labels=None):
+    """
+    Lines for one Histogram in the Prometheus text format (cumulative buckets, sum, count).
+    """
+    lines = []
+    seen = 0
+    for bound, n in zip(histogram.buckets, histogram.counts):
+        seen += n
+        lines.append(f"{name}_bucket{_labels(dict(labels or {}, le=bound))} {seen}")
+    lines.append(f'{name}_bucket{_labels(dict(labels or {}, le="+Inf"))} {histogram.count}')
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+class ServerMetrics:
+    """
+    Fleet-wide counters for the /metrics endpoint.
+
+    Charge points report handled messages and outbound call timeouts, the server
+    counts connections and samples event-loop lag. Gauges owned by other objects
+    (MQTT queue depth, ...) are passed to render() at scrape time.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.connected = 0
+        self.connections = 0
+        # action -> messages handled / Histogram of handler time
+        self.messages = {}
+        self.handler_latency = {}
+        # action -> outbound calls that got no response in time
+        self.outbound_timeouts = {}
+        # command -> MQTT commands routed / time from receipt to handler started
+        self.commands = {}
+        self.command_routing = Histogram(FAST_BUCKETS)
+        self.loop_lag = Histogram()
+        self.last_loop_lag = 0.0
+        # Seconds from process start until the OCPP port listened / the first charger was accepted
+        self.listening_after = None
+        self.first_connection_after = None
+
+    def observe_message(self, action, seconds):
+        self.messages[action] = self.messages.get(action, 0) + 1
+        histogram = self.handler_latency.get(action)
+        if histogram is None:
+            histogram = self.handler_latency[action] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_command(self, command, seconds):
+        self.commands[command] = self.commands.get(command, 0) + 1
+        self.command_routing.observe(seconds)
+
+    def outbound_timeout(self, action):
+        self.outbound_timeouts[action] = self.outbound_timeouts.get(action, 0) + 1
+
+    async def sample_loop_lag(self, interval=1.0):
+        """
+        Sleep `interval` seconds and record how late the loop woke us up.
+        """
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        self.last_loop_lag = max(0.0, time.monotonic() - started - interval)
+        self.loop_lag.observe(self.last_loop_lag)
+
+    def render(self, gauges=None, counters=None):
+        """
+        The Prometheus text exposition. `gauges`/`counters` map metric name -> value
+        or {labels tuple: value} for values owned elsewhere.
+        """
+        lines = [
+            "# TYPE ocpp_uptime_seconds gauge",
+            f"ocpp_uptime_seconds {time.time() - self.started:.0f}",
+            "# TYPE ocpp_startup_seconds gauge",
+            f'ocpp_startup_seconds{{stage="listening"}} {self.listening_after or 0:.3f}',
+            f'ocpp_startup_seconds{{stage="first_connection"}} {self.first_connection_after or 0:.3f}',
+            "# TYPE ocpp_connected_chargers gauge",
+            f"ocpp_connected_chargers {self.connected}",
+            "# TYPE ocpp_connections_total counter",
+            f"ocpp_connections_total {self.connections}",
+            "# TYPE ocpp_messages_total counter",
+        ]
+        for action, count in sorted(self.messages.items()):
+            lines.append(f'ocpp_messages_total{_labels({"action": action})} {count}')
+        lines.append("# TYPE ocpp_handler_seconds histogram")
+        for action, histogram in sorted(self.handler_latency.items()):
+            lines.extend(prometheus_histogram("ocpp_handler_seconds", histogram, {"action": action}))
+        lines.append("# TYPE ocpp_outbound_timeouts_total counter")
+        for action, count in sorted(self.outbound_timeouts.items()):
+            lines.append(f'ocpp_outbound_timeouts_total{_labels({"action": action})} {count}')
+        lines.append("# TYPE mqtt_commands_total counter")
+        for command, count in sorted(self.commands.items()):
+            lines.append(f'mqtt_commands_total{_labels({"command": command})} {count}')
+        lines.append("# TYPE mqtt_command_routing_seconds histogram")
+        lines.extend(prometheus_histogram("mqtt_command_routing_seconds", self.command_routing))
+        lines.append("# TYPE event_loop_lag_seconds histogram")
+        lines.extend(prometheus_histogram("event_loop_lag_seconds", self.loop_lag))
+        for kind, values in (("gauge", gauges), ("counter", counters)):
+            for name, value in (values or {}).items():
+                lines.append(f"# TYPE {name} {kind}")
+                if isinstance(value, dict):
+                    for labels, v in value.items():
+                        lines.append(f"{name}{_labels(dict(labels))} {v}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
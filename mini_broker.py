@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import logging
+import struct
+
+
+def topic_matches(pattern, topic):
+    """
+    MQTT topic filter matching with "+" and "#" wildcards.
+    """
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    for i, part in enumerate(p_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if part != "+" and part != t_parts[i]:
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def _encode_str(value):
+    data = value.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def _packet(packet_type, body, flags=0):
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+class MiniBroker:
+    """
+    Minimal in-process MQTT 3.1.1 broker for load tests and replays.
+
+    Supports CONNECT, PUBLISH (QoS 0/1, retained), SUBSCRIBE with wildcards,
+    UNSUBSCRIBE, PINGREQ and DISCONNECT. No persistence, no authentication.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._sessions = set()
+        self.retained = {}
+        self.received = 0
+        self.delivered = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for session in list(self._sessions):
+            session.writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        self._sessions.add(session)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    if not byte & 0x80:
+                        break
+                    multiplier *= 128
+                body = await reader.readexactly(length) if length else b""
+                if not self._dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Client went away, or the broker is stopping
+            pass
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+
+    def _dispatch(self, session, packet_type, flags, body):
+        if packet_type == 1:  # CONNECT
+            session.send(_packet(2, b"\x00\x00"))
+        elif packet_type == 3:  # PUBLISH
+            qos = (flags >> 1) & 0x03
+            (topic_len,) = struct.unpack_from("!H", body)
+            topic = body[2:2 + topic_len].decode("utf-8")
+            pos = 2 + topic_len
+            if qos:
+                (packet_id,) = struct.unpack_from("!H", body, pos)
+                pos += 2
+                session.send(_packet(4, struct.pack("!H", packet_id)))
+            payload = body[pos:]
+            self.received += 1
+            if flags & 0x01:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            self._route(topic, payload)
+        elif packet_type == 8:  # SUBSCRIBE
+            (packet_id,) = struct.unpack_from("!H", body)
+            pos, granted, new = 2, bytearray(), []
+            while pos < len(body):
+                (n,) = struct.unpack_from("!H", body, pos)
+                pattern = body[pos + 2:pos + 2 + n].decode("utf-8")
+                pos += 3 + n
+                session.subscriptions.add(pattern)
+                new.append(pattern)
+                granted.append(0)
+            session.send(_packet(9, struct.pack("!H", packet_id) + bytes(granted)))
+            for topic, payload in list(self.retained.items()):
+                if any(topic_matches(p, topic) for p in new):
+                    session.send(_packet(3, _encode_str(topic) + payload, flags=0x01))
+        elif packet_type == 10:  # UNSUBSCRIBE
+            (packet_id,) = struct.unpack_from("!H", body)
+            pos = 2
+            while pos < len(body):
+                (n,) = struct.unpack_from("!H", body, pos)
+                session.subscriptions.discard(body[pos + 2:pos + 2 + n].decode("utf-8"))
+                pos += 2 + n
+            session.send(_packet(11, struct.pack("!H", packet_id)))
+        elif packet_type == 12:  # PINGREQ
+            session.send(_packet(13, b""))
+        elif packet_type == 14:  # DISCONNECT
+            return False
+        return True
+
+    def _route(self, topic, payload):
+        frame = None
+        for session in self._sessions:
+            if any(topic_matches(p, topic) for p in session.subscriptions):
+                if frame is None:
+                    frame = _packet(3, _encode_str(topic) + payload)
+                session.send(frame)
+                self.delivered += 1
+
+    def publish(self, topic, payload, retain=False):
+        """
+        Publish from inside the broker (e.g. to simulate Home Assistant commands).
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if retain:
+            self.retained[topic] = payload
+        self._route(topic, payload)
+
+
+class _Session:
+    __slots__ = ("writer", "subscriptions")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscriptions = set()
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+async def _serve(host, port):
+    broker = await MiniBroker(host, port).start()
+    logging.info(f"MiniBroker listening on {broker.host}:{broker.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minimal MQTT broker for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,53 +1,460 @@
 import paho.mqtt.client as mqtt
-import json
+import asyncio
+import collections
 import logging
+import random
+import threading
+import codec
+from discovery import DiscoveryRegistry, HA_STATUS_TOPIC
+from outbox import Outbox
+from mqtt_commands import COMMAND_TOPICS
+
+# Publish priorities, most important first. Under backpressure meter values are
+# dropped first; command echoes (state answering an HA command) are never dropped.
+PRIORITY_COMMAND = 0
+PRIORITY_STATE = 1
+PRIORITY_METER = 2
+
+# "online" while this server is connected to the broker; the broker publishes the
+# "offline" will when the connection is lost, so HA entities do not stay available
+SERVER_STATUS_TOPIC = "ocpp/server/status"
+
+
+class ReconnectBackoff:
+    """
+    Exponential backoff with full jitter for broker (re)connects, so a fleet of
+    servers (or one server after a power cut) does not retry in lockstep.
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self):
+        ceiling = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return random.uniform(self.initial / 2, ceiling)
+
+    def reset(self):
+        self.attempts = 0
+
 
 class MQTTClient:
     def __init__(self, config, event_loop=None):
-        self.config = config 
+        self.config = config
         self.client = mqtt.Client()
         if self.config.get("username") and self.config.get("password"):
             self.client.username_pw_set(self.config["username"], self.config["password"])
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        self.client.will_set(SERVER_STATUS_TOPIC, "offline", retain=True)
         self.command_callback = None
         self.event_loop = event_loop
+        discovery_config = config.get("discovery", {})
+        self.discovery = DiscoveryRegistry(self, discovery_config.get("mode", "device"),
+                                           discovery_config.get("migrate"))
+        self._connected_once = False
+        # Topics to restore after a reconnect (paho does not resubscribe by itself)
+        self._subscriptions = set()
+        self.backoff = ReconnectBackoff(config.get("reconnect_min", 1.0), config.get("reconnect_max", 60.0))
+        self._connect_task = None
+        # Publishes made while the broker is unreachable, flushed at a limited rate on connect
+        outbox_config = config.get("outbox", {})
+        self.outbox = None
+        if outbox_config.get("enabled", True):
+            self.outbox = Outbox(outbox_config.get("path", "mqtt_outbox.bin"),
+                                 outbox_config.get("max_messages", 10000), PRIORITY_METER + 1)
+        self.flush_rate = outbox_config.get("rate", 200)
+        self.flush_batch = outbox_config.get("batch_size", 50)
+        self._flush_task = None
+
+    async def start(self):
+        """
+        Connect to the broker in the background; returns at once. Call from the running loop.
+        """
+        self.event_loop = asyncio.get_running_loop()
+        self._connect_task = asyncio.create_task(self._connect_loop())
+
+    async def _connect_loop(self):
+        # Until the broker answers: jittered exponential backoff, nothing else waits on it.
+        # paho's connect() blocks (DNS lookup, TCP handshake), so it runs in an executor
+        loop = asyncio.get_running_loop()
+        while not (await self._broker_reachable() and await loop.run_in_executor(None, self._try_connect)):
+            delay = self.backoff.next()
+            logging.warning(f"MQTT broker {self.config['broker']}:{self.config['port']} unavailable, "
+                            f"retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        self._started()
+
+    def _started(self):
+        # paho's network thread; it also handles later reconnects (reconnect_delay_set)
+        self.client.reconnect_delay_set(self.backoff.initial, self.backoff.maximum)
+        self.client.loop_start()
+
+    async def _broker_reachable(self, timeout=5.0):
+        # Non-blocking TCP probe: paho's connect() blocks, which must not happen on the
+        # event loop while the broker host is down or unreachable
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.config["broker"], self.config["port"]), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.debug(f"MQTT broker probe failed: {e!r}")
+            return False
+        writer.close()
+        return True
+
+    def _try_connect(self):
         try:
-            self.client.connect(self.config["broker"], self.config["port"])
+            if self._connected_once:
+                self.client.reconnect()
+            else:
+                self.client.connect(self.config["broker"], self.config["port"])
+            return True
         except Exception as e:
-            logging.critical(f"Failed to connect to MQTT broker at {self.config['broker']}:{self.config['port']} - {e}")
-            import sys
-            sys.exit(1)
-        else:
-            self.client.loop_start()
+            logging.error(f"Failed to connect to MQTT broker at {self.config['broker']}:{self.config['port']} - {e}")
+            return False
 
     def set_command_callback(self, callback):
         self.command_callback = callback
 
-    def subscribe_control_topics(self, device_id):
-        for topic in [
-            f"suspend_{device_id}/set",
-            f"unlock_cable_{device_id}/press",
-            f"current_limit_{device_id}/set",
-            f"availability_{device_id}/set"
-        ]:
-            self.client.subscribe(f"ocpp/{topic}")
+    def subscribe(self, topic):
+        self._subscriptions.add(topic)
+        self.client.subscribe(topic)
+
+    def unsubscribe(self, topic):
+        self._subscriptions.discard(topic)
+        self.client.unsubscribe(topic)
+
+    def subscribe_commands(self):
+        # Wildcards: the subscription count does not grow with the fleet
+        for topic in COMMAND_TOPICS:
+            self.subscribe(topic)
 
     def on_message(self, client, userdata, msg):
+        if msg.topic == HA_STATUS_TOPIC:
+            if msg.payload.decode() == "online":
+                self.discovery.republish_all()
+            return
+        topic = msg.topic.removeprefix("ocpp/")
+        payload = msg.payload.decode()
+        self._deliver(topic, payload)
+
+    def _deliver(self, topic, payload):
         if self.command_callback:
-            topic = msg.topic.replace(f"ocpp/", "")
-            payload = msg.payload.decode()
             self.command_callback(topic, payload)
 
     def on_connect(self, client, userdata, flags, rc):
         logging.info(f"Connected to MQTT broker with result code {rc}")
+        # Resend discovery after a broker restart and listen for HA birth messages
+        client.subscribe(HA_STATUS_TOPIC)
+        for topic in list(self._subscriptions):
+            client.subscribe(topic)
+        # Straight to the broker, ahead of anything held in the outbox
+        client.publish(SERVER_STATUS_TOPIC, "online", retain=True)
+        # Broker restart, or configs announced while the broker was still unreachable
+        if self._connected_once or len(self.discovery):
+            self.discovery.republish_all()
+        self._connected_once = True
+        if rc == 0:
+            self.backoff.reset()
+            self._schedule_flush()
 
     def on_disconnect(self, client, userdata, rc):
         logging.warning("Disconnected from MQTT broker")
 
-    def publish(self, topic, payload):
-        logging.debug(f"Publishing {payload} to {topic}")
+    def publish(self, topic, payload, priority=PRIORITY_STATE):
+        logging.debug("Publishing %s to %s", payload, topic)
         if isinstance(payload, (dict, list)):
-            payload = json.dumps(payload)
-        self.client.publish(topic, payload, retain=True)
+            payload = codec.dumpb(payload)
+        # While the outbox is still draining, newer values must queue behind it too
+        if self.outbox is not None and (len(self.outbox) or not self.client.is_connected()):
+            self._hold(topic, payload, priority)
+        elif not self._send(topic, payload, priority) and self.outbox is not None:
+            self._hold(topic, payload, priority)
+
+    def _send(self, topic, payload, priority):
+        # False when the connection is gone and the message should be kept
+        return self.client.publish(topic, payload, retain=True).rc != mqtt.MQTT_ERR_NO_CONN
+
+    def _hold(self, topic, payload, priority):
+        if not self.outbox.put(topic, payload, priority):
+            logging.debug("MQTT outbox full, dropped message for %s", topic)
+        if self._flush_task is None and self.client.is_connected():
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Called from the paho thread (on_connect) as well
+        if self.outbox is not None and len(self.outbox) and self.event_loop is not None:
+            self.event_loop.call_soon_threadsafe(self._start_flush)
+
+    def _start_flush(self):
+        if self._flush_task is None and len(self.outbox):
+            self._flush_task = asyncio.create_task(self._flush_outbox())
+
+    async def _flush_outbox(self):
+        """
+        Send what piled up in the outbox, `flush_batch` messages at a time at no more
+        than `flush_rate` messages/s, so a reconnect (or a whole fleet of servers
+        reconnecting) does not hit the broker with the backlog at once.
+        """
+        sent = 0
+        try:
+            logging.warning(f"Flushing {len(self.outbox)} held MQTT messages at {self.flush_rate}/s")
+            while len(self.outbox) and self.client.is_connected():
+                batch = self.outbox.take(self.flush_batch)
+                for i, (topic, payload, priority) in enumerate(batch):
+                    if not self._send(topic, payload, priority):
+                        # Connection lost mid-batch: put back this one and the rest
+                        for message in batch[i:]:
+                            self.outbox.requeue(*message)
+                        break
+                    sent += 1
+                # Only now may the outbox drop the batch from disk
+                self.outbox.done(batch)
+                await asyncio.sleep(self.flush_batch / self.flush_rate)
+        finally:
+            self._flush_task = None
+        logging.warning(f"Flushed {sent} held MQTT messages, {len(self.outbox)} left")
+
+    def close(self):
+        if self.outbox is not None:
+            self.outbox.close()
+
+
+class PublishQueue:
+    """
+    Bounded publish queue with one FIFO bucket per priority and high/low watermarks.
+
+    Once the depth reaches the high watermark, new meter values are dropped until the
+    writer has drained the queue down to the low watermark. When the queue is full the
+    oldest message of the least important priority is evicted; command messages are
+    never dropped, even if that means going over max_size.
+    """
+
+    def __init__(self, max_size=10000, high_watermark=None, low_watermark=None):
+        self.max_size = max_size
+        self.high_watermark = high_watermark if high_watermark is not None else int(max_size * 0.8)
+        self.low_watermark = low_watermark if low_watermark is not None else int(max_size * 0.2)
+        self._buckets = [collections.deque() for _ in range(PRIORITY_METER + 1)]
+        self._size = 0
+        self._not_empty = asyncio.Event()
+        self.throttled = False
+        self.dropped = [0] * (PRIORITY_METER + 1)
+
+    def put(self, topic, payload, priority=PRIORITY_STATE):
+        """
+        Enqueue a message without blocking. Returns False if the message was dropped.
+        """
+        if self._size >= self.high_watermark:
+            self.throttled = True
+        if self.throttled and priority == PRIORITY_METER:
+            self.dropped[priority] += 1
+            return False
+        if self._size >= self.max_size and not self._evict(priority):
+            self.dropped[priority] += 1
+            return False
+        self._buckets[priority].append((topic, payload, priority))
+        self._size += 1
+        self._not_empty.set()
+        return True
+
+    def _evict(self, priority):
+        # Make room by dropping the oldest message that is less important than, or
+        # as important as, the incoming one. Commands are never evicted.
+        for victim in range(PRIORITY_METER, PRIORITY_COMMAND, -1):
+            if victim < priority:
+                break
+            if self._buckets[victim]:
+                self._buckets[victim].popleft()
+                self._size -= 1
+                self.dropped[victim] += 1
+                return True
+        return priority == PRIORITY_COMMAND
+
+    def get_nowait(self):
+        for bucket in self._buckets:
+            if bucket:
+                self._size -= 1
+                if self._size <= self.low_watermark:
+                    self.throttled = False
+                if not self._size:
+                    self._not_empty.clear()
+                return bucket.popleft()
+        raise asyncio.QueueEmpty
+
+    def drain(self):
+        """
+        Remove everything, returning (topic, payload, priority) tuples in queue order per priority.
+        """
+        items = [item for bucket in self._buckets for item in bucket]
+        for bucket in self._buckets:
+            bucket.clear()
+        self._size = 0
+        self.throttled = False
+        self._not_empty.clear()
+        return items
+
+    async def get(self):
+        while not self._size:
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def __len__(self):
+        return self._size
+
+
+class AsyncMQTTClient(MQTTClient):
+    """
+    MQTT client driven by the asyncio event loop instead of paho's network thread.
+
+    Publishes are queued in a bounded PublishQueue drained by a single writer task,
+    inbound commands are delivered through the `messages()` async iterator.
+    Call `await start()` from the running loop.
+    """
+
+    def __init__(self, config, event_loop=None):
+        queue_config = config.get("queue", {})
+        self.queue = PublishQueue(
+            queue_config.get("max_size", 10000),
+            queue_config.get("high_watermark"),
+            queue_config.get("low_watermark"),
+        )
+        self._inbound = asyncio.Queue()
+        self._tasks = []
+        super().__init__(config, event_loop)
+
+    async def start(self):
+        self.event_loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._connected = asyncio.Event()
+        self._write_idle = asyncio.Event()
+        self._write_idle.set()
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        # Connecting happens in _misc; publishes queue up until then
+        self._tasks = [
+            asyncio.create_task(self._writer()),
+            asyncio.create_task(self._misc()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self.client.disconnect()
+
+    def close(self):
+        # Whatever the writer did not get to survives in the outbox
+        self._spool_queue()
+        super().close()
+
+    def _spool_queue(self):
+        if self.outbox is None:
+            return
+        # Last queued value per topic; a newer one may already be waiting in the outbox
+        latest = {topic: (payload, priority) for topic, payload, priority in self.queue.drain()}
+        for topic, (payload, priority) in latest.items():
+            self.outbox.requeue(topic, payload, priority)
+
+    def _started(self):
+        pass
+
+    # paho external event loop integration. connect() runs in an executor thread and
+    # fires these from there, so they hop to the loop when called off it
+    def _on_loop(self, fn, *args):
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.event_loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self.event_loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._socket_closed, sock)
+
+    def _socket_closed(self, sock):
+        self.event_loop.remove_reader(sock)
+        self.event_loop.remove_writer(sock)
+        self._write_idle.set()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self._register_write, client, sock)
+
+    def _register_write(self, client, sock):
+        self._write_idle.clear()
+        self.event_loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._unregister_write, sock)
+
+    def _unregister_write(self, sock):
+        self.event_loop.remove_writer(sock)
+        self._write_idle.set()
+
+    def on_connect(self, client, userdata, flags, rc):
+        super().on_connect(client, userdata, flags, rc)
+        if rc == 0:
+            self._connected.set()
+
+    def on_disconnect(self, client, userdata, rc):
+        super().on_disconnect(client, userdata, rc)
+        self._connected.clear()
+        # Queued messages go to the outbox so they are kept in order with what comes next
+        self._spool_queue()
+
+    async def _misc(self):
+        # Connect, then keepalive pings and reconnects (loop_forever does this in threaded mode)
+        await self._connect_loop()
+        while True:
+            await asyncio.sleep(1)
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                await self._connect_loop()
+
+    async def _writer(self):
+        # Single writer: waits for the socket buffer to drain between batches so a slow
+        # broker makes the queue grow (and shed meter values) instead of paho's buffer.
+        batch_size = self.config.get("queue", {}).get("batch_size", 64)
+        while True:
+            await self._connected.wait()
+            self._write(*await self.queue.get())
+            for _ in range(batch_size - 1):
+                try:
+                    self._write(*self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await self._write_idle.wait()
+
+    def _write(self, topic, payload, priority):
+        if self.client.publish(topic, payload, retain=True).rc == mqtt.MQTT_ERR_NO_CONN and self.outbox is not None:
+            # Lost the connection mid-batch
+            self.outbox.requeue(topic, payload, priority)
+
+    def _send(self, topic, payload, priority):
+        if not self.queue.put(topic, payload, priority):
+            logging.debug(f"Publish queue full, dropped message for {topic}")
+        return True
+
+    def _deliver(self, topic, payload):
+        # on_message runs on the event loop here, so no thread hop is needed
+        self._inbound.put_nowait((topic, payload))
+
+    async def messages(self):
+        """
+        Async iterator over inbound command messages as (topic, payload) tuples.
+        """
+        while True:
+            yield await self._inbound.get()
+
+
+def create_mqtt_client(config, event_loop=None):
+    """
+    Create the MQTT client for the configured transport ("thread" or "asyncio").
+    """
+    if config.get("transport", "thread") == "asyncio":
+        return AsyncMQTTClient(config, event_loop)
+    return MQTTClient(config, event_loop)
@@ -0,0 +1,91 @@
+import asyncio
+import inspect
+import logging
+
+# One subscription per verb for the whole fleet: command topics are
+# ocpp/<command>_<charge point id>/<verb>
+COMMAND_TOPICS = ("ocpp/+/set", "ocpp/+/press")
+
+# class -> [(command, verb, writeback, attribute name)]
+_routes_cache = {}
+# Running coroutine handlers; the loop only keeps weak references to tasks
+_tasks = set()
+
+
+def command(name, verb="set", writeback=True):
+    """
+    Register a charge point method as the handler of the MQTT command topic
+    ocpp/<name>_<charge point id>/<verb>, the way @on(...) registers OCPP actions.
+
+        @command("current_limit", writeback=False)
+        def on_current_limit_command(self, payload):
+            ...
+
+    The handler gets the payload string and may be a coroutine function. With
+    `writeback` the command is ignored unless allow_writeback is set.
+    """
+    def decorator(func):
+        func._mqtt_command = (name, verb, writeback)
+        return func
+    return decorator
+
+
+def command_routes(cls):
+    """
+    The @command methods of `cls` as (command, verb, writeback, attribute name), cached per class.
+    """
+    routes = _routes_cache.get(cls)
+    if routes is None:
+        routes = _routes_cache[cls] = [
+            (*attr._mqtt_command, name)
+            for name, attr in inspect.getmembers(cls, inspect.isfunction)
+            if hasattr(attr, "_mqtt_command")
+        ]
+    return routes
+
+
+class CommandRoute:
+    """
+    One entry of the dispatch table: a command topic of one connected charge point.
+    """
+    __slots__ = ("charge_point", "command", "handler", "writeback")
+
+    def __init__(self, charge_point, command, handler, writeback):
+        self.charge_point = charge_point
+        self.command = command
+        self.handler = handler
+        self.writeback = writeback
+
+    def run(self, payload, config):
+        """
+        Call the handler; a coroutine result is run as a task. Returns False if the command was refused.
+        """
+        if self.writeback and not config.get("allow_writeback", False):
+            logging.info(f"{self.charge_point.id}: writeback disabled, {self.command} command ignored")
+            return False
+        try:
+            result = self.handler(payload)
+        except Exception as e:
+            logging.exception(f"{self.charge_point.id}: {self.command} command with payload {payload!r} failed: {e}")
+            return False
+        if inspect.isawaitable(result):
+            task = asyncio.create_task(self._finish(result, payload))
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+        return True
+
+    async def _finish(self, result, payload):
+        try:
+            await result
+        except Exception as e:
+            logging.exception(f"{self.charge_point.id}: {self.command} command with payload {payload!r} failed: {e}")
+
+
+def command_table(charge_point):
+    """
+    Dispatch table entries of one charge point: topic without "ocpp/" -> CommandRoute.
+    """
+    return {
+        f"{name}_{charge_point.id}/{verb}": CommandRoute(charge_point, name, getattr(charge_point, attr), writeback)
+        for name, verb, writeback, attr in command_routes(type(charge_point))
+    }
@@ -0,0 +1,125 @@
+import argparse
+import json
+import time
+from datetime import datetime
+import codec
+
+INBOUND = "in"
+OUTBOUND = "out"
+
+
+class TraceRecorder:
+    """
+    Records OCPP frames as JSON lines: [seconds since start (monotonic), charge point id, "in"/"out", frame].
+
+    Lines go into a large write buffer; the owner calls flush() periodically and close()
+    on shutdown, so recording does not add a disk write per frame.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1 << 16)
+        self._clock = clock
+        self._start = clock()
+        self.frames = 0
+
+    def record(self, charge_point_id, direction, message):
+        t = round(self._clock() - self._start, 6)
+        self._file.write(codec.dumps([t, charge_point_id, direction, message]))
+        self._file.write("\n")
+        self.frames += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path):
+    """
+    Yield (t, charge_point_id, direction, frame) from a trace file.
+
+    Recordings appended by later server runs restart at t=0; they are shifted to follow on.
+    """
+    offset = last = 0.0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            t, cp_id, direction, message = json.loads(line)
+            if t + offset < last:
+                offset = last - t
+            last = t + offset
+            yield last, cp_id, direction, message
+
+
+def trace_from_log(path):
+    """
+    Yield trace entries from the "receive message"/"send" lines of a text server log.
+
+    Log timestamps only have millisecond resolution.
+    """
+    start = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            for marker, direction in ((": receive message ", INBOUND), (": send ", OUTBOUND)):
+                idx = line.find(marker)
+                if idx >= 0:
+                    break
+            else:
+                continue
+            head = line[:idx]
+            try:
+                ts = datetime.strptime(head[:23], "%Y-%m-%d %H:%M:%S,%f").timestamp()
+            except ValueError:
+                continue
+            if start is None:
+                start = ts
+            cp_id = head[head.find("] ") + 2:]
+            yield round(ts - start, 3), cp_id, direction, line[idx + len(marker):].strip()
+
+
+def write_trace(entries, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(list(entry), separators=(",", ":")) + "\n")
+
+
+def summary(entries):
+    """
+    Frame counts per (direction, action) and the trace duration.
+    """
+    counts = {}
+    duration = 0.0
+    for t, cp_id, direction, message in entries:
+        duration = t
+        try:
+            frame = json.loads(message)
+        except ValueError:
+            continue
+        action = frame[2] if frame and frame[0] == 2 else "response"
+        counts[(direction, action)] = counts.get((direction, action), 0) + 1
+    return counts, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCPP trace tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("from-log", help="Build a trace from a server log")
+    convert.add_argument("log")
+    convert.add_argument("trace")
+    show = sub.add_parser("summary", help="Frame counts per action")
+    show.add_argument("trace")
+    args = parser.parse_args()
+
+    if args.command == "from-log":
+        write_trace(trace_from_log(args.log), args.trace)
+    counts, duration = summary(read_trace(args.trace))
+    print(f"{args.trace}: {sum(counts.values())} frames over {duration:.1f} s")
+    for (direction, action), count in sorted(counts.items()):
+        print(f"  {direction:>3} {action:<24} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+import uuid
+from ocpp.charge_point import camel_to_snake_case
+from ocpp.messages import MessageType
+from ocpp.v16 import call_result
+import codec
+from metrics import Histogram
+
+
+class OutboundCallError(Exception):
+    """
+    The charger answered a CSMS-initiated call with a CALLERROR.
+    """
+
+    def __init__(self, action, error_code, description="", details=None):
+        super().__init__(f"{action} failed: {error_code} {description}".strip())
+        self.action = action
+        self.error_code = error_code
+        self.description = description
+        self.details = details or {}
+
+
+class RetryPolicy:
+    """
+    How often to retry a call, and after which delays (exponential backoff).
+    """
+
+    def __init__(self, attempts=1, backoff=1.0, factor=2.0, retry_on_timeout=True, retry_on_errors=()):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.retry_on_timeout = retry_on_timeout
+        self.retry_on_errors = frozenset(retry_on_errors)
+
+    def delay(self, attempt):
+        return self.backoff * (self.factor ** (attempt - 1))
+
+    def should_retry(self, attempt, error):
+        if attempt >= self.attempts:
+            return False
+        if isinstance(error, asyncio.TimeoutError):
+            return self.retry_on_timeout
+        return isinstance(error, OutboundCallError) and error.error_code in self.retry_on_errors
+
+
+class OutboundCallManager:
+    """
+    Sends CSMS-initiated calls to one charger and correlates the responses.
+
+    Each call registers a future under its unique_id; `resolve` completes it when
+    the matching CALLRESULT or CALLERROR arrives. Calls time out individually, are
+    limited to `max_concurrency` in flight (OCPP 1.6 allows one), are retried per
+    RetryPolicy, and return the typed ocpp.v16.call_result payload.
+    `on_timeout(action)` is called for every attempt that timed out.
+    """
+
+    def __init__(self, charge_point, timeout=30, max_concurrency=1, retry_policy=None, on_timeout=None):
+        self.charge_point = charge_point
+        self.on_timeout = on_timeout
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # unique_id -> (action, future)
+        self._pending = {}
+        # action -> Histogram of response times
+        self.latency = {}
+        self.timeouts = {}
+        self.errors = {}
+
+    async def call(self, action, payload, timeout=None, retry_policy=None):
+        policy = retry_policy or self.retry_policy
+        attempt = 1
+        while True:
+            try:
+                return await self._call_once(action, payload, timeout or self.timeout)
+            except (asyncio.TimeoutError, OutboundCallError) as e:
+                if not policy.should_retry(attempt, e):
+                    raise
+                delay = policy.delay(attempt)
+                logging.warning(f"{self.charge_point.id}: {action} attempt {attempt} failed ({e!r}), retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _call_once(self, action, payload, timeout):
+        async with self._semaphore:
+            unique_id = str(uuid.uuid4())
+            future = asyncio.get_running_loop().create_future()
+            self._pending[unique_id] = (action, future)
+            started = time.monotonic()
+            try:
+                await self.charge_point._send(codec.dumps([MessageType.Call, unique_id, action, payload]))
+                response = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self.timeouts[action] = self.timeouts.get(action, 0) + 1
+                if self.on_timeout is not None:
+                    self.on_timeout(action)
+                raise asyncio.TimeoutError(f"{self.charge_point.id}: no response to {action} within {timeout}s")
+            finally:
+                self._pending.pop(unique_id, None)
+            self.latency.setdefault(action, Histogram()).observe(time.monotonic() - started)
+
+        if response.message_type_id == MessageType.CallError:
+            self.errors[action] = self.errors.get(action, 0) + 1
+            raise OutboundCallError(action, response.error_code, response.error_description, response.error_details)
+        return getattr(call_result, action)(**camel_to_snake_case(response.payload))
+
+    def resolve(self, message):
+        """
+        Complete the pending call a CALLRESULT/CALLERROR belongs to. Returns False if unknown.
+        """
+        pending = self._pending.get(message.unique_id)
+        if pending is None:
+            return False
+        future = pending[1]
+        if not future.done():
+            future.set_result(message)
+        return True
+
+    def cancel_all(self):
+        for action, future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"{self.charge_point.id}: connection closed before {action} was answered"))
+        self._pending.clear()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._pending),
+            "timeouts": dict(self.timeouts),
+            "errors": dict(self.errors),
+            "latency": {action: h.summary() for action, h in self.latency.items()},
+        }
@@ -0,0 +1,212 @@
+import logging
+import os
+import struct
+import threading
+
+# Record on disk: priority, topic length, payload length, then topic and payload bytes
+_HEADER = struct.Struct("!BHI")
+
+
+def _as_bytes(payload):
+    # Same conversion paho applies on publish
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, bytearray):
+        return bytes(payload)
+    if payload is None:
+        return b""
+    return str(payload).encode("utf-8")
+
+
+class Outbox:
+    """
+    Bounded, disk-backed holding area for MQTT publishes made while the broker is down.
+
+    Everything this server publishes is retained, so only the latest payload per topic
+    matters: putting a topic that is already waiting replaces it (and moves it to the
+    back), which keeps the outbox at one entry per topic however long the outage lasts.
+    When `max_messages` topics are waiting, the oldest entry of the least important
+    priority makes room; command echoes are never dropped.
+
+    Each put is appended to `path` and replayed on startup (last record per topic
+    wins), so a restart during an outage does not lose state either. The file is
+    rewritten with just the live entries once it holds mostly superseded records.
+    Messages handed out by `take` stay on disk until `done` confirms their batch, and
+    the file is only truncated once nothing is waiting or in flight.
+    Thread-safe: the paho thread publishes too.
+    """
+
+    def __init__(self, path="mqtt_outbox.bin", max_messages=10000, priorities=3):
+        self.path = path
+        self.max_messages = max_messages
+        # One insertion-ordered dict per priority: topic -> payload bytes
+        self._entries = [{} for _ in range(priorities)]
+        self._priority = {}
+        # topic -> (payload, priority) taken for sending but not confirmed yet
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._records = 0
+        self.dropped = [0] * priorities
+        self.compacted = 0
+        if path:
+            self._load()
+            # Start from a clean file with just the live entries; also opens it for appending
+            self._rewrite()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            priority, topic_len, payload_len = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            end = start + topic_len + payload_len
+            if end > len(data) or priority >= len(self._entries):
+                # Torn last write (crash mid-append) or garbage: keep what came before
+                logging.warning(f"Ignoring {len(data) - offset} trailing bytes in MQTT outbox {self.path}")
+                break
+            topic = data[start:start + topic_len].decode("utf-8")
+            # Same bound as put(): evictions are not logged, so they happen again here
+            if self._admit(topic, priority):
+                self._store(topic, data[start + topic_len:end], priority)
+            offset = end
+        if self._priority:
+            logging.warning(f"MQTT outbox {self.path}: {len(self._priority)} messages from the last run to flush")
+
+    def put(self, topic, payload, priority):
+        """
+        Hold `payload` for `topic`, replacing any earlier one. Returns False if dropped.
+        """
+        payload = _as_bytes(payload)
+        with self._lock:
+            if not self._admit(topic, priority):
+                return False
+            self._store(topic, payload, priority)
+            self._append(topic, payload, priority)
+        return True
+
+    def _admit(self, topic, priority):
+        # Room for a new topic, evicting a less important one if the outbox is full
+        if topic not in self._priority and len(self._priority) >= self.max_messages and not self._evict(priority):
+            self.dropped[priority] += 1
+            return False
+        return True
+
+    def requeue(self, topic, payload, priority):
+        """
+        Put back a message that could not be sent, unless a newer one for the topic arrived meanwhile.
+        """
+        with self._lock:
+            if topic in self._priority:
+                return
+        self.put(topic, payload, priority)
+
+    def _store(self, topic, payload, priority):
+        previous = self._priority.get(topic)
+        if previous is not None:
+            del self._entries[previous][topic]
+        self._entries[priority][topic] = payload
+        self._priority[topic] = priority
+
+    def _evict(self, priority):
+        # Oldest entry of a less (or equally) important priority; commands are never evicted
+        for victim in range(len(self._entries) - 1, 0, -1):
+            if victim < priority:
+                break
+            bucket = self._entries[victim]
+            if bucket:
+                topic = next(iter(bucket))
+                del bucket[topic]
+                del self._priority[topic]
+                self.dropped[victim] += 1
+                return True
+        return priority == 0
+
+    def take(self, n):
+        """
+        Remove and return up to `n` messages as (topic, payload, priority), most important first.
+
+        They stay on disk until `done(batch)`; requeue the ones that could not be sent first.
+        """
+        batch = []
+        with self._lock:
+            for priority, bucket in enumerate(self._entries):
+                while bucket and len(batch) < n:
+                    topic = next(iter(bucket))
+                    payload = bucket.pop(topic)
+                    batch.append((topic, payload, priority))
+                    del self._priority[topic]
+                    self._in_flight[topic] = (payload, priority)
+        return batch
+
+    def done(self, batch):
+        """
+        The batch from `take` was sent (or requeued); truncate the file if nothing is left.
+        """
+        with self._lock:
+            for topic, _, _ in batch:
+                self._in_flight.pop(topic, None)
+            if not self._priority and not self._in_flight:
+                self._truncate()
+
+    def _append(self, topic, payload, priority):
+        if self._file is None:
+            return
+        encoded = topic.encode("utf-8")
+        try:
+            self._file.write(_HEADER.pack(priority, len(encoded), len(payload)) + encoded + payload)
+            # Into the OS page cache: survives a process crash; no fsync per publish
+            self._file.flush()
+        except OSError as e:
+            logging.error(f"Writing MQTT outbox {self.path} failed: {e}")
+            return
+        self._records += 1
+        if self._records > 1000 and self._records > 2 * len(self._priority):
+            self._rewrite()
+
+    def _rewrite(self):
+        # Compaction: write the live entries to a new file and swap it in atomically
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                # In-flight messages first: a newer held value for the topic wins on replay
+                entries = [(topic, payload, priority) for topic, (payload, priority) in self._in_flight.items()]
+                for priority, bucket in enumerate(self._entries):
+                    entries.extend((topic, payload, priority) for topic, payload in bucket.items())
+                for topic, payload, priority in entries:
+                    encoded = topic.encode("utf-8")
+                    f.write(_HEADER.pack(priority, len(encoded), len(payload)) + encoded + payload)
+            if self._file is not None:
+                self._file.close()
+            os.replace(tmp, self.path)
+            self._file = open(self.path, "ab")
+        except OSError as e:
+            logging.error(f"Compacting MQTT outbox {self.path} failed: {e}")
+            return
+        self._records = len(self._priority) + len(self._in_flight)
+        self.compacted += 1
+
+    def _truncate(self):
+        if self._file is None or not self._records:
+            return
+        try:
+            self._file.truncate(0)
+        except OSError as e:
+            logging.error(f"Truncating MQTT outbox {self.path} failed: {e}")
+            return
+        self._records = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self._priority)
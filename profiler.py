@@ -0,0 +1,126 @@
+import asyncio
+import cProfile
+import io
+import logging
+import math
+import os
+import pstats
+import time
+
+# Functions reported on their own, besides the overall top list: OCPP handlers
+# (on_<action> in evcharger_handler.py) and the MQTT publish paths
+HANDLER_FILE = "evcharger_handler.py"
+PUBLISH_PATHS = {
+    "mqtt_client.py": ("publish", "put", "_writer"),
+    "state_publisher.py": ("publish",),
+    "discovery.py": ("announce", "republish_all"),
+}
+
+
+class RuntimeProfiler:
+    """
+    cProfile on the event loop thread for a limited time, switched on while the server runs.
+
+    `start(seconds)` enables the profiler (everything on the loop runs on that one
+    thread: handlers, MQTT publishing, the asyncio transport's writer) and disables
+    it again after `seconds`. The result goes to `<dir>/profile-<time>.prof` (for
+    pstats/snakeviz) plus a `.txt` report with the top functions and a section per
+    OCPP handler and MQTT publish path. Costs nothing while off.
+    """
+
+    def __init__(self, output_dir="logs/profiles", default_seconds=30, max_seconds=600, top=40):
+        self.output_dir = output_dir
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+        self.top = top
+        self._profile = None
+        self._started = None
+        self.last_report = None
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self, seconds=None):
+        """
+        Profile for `seconds` (default_seconds when None; numeric strings are accepted).
+        Returns False if already running or the duration is not a positive number.
+        """
+        if self._profile is not None:
+            logging.warning("Profiler already running, ignoring start request")
+            return False
+        # The duration comes straight from an MQTT payload
+        requested = self.default_seconds if seconds is None else seconds
+        try:
+            seconds = float(requested)
+        except (TypeError, ValueError):
+            seconds = math.nan
+        if not math.isfinite(seconds) or seconds <= 0:
+            logging.warning(f"Invalid profiling duration {requested!r}, ignoring start request")
+            return False
+        seconds = min(seconds, self.max_seconds)
+        self._profile = cProfile.Profile()
+        self._started = time.time()
+        self._profile.enable()
+        asyncio.get_running_loop().call_later(seconds, self.stop)
+        logging.warning(f"Profiling the event loop for {seconds:.0f} s")
+        return True
+
+    def stop(self):
+        profile, self._profile = self._profile, None
+        if profile is None:
+            return
+        profile.disable()
+        base = os.path.join(self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(self._started)))
+        # Sorting and writing the report would be a CPU spike of its own on the loop
+        asyncio.get_running_loop().run_in_executor(None, self._dump, profile, base, time.time() - self._started)
+
+    def _dump(self, profile, base, elapsed):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(self.report(profile, elapsed))
+            self.last_report = base + ".txt"
+            logging.warning(f"Profile written to {base}.txt and {base}.prof")
+        except Exception as e:
+            logging.exception(f"Writing profile {base} failed: {e}")
+
+    def report(self, profile, elapsed):
+        stats = pstats.Stats(profile)
+        out = io.StringIO()
+        out.write(f"Event loop profile over {elapsed:.1f} s\n\n")
+        out.write(f"== Top {self.top} by cumulative time ==\n")
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(self.top)
+
+        handlers, publishers = [], []
+        for key in stats.stats:
+            filename, _, name = key
+            base = os.path.basename(filename)
+            if base == HANDLER_FILE and name.startswith("on_"):
+                handlers.append(key)
+            elif name in PUBLISH_PATHS.get(base, ()):
+                publishers.append(key)
+        for title, keys in (("OCPP handlers", handlers), ("MQTT publish paths", publishers)):
+            out.write(f"\n== {title} ==\n")
+            keys.sort(key=lambda k: stats.stats[k][3], reverse=True)
+            for key in keys:
+                self._function(out, stats, key, elapsed)
+        return out.getvalue()
+
+    def _function(self, out, stats, key, elapsed):
+        _, calls, own, cumulative, _ = stats.stats[key]
+        filename, line, name = key
+        per_call = cumulative / calls * 1e6 if calls else 0.0
+        out.write(
+            f"\n{name} ({os.path.basename(filename)}:{line}): {calls} calls, {cumulative * 1000:.1f} ms total "
+            f"({cumulative / elapsed:.1%} of the loop), {per_call:.0f} us/call, own {own * 1000:.1f} ms\n"
+        )
+        # Where the time goes inside, heaviest callees first
+        if stats.all_callees is None:
+            stats.calc_callees()
+        callees = stats.all_callees.get(key, {})
+        ranked = sorted(callees.items(), key=lambda item: item[1][3], reverse=True)[:8]
+        for (c_file, c_line, c_name), (c_calls, _, _, c_cumulative) in ranked:
+            out.write(f"    {c_cumulative * 1000:9.1f} ms {c_calls:7d}x  {c_name} ({os.path.basename(c_file)}:{c_line})\n")
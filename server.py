@@ -1,129 +1,336 @@
+import time
+# Startup timings (listening, first charger accepted) are measured from here
+STARTED = time.monotonic()
 import asyncio
-import json
 import logging
+import signal
 import websockets
-from ocpp.routing import on
-from ocpp.v16 import ChargePoint as cp
+import websockets.exceptions
+from ocpp.routing import create_route_map
 from evcharger_handler import EVChargePoint
-from mqtt_client import MQTTClient
-# For robust logging encoding
-import os
+from mqtt_client import PRIORITY_COMMAND, PRIORITY_METER, PRIORITY_STATE, AsyncMQTTClient, create_mqtt_client
+from state_publisher import StatePublisher
+from config_manager import ConfigManager
+from session_store import SessionStore
+from load_manager import SiteLoadManager
+from timeseries import MeterHistory
+from log_setup import setup_logging
+from ocpp_trace import TraceRecorder
+from metrics import ServerMetrics
+from liveness import LivenessMonitor
+from profiler import RuntimeProfiler
+from validation_policy import configure_validation, preload_validators
+from charge_point_registry import ChargePointRegistry, charge_point_id_from_path, request_path, valid_charge_point_id
 import sys
 
-# Load settings
-with open("config//config.json") as f:
-    config = json.load(f)
-
-# Ensure log directory exists
-log_file = config["logging"]["file"]
-log_dir = os.path.dirname(log_file)
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Setup logging: all logs to file, only warnings and above to console
-log_level = getattr(logging, config["logging"]["level"].upper())
-formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-# Remove all handlers associated with the root logger object.
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-file_handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
-file_handler.setFormatter(formatter)
-file_handler.setLevel(log_level)
-console_stream = open(sys.stdout.fileno(), mode='w', encoding='utf-8', errors='replace', buffering=1)
-console_handler = logging.StreamHandler(console_stream)
-console_handler.setFormatter(formatter)
-console_handler.setLevel(getattr(logging, config["logging"]["to_console_level"].upper()))
-root_logger = logging.getLogger()
-root_logger.setLevel(log_level)
-root_logger.handlers = []
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
+# Load settings once; the manager reloads the snapshot when the file changes
+config_manager = ConfigManager("config//config.json")
+config = config_manager.snapshot
+
+# Logging: file and console, written from a background thread unless logging.mode is "direct"
+log_listener = setup_logging(config["logging"])
 
-import asyncio
 # main_loop will be set in main()
 main_loop = None
-charge_points = {}
-mqtt_client = MQTTClient(config["mqtt"], main_loop)
+charge_points = ChargePointRegistry()
+mqtt_client = create_mqtt_client(config["mqtt"], main_loop)
+# One state publisher for the whole fleet so its counters show total broker savings
+state_publisher = StatePublisher(mqtt_client, config.get("state_publisher"))
+# Charging sessions per charger; imports the open transaction from the old persist.json once
+session_store = SessionStore(
+    config.get("session_store", {}).get("path", "sessions.db"),
+    legacy_file="persist.json",
+    legacy_charge_point_id=config["ocpp"]["charge_point_id"],
+)
 
-async def on_connect(websocket):
+# Optional recording of all OCPP frames for bench/replay_trace.py
+trace_config = config.get("trace")
+tracer = TraceRecorder(trace_config["file"]) if trace_config else None
+
+# Counters behind the /metrics endpoint; /healthz fails above this event-loop lag (s)
+server_metrics = ServerMetrics()
+HEALTHZ_MAX_LAG = config.get("metrics", {}).get("healthz_max_lag", 5.0)
+
+# On-demand cProfile of the event loop: SIGUSR1 or a number of seconds on PROFILE_TOPIC
+profiling_config = config.get("profiling", {})
+profiler = RuntimeProfiler(
+    profiling_config.get("dir", "logs/profiles"),
+    default_seconds=profiling_config.get("seconds", 30),
+)
+PROFILE_TOPIC = "admin/profile/set"
+
+
+def dispatch_command(topic, payload, received=None):
     """
-    Handle new incoming WebSocket connections from EV chargers.
+    Route an incoming MQTT command to the owning charge point. Runs on the event loop.
+
+    `received` is the time.perf_counter() at which the MQTT message arrived; routing
+    latency is measured from there until the handler ran.
+    """
+    if received is None:
+        received = time.perf_counter()
+    logging.info("dispatch_command called with topic=%s, payload=%s", topic, payload)
+    if topic == PROFILE_TOPIC:
+        profiler.start(payload.strip() or None)
+        return
+    route = charge_points.route_command(topic)
+    if route is None:
+        logging.error(f"No connected charge point has command topic {topic}")
+        return
+    route.run(payload, config_manager.snapshot)
+    server_metrics.observe_command(route.command, time.perf_counter() - received)
+
+
+def handle_command(topic, payload):
+    """
+    Glue for the threaded MQTT transport: hop from paho's network thread to the event loop.
+    """
+    try:
+        if main_loop is not None:
+            main_loop.call_soon_threadsafe(dispatch_command, topic, payload, time.perf_counter())
+        else:
+            logging.error("main_loop is None! Cannot schedule dispatch_command.")
+    except Exception as e:
+        logging.exception(f"Exception while scheduling dispatch_command: {e}")
+
+
+async def consume_commands():
     """
-    
-    cp_id = config["ocpp"]["charge_point_id"]
-    charge_point = EVChargePoint(cp_id, websocket, mqtt_client, config)
-    # Store the charge_point instance globally
-    charge_points[cp_id] = charge_point
-
-    # Publish MQTT discovery for controls
-    charge_point.publish_control_discovery()
-    # Publish MQTT discovery for last_charging_start sensor
-    charge_point.publish_last_charging_start_sensor()
-    # Subscribe to control topics
-    mqtt_client.subscribe_control_topics(cp_id)
-
-    main_loop = None  # Will be set in main()
-
-    # Glue: handle incoming MQTT commands
-    def handle_command(topic, payload):
-        logging.info(f"handle_command called with topic={topic}, payload={payload}")
-        import json
-        with open("config//config.json") as f:
-            config = json.load(f)
-        # Use the correct charge_point instance from the global dict
-        cp_id = config["ocpp"]["charge_point_id"]
-        cp = charge_points.get(cp_id)
-        if cp is None:
-            logging.error(f"No charge_point instance found for id {cp_id}")
-            return
+    Glue for the asyncio MQTT transport: commands arrive on the event loop already.
+    """
+    async for topic, payload in mqtt_client.messages():
         try:
-            global main_loop
-            logging.info(f"Scheduling handle_mqtt_command on main event loop... main_loop={main_loop}, cp={cp}, cp_id={cp_id}")
-            def _debug_task():
-                logging.info(f"IN main_loop: about to create_task for handle_mqtt_command (cp={cp}, cp_id={cp_id})")
-                asyncio.create_task(cp.handle_mqtt_command(topic, payload, config))
-            if main_loop is not None:
-                main_loop.call_soon_threadsafe(_debug_task)
-                logging.info("Scheduled handle_mqtt_command successfully.")
-            else:
-                logging.error("main_loop is None! Cannot schedule handle_mqtt_command.")
+            dispatch_command(topic, payload)
         except Exception as e:
-            logging.exception(f"Exception while scheduling handle_mqtt_command: {e}")
+            logging.exception(f"Exception while dispatching MQTT command: {e}")
+
+
+# Running close handshakes; the loop only keeps weak references to tasks
+_close_tasks = set()
+
+
+def close_connection(charge_point, reason):
+    # The charge point's own on_connect finally does the cleanup once the socket is closed;
+    # close() waits for the closing handshake (up to close_timeout), so it runs as a task
+    task = asyncio.create_task(charge_point._connection.close(1001, reason))
+    _close_tasks.add(task)
+    task.add_done_callback(_close_tasks.discard)
+
+
+def on_idle(charge_point):
+    """
+    A charger sent nothing for ocpp.idle_timeout seconds: mark it offline and close the socket.
+    """
+    logging.warning(f"{charge_point.id}: no message for {liveness.timeout:.0f}s, closing the connection")
+    charge_point.publish_connection(False)
+    close_connection(charge_point, "idle timeout")
+
+
+# Silent chargers (open but idle, or half-open sockets) are found by one timer wheel
+liveness = LivenessMonitor(config["ocpp"].get("idle_timeout", 90), on_idle=on_idle)
+
+
+def on_site_allocation(cp_id, amps):
+    """
+    Push a changed site allocation to the charger it belongs to.
+    """
+    cp = charge_points.get(cp_id)
+    if cp is not None:
+        cp.apply_site_limit(amps)
+
+
+# Optional site-level smart charging across all chargers behind one main fuse
+site_config = config.get("site")
+load_manager = None
+if site_config:
+    load_manager = SiteLoadManager(
+        site_config["budget"],
+        min_current=site_config.get("min_current", config["ev"]["min_current"]),
+        headroom=site_config.get("headroom", 2.0),
+        on_change=on_site_allocation,
+    )
 
-    mqtt_client.set_command_callback(handle_command)
 
-  
+# Per-charger meter history (timeseries.MeterHistory), kept across reconnects
+meter_histories = {}
+# cp_id -> time.monotonic() when it disconnected; its history is dropped after evict_after
+history_released = {}
+HISTORY_EVICT_AFTER = config.get("timeseries", {}).get("evict_after", 86400)
+
+
+def meter_history(cp_id):
+    history_released.pop(cp_id, None)
+    history = meter_histories.get(cp_id)
+    if history is None:
+        history = meter_histories[cp_id] = MeterHistory(config.get("timeseries"))
+    return history
+
+
+def evict_meter_histories():
+    """
+    Drop the history of chargers that have been gone for more than timeseries.evict_after seconds.
+    """
+    cutoff = time.monotonic() - HISTORY_EVICT_AFTER
+    for cp_id, released in list(history_released.items()):
+        if released < cutoff and cp_id not in charge_points:
+            del history_released[cp_id]
+            meter_histories.pop(cp_id, None)
+            logging.info(f"{cp_id}: meter history dropped after {HISTORY_EVICT_AFTER:.0f}s offline")
+
+
+def on_config_changed(snapshot, changed):
+    """
+    Push a reloaded config to every connected charge point.
+    """
+    for charge_point in charge_points:
+        charge_point.apply_config(snapshot, changed)
+
+
+async def on_connect(websocket):
+    """
+    Handle new incoming WebSocket connections from EV chargers.
+    """
+    # Chargers connect to ws://host:port/<cp_id>; bare root falls back to the configured id
+    cp_id = charge_point_id_from_path(request_path(websocket), config["ocpp"]["charge_point_id"])
+    if not valid_charge_point_id(cp_id):
+        # process_http_request already refuses these; this covers the legacy websockets API
+        logging.warning(f"Rejected charger with invalid id {cp_id!r} from {websocket.remote_address}")
+        await websocket.close(1008, "invalid charge point id")
+        return
+    charge_point = EVChargePoint(cp_id, websocket, mqtt_client, config_manager.snapshot,
+                                 state_publisher=state_publisher, session_store=session_store,
+                                 load_manager=load_manager, history=meter_history(cp_id),
+                                 tracer=tracer, metrics=server_metrics, liveness=liveness)
+    previous = charge_points.register(charge_point)
+    server_metrics.connected += 1
+    # Everything after register() is inside the try, so the finally always undoes it
     try:
-        logging.info(f"New connection from {websocket.remote_address}")
+        if previous is not None:
+            # The charger reconnected, so its old socket is dead even if TCP has not noticed yet
+            liveness.forget(previous)
+            close_connection(previous, "replaced by a new connection")
+        liveness.seen(charge_point)
+        server_metrics.connections += 1
+        if server_metrics.first_connection_after is None:
+            server_metrics.first_connection_after = time.monotonic() - STARTED
+            logging.info(f"First charger accepted {server_metrics.first_connection_after:.2f}s after start")
+
+        # Availability of all the charger's HA entities
+        charge_point.publish_connection(True)
+        # Publish MQTT discovery for controls
+        charge_point.publish_control_discovery()
+        # Publish MQTT discovery for last_charging_start sensor
+        charge_point.publish_last_charging_start_sensor()
+        # Publish MQTT discovery for session energy and cost sensors
+        charge_point.publish_session_energy_discovery()
+        logging.info(f"New connection from {websocket.remote_address} as {cp_id} ({len(charge_points)} connected)")
         await charge_point.start()
+    except websockets.exceptions.ConnectionClosedOK:
+        logging.info(f"{cp_id}: WebSocket closed by the charger")
     except websockets.exceptions.ConnectionClosedError as e:
-        logging.error(f"WebSocket connection closed unexpectedly: {e}")
+        logging.error(f"{cp_id}: WebSocket connection closed unexpectedly: {e}")
     except Exception as e:
-        logging.exception(f"Connection error: {e}")
+        logging.exception(f"{cp_id}: Connection error: {e}")
     finally:
-        logging.info(f"Connection closed for {websocket.remote_address}")
+        server_metrics.connected -= 1
+        liveness.forget(charge_point)
+        # A newer connection of the same charger may already have taken over the entry
+        if charge_points.unregister(charge_point):
+            history_released[cp_id] = time.monotonic()
+            charge_point.publish_connection(False)
+        logging.info(f"{cp_id}: Connection closed for {websocket.remote_address} ({len(charge_points)} connected)")
+
+def mqtt_metrics():
+    """
+    Gauges and counters of the MQTT publish path for /metrics.
+    """
+    gauges = {"mqtt_connected": int(mqtt_client.client.is_connected())}
+    counters = {}
+    queue = getattr(mqtt_client, "queue", None)
+    if queue is not None:
+        # asyncio transport: our own bounded publish queue
+        gauges["mqtt_publish_queue_depth"] = len(queue)
+        gauges["mqtt_publish_queue_throttled"] = int(queue.throttled)
+        counters["mqtt_publish_dropped_total"] = {
+            (("priority", name),): queue.dropped[priority]
+            for priority, name in ((PRIORITY_COMMAND, "command"), (PRIORITY_STATE, "state"), (PRIORITY_METER, "meter"))
+        }
+    outbox = mqtt_client.outbox
+    if outbox is not None:
+        # Messages held while the broker was unreachable
+        gauges["mqtt_outbox_depth"] = len(outbox)
+        counters["mqtt_outbox_dropped_total"] = {
+            (("priority", name),): outbox.dropped[priority]
+            for priority, name in ((PRIORITY_COMMAND, "command"), (PRIORITY_STATE, "state"), (PRIORITY_METER, "meter"))
+        }
+    counters["mqtt_state_published_total"] = state_publisher.published
+    counters["mqtt_state_suppressed_total"] = state_publisher.suppressed
+    return gauges, counters
+
+
+def http_response(connection, status, body, content_type="text/plain; charset=utf-8"):
+    if connection is None:
+        # Legacy websockets API: (status, headers, body)
+        return status, [("Content-Type", content_type)], body.encode()
+    response = connection.respond(status, body)
+    # Headers is a multidict: assigning would add a second Content-Type
+    del response.headers["Content-Type"]
+    response.headers["Content-Type"] = content_type
+    return response
+
+
+async def process_http_request(*args):
+    """
+    process_request hook: serves /metrics and /healthz, rejects other plain HTTP
+    requests and lets WebSocket upgrades through.
+
+    Called as (connection, request) by the websockets asyncio API and as
+    (path, request_headers) by the legacy one.
+    """
+    if isinstance(args[0], str):
+        connection, path, headers = None, args[0], args[1]
+    else:
+        connection, path, headers = args[0], args[1].path, args[1].headers
 
-async def reject_non_websocket(path, request_headers):
-    # request_headers is a websockets.http11.Request
-    headers = request_headers.headers
+    route = path.split("?", 1)[0]
+    if route == "/metrics":
+        gauges, counters = mqtt_metrics()
+        gauges["ocpp_outbound_in_flight"] = sum(len(charge_point.outbound) for charge_point in charge_points)
+        gauges["ocpp_registered_chargers"] = len(charge_points)
+        gauges["ocpp_liveness_watched"] = len(liveness)
+        counters["ocpp_idle_closed_total"] = liveness.expired
+        body = server_metrics.render(gauges, counters)
+        return http_response(connection, 200, body, "text/plain; version=0.0.4; charset=utf-8")
+    if route == "/healthz":
+        # Unhealthy when the broker is gone or the loop is badly behind
+        lag = server_metrics.last_loop_lag
+        if not mqtt_client.client.is_connected():
+            return http_response(connection, 503, "mqtt disconnected\n")
+        if lag > HEALTHZ_MAX_LAG:
+            return http_response(connection, 503, f"event loop lag {lag:.1f}s\n")
+        return http_response(connection, 200, "ok\n")
 
     if "Upgrade" not in headers:
         client_ip = headers.get("X-Forwarded-For") or headers.get("Host", "?")
         logging.warning(
             f"Rejected non-WebSocket request from {client_ip} on path {path}"
         )
-        return (
-            400,
-            [("Content-Type", "text/plain; charset=utf-8")],
-            b"Bugger off.\n",
-        )
-
-    return None  # Continue normal websocket handshake
+        return http_response(connection, 400, "Bugger off.\n")
 
+    # The id ends up in MQTT topics and metric labels: refuse it before the handshake
+    cp_id = charge_point_id_from_path(path, config["ocpp"]["charge_point_id"])
+    if not valid_charge_point_id(cp_id):
+        logging.warning(f"Rejected WebSocket connection with invalid charge point id {cp_id!r}")
+        return http_response(connection, 400, "Invalid charge point id.\n")
 
+    return None  # Continue normal websocket handshake
 
 
 async def main():
+    # Schema validators are shared by all charge points; load the ones we need up front
+    configure_validation(config.get("validation"))
+    preload_validators(create_route_map(EVChargePoint).keys())
+
     # Quiet down noisy handshake tracebacks from the websockets library
     logging.getLogger("websockets.server").setLevel(logging.WARNING)
     logging.getLogger("websockets.protocol").setLevel(logging.WARNING)
@@ -133,31 +340,71 @@ async def main():
         config["ocpp"]["host"],
         config["ocpp"]["port"],
         subprotocols=["ocpp1.6"],
-        process_request=reject_non_websocket,
+        process_request=process_http_request,
+        # WebSocket pings catch half-open TCP connections; idle_timeout catches quiet chargers
+        ping_interval=config["ocpp"].get("ping_interval", 20),
+        ping_timeout=config["ocpp"].get("ping_timeout", 20),
     )
 
     server = await start_server
+    server_metrics.listening_after = time.monotonic() - STARTED
     logging.info(
-        f"OCPP server started on {config['ocpp']['host']}:{config['ocpp']['port']}"
+        f"OCPP server started on {config['ocpp']['host']}:{config['ocpp']['port']} "
+        f"({server_metrics.listening_after:.2f}s after start)"
     )
 
     global main_loop
     main_loop = asyncio.get_running_loop()
+    # docker stop sends SIGTERM: close the server so the cleanup below still runs
+    try:
+        main_loop.add_signal_handler(signal.SIGTERM, server.close)
+        main_loop.add_signal_handler(signal.SIGUSR1, profiler.start)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows
+    # The OCPP side is up; MQTT connects in the background and may take a while
+    # (e.g. after a power cut the broker often comes up after the chargers)
+    if isinstance(mqtt_client, AsyncMQTTClient):
+        asyncio.create_task(consume_commands())
+    else:
+        mqtt_client.set_command_callback(handle_command)
+    # Command topics of every charger, present and future
+    mqtt_client.subscribe_commands()
+    await mqtt_client.start()
+    if profiling_config.get("mqtt", True):
+        mqtt_client.subscribe(f"ocpp/{PROFILE_TOPIC}")
 
-    async def loop_alive():
+    async def housekeeping():
+        # Samples event-loop lag every second for /metrics; flushes the trace and logs
+        # fleet publisher stats now and then
+        ticks = 0
         while True:
-            logging.debug("Main event loop is alive.")
-            await asyncio.sleep(10)
+            await server_metrics.sample_loop_lag(1.0)
+            ticks += 1
+            if tracer is not None and ticks % 10 == 0:
+                tracer.flush()
+            if ticks % 60 == 0:
+                evict_meter_histories()
+            if ticks % 300 == 0:
+                state_publisher.log_stats("fleet")
 
-    asyncio.create_task(loop_alive())
+    asyncio.create_task(housekeeping())
+    asyncio.create_task(liveness.run())
+    config_manager.subscribe(on_config_changed)
+    asyncio.create_task(config_manager.watch())
 
-    await server.wait_closed()  # Keep server running
+    try:
+        await server.wait_closed()  # Keep server running
+    finally:
+        await session_store.close()
+        mqtt_client.close()
+        if tracer is not None:
+            tracer.close()
+        if log_listener is not None:
+            # Flush queued records to the file
+            log_listener.stop()
 
 
 if __name__ == "__main__":
-    import sys
-    import asyncio
-
     # Only set WindowsSelectorEventLoopPolicy if it exists (prevents crash in Linux Docker)
     if sys.platform == "win32" and hasattr(asyncio, "WindowsSelectorEventLoopPolicy"):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -166,8 +413,6 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         # Graceful shutdown on Ctrl+C
-        import logging
         logging.info("Shutting down OCPP server...")
     except Exception as e:
-        import logging
         logging.exception(f"Unexpected error: {e}")
@@ -0,0 +1,210 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    transaction_id INTEGER PRIMARY KEY,
+    charge_point_id TEXT NOT NULL,
+    connector_id INTEGER,
+    id_tag TEXT,
+    meter_start INTEGER,
+    start_time TEXT,
+    meter_stop INTEGER,
+    stop_time TEXT,
+    stop_reason TEXT,
+    energy_wh REAL,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_open ON sessions (charge_point_id) WHERE stop_time IS NULL;
+"""
+
+_INSERT = (
+    "INSERT OR REPLACE INTO sessions (transaction_id, charge_point_id, connector_id, id_tag, meter_start, start_time) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_STOP = "UPDATE sessions SET meter_stop = ?, stop_time = ?, stop_reason = ? WHERE transaction_id = ?"
+_ENERGY = "UPDATE sessions SET energy_wh = ?, cost = ? WHERE transaction_id = ?"
+# Columns added after the first release; ALTERed into existing databases
+_ADDED_COLUMNS = (("energy_wh", "REAL"), ("cost", "REAL"))
+
+
+class Session:
+    __slots__ = ("transaction_id", "charge_point_id", "connector_id", "id_tag", "meter_start", "start_time",
+                 "meter_stop", "stop_time", "stop_reason", "energy_wh", "cost")
+
+    def __init__(self, transaction_id, charge_point_id, connector_id=None, id_tag=None, meter_start=None,
+                 start_time=None, meter_stop=None, stop_time=None, stop_reason=None, energy_wh=None, cost=None):
+        self.transaction_id = transaction_id
+        self.charge_point_id = charge_point_id
+        self.connector_id = connector_id
+        self.id_tag = id_tag
+        self.meter_start = meter_start
+        self.start_time = start_time
+        self.meter_stop = meter_stop
+        self.stop_time = stop_time
+        self.stop_reason = stop_reason
+        self.energy_wh = energy_wh
+        self.cost = cost
+
+    def __repr__(self):
+        return f"Session(transaction_id={self.transaction_id}, charge_point_id={self.charge_point_id!r})"
+
+
+class SessionStore:
+    """
+    Durable store of charging sessions, replacing the single-id persist.json.
+
+    Reads are served from an in-memory cache of open sessions. Writes are queued and
+    committed in batches, one SQLite transaction per batch, on a dedicated thread so
+    the event loop never blocks on disk I/O. The database runs in WAL mode, so a
+    crash loses at most the last uncommitted batch and never corrupts earlier ones.
+    """
+
+    def __init__(self, path="sessions.db", legacy_file=None, legacy_charge_point_id=None):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        for name, kind in _ADDED_COLUMNS:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {kind}")
+        # Single writer thread: sqlite connections must not be used concurrently
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._pending = []
+        self._wakeup = None
+        self._writer = None
+        self.commits = 0
+        # charge_point_id -> open Session
+        self._active = {}
+        for row in self._conn.execute("SELECT * FROM sessions WHERE stop_time IS NULL ORDER BY transaction_id"):
+            session = Session(*row)
+            self._active[session.charge_point_id] = session
+        (self._last_id,) = self._conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM sessions").fetchone()
+        if legacy_file and not self._last_id:
+            self._import_legacy(legacy_file, legacy_charge_point_id)
+
+    def _import_legacy(self, legacy_file, charge_point_id):
+        # Carry over the open transaction id from the old persist.json
+        try:
+            with open(legacy_file) as f:
+                transaction_id = json.load(f).get("current_transaction_id")
+        except (OSError, ValueError):
+            return
+        if transaction_id and charge_point_id:
+            session = Session(transaction_id, charge_point_id)
+            self._active[charge_point_id] = session
+            self._last_id = transaction_id
+            self._conn.execute(_INSERT, (transaction_id, charge_point_id, None, None, None, None))
+            logging.info(f"Imported transaction {transaction_id} for {charge_point_id} from {legacy_file}")
+
+    def _next_id(self):
+        # Keep the historical "epoch seconds" look, but unique across chargers
+        self._last_id = max(self._last_id + 1, int(time.time()))
+        return self._last_id
+
+    def active_transaction(self, charge_point_id):
+        return self._active.get(charge_point_id)
+
+    def start_transaction(self, charge_point_id, connector_id=None, id_tag=None, meter_start=None, timestamp=None):
+        session = Session(self._next_id(), charge_point_id, connector_id, id_tag, meter_start, timestamp)
+        previous = self._active.get(charge_point_id)
+        if previous is not None:
+            logging.warning(f"{charge_point_id}: starting transaction {session.transaction_id} while "
+                            f"{previous.transaction_id} is still open")
+        self._active[charge_point_id] = session
+        self._enqueue(_INSERT, (session.transaction_id, charge_point_id, connector_id, id_tag, meter_start, timestamp))
+        return session
+
+    def adopt_transaction(self, charge_point_id, transaction_id):
+        """
+        Record a transaction the charger reports (e.g. in MeterValues) that we have no open session for.
+        """
+        session = Session(transaction_id, charge_point_id)
+        self._active[charge_point_id] = session
+        self._last_id = max(self._last_id, transaction_id)
+        self._enqueue(_INSERT, (transaction_id, charge_point_id, None, None, None, None))
+        return session
+
+    def stop_transaction(self, charge_point_id, transaction_id, meter_stop=None, timestamp=None, reason=None):
+        session = self._active.get(charge_point_id)
+        if session is not None and session.transaction_id == transaction_id:
+            del self._active[charge_point_id]
+        else:
+            session = Session(transaction_id, charge_point_id)
+        session.meter_stop = meter_stop
+        session.stop_time = timestamp
+        session.stop_reason = reason
+        self._enqueue(_STOP, (meter_stop, timestamp, reason, transaction_id))
+        return session
+
+    def record_energy(self, transaction_id, energy_wh, cost=None):
+        """
+        Store the accounted energy (and cost) of a session.
+        """
+        self._enqueue(_ENERGY, (energy_wh, cost, transaction_id))
+
+    def _enqueue(self, sql, params):
+        self._pending.append((sql, params))
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if batch:
+                try:
+                    await loop.run_in_executor(self._executor, self._commit, batch)
+                except Exception as e:
+                    logging.exception(f"Failed to commit {len(batch)} session updates: {e}")
+
+    def _commit(self, batch):
+        # One atomic transaction per batch, statements kept in arrival order
+        self._conn.execute("BEGIN")
+        try:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        self.commits += 1
+
+    async def flush(self):
+        """
+        Commit everything queued so far.
+        """
+        batch, self._pending = self._pending, []
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._commit, batch)
+        # Wait for a batch the writer task may have in flight
+        await asyncio.get_running_loop().run_in_executor(self._executor, lambda: None)
+
+    async def close(self):
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+    async def history(self, charge_point_id, limit=100):
+        """
+        Most recent sessions of a charge point, newest first.
+        """
+        def query():
+            return self._conn.execute(
+                "SELECT * FROM sessions WHERE charge_point_id = ? ORDER BY transaction_id DESC LIMIT ?",
+                (charge_point_id, limit),
+            ).fetchall()
+        rows = await asyncio.get_running_loop().run_in_executor(self._executor, query)
+        return [Session(*row) for row in rows]
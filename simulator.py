@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+
+import websockets
+from ocpp.routing import on
+from ocpp.v16 import ChargePoint as cp
+from ocpp.v16 import call, call_result
+
+from mini_broker import MiniBroker
+
+VOLTAGE = 230.0
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SimulationRates:
+    """
+    How often a virtual charger talks, in seconds. Session start/idle times are randomized.
+    """
+
+    def __init__(self, heartbeat=30.0, meter=10.0, idle=120.0, session=600.0, phases=3, max_current=32):
+        self.heartbeat = heartbeat
+        self.meter = meter
+        self.idle = idle
+        self.session = session
+        self.phases = phases
+        self.max_current = max_current
+
+
+class VirtualCharger(cp):
+    """
+    A simulated Futurehome charger: boots, heartbeats, runs charging sessions with
+    MeterValues, and answers the CSMS calls EVChargePoint sends.
+
+    Round-trip times of its own calls are collected per action in `stats.latency`.
+    """
+
+    def __init__(self, id, connection, rates, stats, rng):
+        super().__init__(id, connection)
+        self.rates = rates
+        self.stats = stats
+        self.rng = rng
+        self.status = "Available"
+        self.limit = rates.max_current
+        self.transaction_id = None
+        self.energy_wh = rng.uniform(0, 1e6)
+        self._stop_requested = asyncio.Event()
+        self._stop = asyncio.Event()
+
+    async def timed_call(self, payload):
+        action = payload.__class__.__name__
+        started = time.monotonic()
+        try:
+            response = await self.call(payload)
+        except Exception:
+            self.stats.errors[action] = self.stats.errors.get(action, 0) + 1
+            raise
+        self.stats.latency.setdefault(action, []).append(time.monotonic() - started)
+        return response
+
+    async def run(self, stop):
+        self._stop = stop
+        await self.timed_call(call.BootNotification(charge_point_vendor="Futurehome", charge_point_model="Charge"))
+        await self.send_status("Available")
+        tasks = [asyncio.create_task(self._heartbeats()), asyncio.create_task(self._sessions())]
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def send_status(self, status):
+        self.status = status
+        await self.timed_call(call.StatusNotification(
+            connector_id=1, error_code="NoError", status=status, timestamp=_now()))
+
+    async def _heartbeats(self):
+        # Spread the fleet over the interval instead of all beating at once
+        await asyncio.sleep(self.rng.uniform(0, self.rates.heartbeat))
+        while not self._stop.is_set():
+            try:
+                await self.timed_call(call.Heartbeat())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass  # counted in stats.errors
+            await asyncio.sleep(self.rates.heartbeat)
+
+    async def _sessions(self):
+        # The loops also check the fleet stop event: on 3.11 wait_for() can swallow a
+        # cancel that races its timeout, which would leave the charger running forever
+        while not self._stop.is_set():
+            await asyncio.sleep(self.rng.expovariate(1 / self.rates.idle) if self.rates.idle else 0)
+            if self.status != "Available":
+                continue
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # A call failed (counted in stats.errors); start over from Available
+                self.transaction_id = None
+                self.status = "Available"
+
+    async def _session(self):
+        await self.send_status("Preparing")
+        response = await self.timed_call(call.StartTransaction(
+            connector_id=1, id_tag="simulator", meter_start=int(self.energy_wh), timestamp=_now()))
+        self.transaction_id = response.transaction_id
+        await self.send_status("Charging")
+        self._stop_requested.clear()
+        end = time.monotonic() + self.rng.uniform(0.5, 1.5) * self.rates.session
+        while time.monotonic() < end and not (self._stop_requested.is_set() or self._stop.is_set()):
+            try:
+                await asyncio.wait_for(self._stop_requested.wait(), self.rates.meter)
+            except asyncio.TimeoutError:
+                await self._meter_values()
+        await self.timed_call(call.StopTransaction(
+            meter_stop=int(self.energy_wh), timestamp=_now(), transaction_id=self.transaction_id,
+            reason="Remote" if self._stop_requested.is_set() else "EVDisconnected"))
+        self.transaction_id = None
+        await self.send_status("Finishing")
+        await self.send_status("Available")
+
+    async def _meter_values(self):
+        phases = self.rates.phases
+        current = min(self.limit, self.rates.max_current) * self.rng.uniform(0.9, 1.0)
+        power = current * VOLTAGE * phases
+        self.energy_wh += power * self.rates.meter / 3600
+        sampled = [
+            {"value": f"{self.energy_wh:.0f}", "measurand": "Energy.Active.Import.Register", "unit": "Wh",
+             "location": "Outlet"},
+            {"value": f"{power:.0f}", "measurand": "Power.Active.Import", "unit": "W", "location": "Outlet"},
+            {"value": f"{self.limit:.1f}", "measurand": "Current.Offered", "unit": "A", "location": "Outlet"},
+        ]
+        for phase in ("L1", "L2", "L3")[:phases]:
+            sampled.append({"value": f"{current:.1f}", "measurand": "Current.Import", "unit": "A",
+                            "phase": phase, "location": "Outlet"})
+            sampled.append({"value": f"{self.rng.uniform(228, 234):.1f}", "measurand": "Voltage", "unit": "V",
+                            "phase": phase, "location": "Outlet"})
+        await self.timed_call(call.MeterValues(
+            connector_id=1, transaction_id=self.transaction_id,
+            meter_value=[{"timestamp": _now(), "sampled_value": sampled}]))
+
+    def _server_call(self, action):
+        stats = self.stats
+        stats.server_calls[action] = stats.server_calls.get(action, 0) + 1
+        sent = stats.pending_commands.pop((self.id, action), None)
+        if sent is not None:
+            # End to end: HA command published on the broker -> call reached the charger
+            stats.latency.setdefault(f"mqtt->{action}", []).append(time.monotonic() - sent)
+
+    @on("SetChargingProfile")
+    def on_set_charging_profile(self, connector_id, cs_charging_profiles, **kwargs):
+        self._server_call("SetChargingProfile")
+        periods = cs_charging_profiles["charging_schedule"]["charging_schedule_period"]
+        self.limit = float(periods[0]["limit"]) if periods else self.rates.max_current
+        return call_result.SetChargingProfile(status="Accepted")
+
+    @on("ChangeAvailability")
+    def on_change_availability(self, connector_id, type, **kwargs):
+        self._server_call("ChangeAvailability")
+        return call_result.ChangeAvailability(status="Accepted")
+
+    @on("UnlockConnector")
+    def on_unlock_connector(self, connector_id, **kwargs):
+        self._server_call("UnlockConnector")
+        return call_result.UnlockConnector(status="Unlocked")
+
+    @on("RemoteStopTransaction")
+    def on_remote_stop_transaction(self, transaction_id, **kwargs):
+        self._server_call("RemoteStopTransaction")
+        if transaction_id != self.transaction_id:
+            return call_result.RemoteStopTransaction(status="Rejected")
+        self._stop_requested.set()
+        return call_result.RemoteStopTransaction(status="Accepted")
+
+    @on("GetConfiguration")
+    def on_get_configuration(self, **kwargs):
+        self._server_call("GetConfiguration")
+        return call_result.GetConfiguration(configuration_key=[], unknown_key=[])
+
+
+class SimulationStats:
+    def __init__(self):
+        # action -> round-trip times (s) of the chargers' own calls
+        self.latency = {}
+        self.errors = {}
+        # action -> calls received from the server
+        self.server_calls = {}
+        # (charger id, expected server action) -> monotonic time an MQTT command was published
+        self.pending_commands = {}
+        # charger id -> VirtualCharger
+        self.chargers = {}
+        self.connected = 0
+        self.failed = 0
+
+    def calls(self):
+        return sum(len(values) for values in self.latency.values())
+
+    def report(self, elapsed):
+        lines = [
+            f"{self.connected} chargers connected ({self.failed} failed), {self.calls()} calls in {elapsed:.1f} s "
+            f"= {self.calls() / elapsed:,.0f} calls/s, errors {self.errors or 0}, server calls {self.server_calls}",
+            f"  {'action':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}",
+        ]
+        for action, values in sorted(self.latency.items()):
+            values = sorted(values)
+            p = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+            lines.append(f"  {action:<22}{len(values):>8}{p(0.5):>10.2f}{p(0.95):>10.2f}{p(0.99):>10.2f}"
+                         f"{values[-1] * 1000:>10.2f}")
+        return "\n".join(lines)
+
+
+async def run_charger(url, cp_id, rates, stats, stop, rng):
+    try:
+        async with websockets.connect(f"{url}/{cp_id}", subprotocols=["ocpp1.6"], max_queue=None) as ws:
+            charger = VirtualCharger(cp_id, ws, rates, stats, rng)
+            stats.chargers[cp_id] = charger
+            stats.connected += 1
+            receiver = asyncio.create_task(charger.start())
+            try:
+                await charger.run(stop)
+            finally:
+                receiver.cancel()
+    except (OSError, websockets.exceptions.WebSocketException, asyncio.TimeoutError) as e:
+        stats.failed += 1
+        logging.warning(f"{cp_id}: simulator connection failed: {e!r}")
+
+
+async def run_fleet(url, chargers, rates, duration, prefix="SIM", ramp=0.0, seed=1, stats=None):
+    """
+    Run `chargers` virtual chargers against ws://.../<prefix>_<n> for `duration` seconds.
+
+    Connections are spread over `ramp` seconds. Returns the SimulationStats.
+    """
+    stats = stats or SimulationStats()
+    stop = asyncio.Event()
+    tasks = []
+    for n in range(chargers):
+        rng = random.Random(seed * 1000003 + n)
+        tasks.append(asyncio.create_task(run_charger(url, f"{prefix}_{n:05d}", rates, stats, stop, rng)))
+        if ramp:
+            await asyncio.sleep(ramp / chargers)
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats
+
+
+async def _main(args):
+    broker = None
+    if args.broker_port is not None:
+        broker = await MiniBroker(port=args.broker_port).start()
+        logging.info(f"MiniBroker listening on port {broker.port}")
+    rates = SimulationRates(args.heartbeat, args.meter, args.idle, args.session)
+    started = time.monotonic()
+    try:
+        stats = await run_fleet(args.url, args.chargers, rates, args.duration, ramp=args.ramp)
+    finally:
+        if broker is not None:
+            await broker.stop()
+    print(stats.report(time.monotonic() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of OCPP 1.6 chargers against a running server")
+    parser.add_argument("--url", default="ws://127.0.0.1:9000")
+    parser.add_argument("--chargers", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--ramp", type=float, default=0, help="Spread connections over this many seconds")
+    parser.add_argument("--heartbeat", type=float, default=30)
+    parser.add_argument("--meter", type=float, default=10, help="MeterValues interval while charging")
+    parser.add_argument("--idle", type=float, default=120, help="Mean idle time between sessions")
+    parser.add_argument("--session", type=float, default=600, help="Mean session length")
+    parser.add_argument("--broker-port", type=int, help="Also run a MiniBroker on this port (0 = any)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
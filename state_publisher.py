@@ -0,0 +1,76 @@
+import logging
+import time
+from mqtt_client import PRIORITY_STATE
+
+
+class StatePublisher:
+    """
+    Change-suppressing layer over MQTTClient.publish for retained state topics.
+
+    Keeps the last published value per topic and skips a publish when the value is
+    unchanged (or, for numeric measurands with a deadband, moved less than the
+    deadband). An unchanged value is still republished after `max_silence` seconds,
+    and measurand samples are never published more often than `min_interval` seconds
+    per topic.
+    """
+
+    def __init__(self, mqtt_client, config=None, clock=time.monotonic):
+        config = config or {}
+        self.mqtt_client = mqtt_client
+        self.deadbands = dict(config.get("deadband", {}))
+        self.max_silence = config.get("max_silence", 300)
+        self.min_interval = config.get("min_interval", 0)
+        self._clock = clock
+        # topic -> (last published value, publish time)
+        self._last = {}
+        self.published = 0
+        self.suppressed = 0
+
+    def publish(self, topic, value, measurand=None, priority=PRIORITY_STATE, force=False):
+        """
+        Publish `value` to `topic` unless it is a redundant update. Returns True if sent.
+        """
+        now = self._clock()
+        last = self._last.get(topic)
+        if last is not None and not force:
+            last_value, last_time = last
+            elapsed = now - last_time
+            if (measurand is not None and elapsed < self.min_interval) or (
+                elapsed < self.max_silence and not self._changed(last_value, value, measurand)
+            ):
+                self.suppressed += 1
+                return False
+        self._last[topic] = (value, now)
+        self.published += 1
+        self.mqtt_client.publish(topic, value, priority=priority)
+        return True
+
+    def _changed(self, last_value, value, measurand):
+        if last_value == value:
+            return False
+        deadband = self.deadbands.get(measurand) if measurand else None
+        if not deadband:
+            return True
+        try:
+            return abs(float(value) - float(last_value)) >= deadband
+        except (TypeError, ValueError):
+            return True
+
+    def forget(self, topic):
+        self._last.pop(topic, None)
+
+    def stats(self):
+        total = self.published + self.suppressed
+        return {
+            "published": self.published,
+            "suppressed": self.suppressed,
+            "suppressed_ratio": self.suppressed / total if total else 0.0,
+            "topics": len(self._last),
+        }
+
+    def log_stats(self, name):
+        stats = self.stats()
+        logging.info(
+            f"{name}: state publisher published={stats['published']} suppressed={stats['suppressed']} "
+            f"({stats['suppressed_ratio']:.0%}) topics={stats['topics']}"
+        )
@@ -0,0 +1,76 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def import_server(tmp_path, monkeypatch):
+    """
+    Import a fresh server module working in tmp_path; `overrides` are merged into the config sections.
+    """
+    def load(overrides=None):
+        with open(os.path.join(ROOT, "config", "config.json")) as f:
+            config = json.load(f)
+        for section, values in (overrides or {}).items():
+            if isinstance(values, dict):
+                config.setdefault(section, {}).update(values)
+            else:
+                config[section] = values
+        # server.py loads config/ and creates sessions.db and logs/ relative to the working directory
+        (tmp_path / "config").mkdir()
+        (tmp_path / "config" / "config.json").write_text(json.dumps(config))
+        (tmp_path / "logs").mkdir()
+        monkeypatch.chdir(tmp_path)
+        sys.modules.pop("server", None)
+        return importlib.import_module("server")
+
+    yield load
+    sys.modules.pop("server", None)
+
+
+@pytest.fixture
+def server(import_server):
+    return import_server()
+
+
+class RecordingMQTT:
+    """
+    MQTT client stand-in with the publish interface; keeps the last payload per topic.
+    """
+
+    def __init__(self, discovery_mode="device"):
+        from discovery import DiscoveryRegistry
+        self.published = []
+        self.retained = {}
+        self.discovery = DiscoveryRegistry(self, discovery_mode)
+
+    def publish(self, topic, payload, **kwargs):
+        self.published.append((topic, payload))
+        if payload in (b"", ""):
+            self.retained.pop(topic, None)
+        else:
+            self.retained[topic] = payload
+
+
+class NullConnection:
+    async def send(self, message):
+        pass
+
+
+@pytest.fixture
+def config():
+    from config_manager import freeze
+    with open(os.path.join(ROOT, "config", "config.json")) as f:
+        return freeze(json.load(f))
+
+
+@pytest.fixture
+def mqtt():
+    return RecordingMQTT()
@@ -0,0 +1,38 @@
+import decimal
+
+import pytest
+
+import codec
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request):
+    if request.param == "orjson" and codec.orjson is None:
+        pytest.skip("orjson not installed")
+    previous = codec.BACKEND
+    codec.use(request.param)
+    yield request.param
+    codec.use(previous)
+
+
+def test_compact_unescaped_output(backend):
+    frame = [2, "1", "DataTransfer", {"vendorId": "Øst", "value": decimal.Decimal("1.5")}]
+    assert codec.dumps(frame) == '[2,"1","DataTransfer",{"vendorId":"Øst","value":1.5}]'
+    assert codec.dumpb(frame) == codec.dumps(frame).encode("utf-8")
+    assert codec.loads(codec.dumpb(frame)) == [2, "1", "DataTransfer", {"vendorId": "Øst", "value": 1.5}]
+
+
+def test_sorted_keys_match_across_backends(backend):
+    assert codec.dumpb({"b": 1, "a": {"d": 2, "c": 3}}, sort_keys=True) == b'{"a":{"c":3,"d":2},"b":1}'
+
+
+def test_invalid_input_raises_value_error(backend):
+    with pytest.raises(ValueError):
+        codec.loads('[2,"1",')
+    with pytest.raises(TypeError):
+        codec.dumps({"x": object()})
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        codec.use("simplejson")
@@ -0,0 +1,80 @@
+import asyncio
+
+from command_coalescer import CommandCoalescer
+
+
+def test_burst_applies_last_value_once():
+    applied = []
+
+    async def apply(value):
+        applied.append(value)
+
+    async def run():
+        coalescer = CommandCoalescer("CP_1", settle=0.05, max_delay=1.0)
+        for value in range(6, 17):
+            coalescer.submit("current_limit", value, apply)
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.1)
+        coalescer.cancel()
+        return coalescer
+
+    coalescer = asyncio.run(run())
+    assert applied == [16]
+    assert coalescer.collapsed == 10
+
+
+def test_max_delay_while_commands_keep_coming():
+    applied = []
+
+    async def apply(value):
+        applied.append(value)
+
+    async def run():
+        coalescer = CommandCoalescer("CP_1", settle=0.05, max_delay=0.1)
+        for value in range(30):
+            coalescer.submit("current_limit", value, apply)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        coalescer.cancel()
+
+    asyncio.run(run())
+    # Not held back until the slider stops: applied along the way, ending on the last value
+    assert len(applied) >= 2
+    assert applied[-1] == 29
+
+
+def test_keys_are_independent_and_failures_isolated():
+    applied = []
+
+    async def apply(value):
+        if value == "boom":
+            raise RuntimeError(value)
+        applied.append(value)
+
+    async def run():
+        coalescer = CommandCoalescer("CP_1", settle=0.01, max_delay=1.0)
+        coalescer.submit("availability", "boom", apply)
+        coalescer.submit("suspend", "on", apply)
+        await asyncio.sleep(0.05)
+        coalescer.submit("suspend", "off", apply)
+        await asyncio.sleep(0.05)
+        coalescer.cancel()
+
+    asyncio.run(run())
+    assert applied == ["on", "off"]
+
+
+def test_cancel_drops_pending():
+    applied = []
+
+    async def apply(value):
+        applied.append(value)
+
+    async def run():
+        coalescer = CommandCoalescer("CP_1", settle=0.05)
+        coalescer.submit("current_limit", 10, apply)
+        coalescer.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert applied == []
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+from conftest import NullConnection, RecordingMQTT
+from discovery import DiscoveryRegistry
+from evcharger_handler import EVChargePoint
+
+DEVICE_TOPIC = "homeassistant/device/CP_1/config"
+
+
+def connect(mqtt, config):
+    """
+    Announce what a freshly connected charger announces, then let the batched flush run.
+    """
+    async def run():
+        cp = EVChargePoint("CP_1", NullConnection(), mqtt, config)
+        cp.publish_connection(True)
+        cp.publish_control_discovery()
+        cp.publish_last_charging_start_sensor()
+        cp.publish_session_energy_discovery()
+        await asyncio.sleep(0)
+        cp.coalescer.cancel()
+        return cp
+
+    return asyncio.run(run())
+
+
+def discovery_topics(mqtt):
+    return [topic for topic, _ in mqtt.published if topic.startswith("homeassistant/")]
+
+
+def test_one_device_config_per_charger(config):
+    mqtt = RecordingMQTT()
+    mqtt.discovery.migrate = False
+    cp = connect(mqtt, config)
+    assert discovery_topics(mqtt) == [DEVICE_TOPIC]
+    payload = json.loads(mqtt.retained[DEVICE_TOPIC])
+    assert payload["device"]["identifiers"] == ["CP_1"]
+    assert len(payload["components"]) == len(cp.discovery) == 8
+    assert payload["components"]["current_limit_CP_1"]["platform"] == "number"
+    # The connection sensor only depends on the server's status, not on itself
+    assert payload["components"]["CP_1_connection"]["availability"] == [{"topic": "ocpp/server/status"}]
+
+
+def test_rebuilt_only_when_entities_change(config):
+    mqtt = RecordingMQTT()
+    mqtt.discovery.migrate = False
+    cp = connect(mqtt, config)
+    device = cp.discovery
+    config_payload = dict(json.loads(mqtt.retained[DEVICE_TOPIC])["components"]["CP_1_session_cost"])
+    platform = config_payload.pop("platform")
+    # Equal content again: nothing published
+    device.add(platform, dict(config_payload))
+    assert discovery_topics(mqtt) == [DEVICE_TOPIC]
+    # Changed entity: one new device config
+    device.add(platform, dict(config_payload, name="Cost"))
+    assert discovery_topics(mqtt) == [DEVICE_TOPIC, DEVICE_TOPIC]
+    assert json.loads(mqtt.retained[DEVICE_TOPIC])["components"]["CP_1_session_cost"]["name"] == "Cost"
+    assert device.rebuilt == 2
+
+
+def test_entity_mode_publishes_per_entity(config):
+    mqtt = RecordingMQTT("entity")
+    assert not mqtt.discovery.migrate
+    connect(mqtt, config)
+    topics = discovery_topics(mqtt)
+    assert len(topics) == 8
+    assert "homeassistant/number/current_limit_CP_1/config" in topics
+    payload = json.loads(mqtt.retained["homeassistant/sensor/CP_1_session_energy/config"])
+    assert payload["device"]["identifiers"] == ["CP_1"]
+    assert payload["availability_mode"] == "all"
+
+
+def test_migration_from_entity_configs(config):
+    mqtt = RecordingMQTT()
+    assert mqtt.discovery.migrate
+    # What an older version left retained on the broker
+    old = "homeassistant/number/current_limit_CP_1/config"
+    mqtt.retained[old] = b"{}"
+    connect(mqtt, config)
+    published = [(topic, payload) for topic, payload in mqtt.published if topic in (old, DEVICE_TOPIC)]
+    # HA's order: migrate_discovery on the old topic, the device config, then clear the old topic
+    assert [topic for topic, _ in published] == [old, DEVICE_TOPIC, old]
+    assert published[0][1] == {"migrate_discovery": True}
+    assert published[2][1] == b""
+    assert old not in mqtt.retained
+    assert DEVICE_TOPIC in mqtt.retained
+
+
+def test_republish_after_ha_restart(config):
+    mqtt = RecordingMQTT()
+    connect(mqtt, config)
+    before = len(mqtt.published)
+    mqtt.discovery.republish_all()
+    # The bundle only, no second migration
+    assert [topic for topic, _ in mqtt.published[before:]] == [DEVICE_TOPIC]
+
+
+def test_registry_announce_skips_unchanged():
+    mqtt = RecordingMQTT()
+    registry = DiscoveryRegistry(mqtt, "entity")
+    config = {"unique_id": "x", "name": "X"}
+    assert registry.announce("homeassistant/sensor/x/config", config)
+    assert not registry.announce("homeassistant/sensor/x/config", config)
+    assert not registry.announce("homeassistant/sensor/x/config", dict(config))
+    assert registry.announce("homeassistant/sensor/x/config", dict(config, name="Y"))
+    assert (registry.published, registry.skipped) == (2, 2)
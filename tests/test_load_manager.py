@@ -0,0 +1,109 @@
+import math
+import random
+
+from config_manager import freeze
+from load_manager import PHASES, SiteLoadManager
+
+
+def reference_allocations(manager):
+    """
+    Allocations recomputed from scratch from the sessions' caps and phases.
+    """
+    sessions = sorted(manager._sessions.values(), key=lambda s: s.seq)
+    levels = {}
+    admitted = {}
+    for phase, state in manager._phases.items():
+        on_phase = [s for s in sessions if phase in s.phases]
+        limit = int(state.budget // manager.min_current) if manager.min_current else len(on_phase)
+        admitted[phase] = {s.cp_id for s in on_phase[:limit]}
+        # Water-filling: the level L with sum(min(cap, L)) == budget, or inf if everything fits
+        caps = sorted(s.cap for s in on_phase[:limit])
+        remaining, n, level = state.budget, len(caps), math.inf
+        for cap in caps:
+            if cap * n > remaining:
+                level = remaining / n
+                break
+            remaining -= cap
+            n -= 1
+        levels[phase] = level
+    allocations = {}
+    for session in sessions:
+        allocation = session.cap
+        for phase in session.phases:
+            if phase not in levels:
+                continue
+            if session.cp_id not in admitted[phase]:
+                allocation = 0
+                break
+            allocation = min(allocation, levels[phase])
+        allocations[session.cp_id] = int(allocation)
+    return allocations
+
+
+def test_frozen_per_phase_budget():
+    budget = freeze({"site": {"budget": {"L1": 32, "L2": 20, "L3": 16}}})["site"]["budget"]
+    manager = SiteLoadManager(budget, min_current=6)
+    assert manager.update("CP_1", 32) == 16
+    manager.update("CP_2", 32)
+    assert manager.allocation("CP_1") == 8
+    assert manager.allocation("CP_2") == 8
+
+
+def test_server_builds_manager_from_frozen_site_config(import_server):
+    server = import_server({"site": {"budget": {"L1": 63, "L2": 63, "L3": 40}, "min_current": 6}})
+    assert server.load_manager.update("CP_1", 32) == 32
+    assert server.load_manager.update("CP_2", 32) == 20
+
+
+def test_scalar_budget_fair_share():
+    manager = SiteLoadManager(32, min_current=6)
+    manager.update("CP_1", 16)
+    manager.update("CP_2", 32)
+    manager.update("CP_3", 10)
+    # CP_3 keeps its cap, the others split what is left
+    assert [manager.allocation(cp) for cp in ("CP_1", "CP_2", "CP_3")] == [11, 11, 10]
+
+
+def test_newest_session_paused_below_min_current():
+    changes = {}
+    manager = SiteLoadManager(16, min_current=6, on_change=changes.__setitem__)
+    for cp_id in ("CP_1", "CP_2", "CP_3"):
+        manager.update(cp_id, 16)
+    assert changes == {"CP_1": 8, "CP_2": 8, "CP_3": 0}
+    manager.remove("CP_1")
+    assert changes == {"CP_1": 8, "CP_2": 8, "CP_3": 8}
+    assert manager.allocation("CP_1") is None
+
+
+def test_ev_drawing_less_releases_capacity():
+    manager = SiteLoadManager(32, min_current=6, headroom=2)
+    manager.update("CP_1", 16)
+    manager.update("CP_2", 32)
+    manager.update("CP_1", 16, {"L1": 6, "L2": 6, "L3": 6}, 16)
+    assert manager.allocation("CP_1") == 8
+    assert manager.allocation("CP_2") == 24
+
+
+def test_incremental_matches_recompute():
+    # Random joins, reading updates and leaves; after every event the incremental
+    # allocations, and what on_change reported, must equal a from-scratch recompute
+    rng = random.Random(7)
+    reported = {}
+    manager = SiteLoadManager({"L1": 100, "L2": 80, "L3": 63}, min_current=6, headroom=2,
+                              on_change=reported.__setitem__)
+    ids = [f"CP_{i:02d}" for i in range(40)]
+    for _ in range(3000):
+        cp_id = rng.choice(ids)
+        if rng.random() < 0.1:
+            manager.remove(cp_id)
+            reported.pop(cp_id, None)
+        else:
+            offered = manager.allocation(cp_id) or rng.choice((6, 16, 32))
+            phases = PHASES if rng.random() < 0.6 else rng.sample(PHASES, rng.randint(1, 2))
+            drawn = rng.uniform(0, offered)
+            imports = {p: drawn for p in phases} if rng.random() < 0.8 else None
+            manager.update(cp_id, rng.choice((10, 16, 20, 32)), imports, offered)
+        expected = reference_allocations(manager)
+        actual = {cp: manager.allocation(cp) for cp in expected}
+        assert actual == expected
+        assert {cp: reported.get(cp) for cp in expected} == expected
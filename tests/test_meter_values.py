@@ -0,0 +1,45 @@
+import asyncio
+
+from conftest import NullConnection
+from evcharger_handler import EVChargePoint
+from load_manager import SiteLoadManager
+
+
+def sample(value, measurand, phase=None, unit="A"):
+    sampled = {"value": value, "measurand": measurand, "unit": unit}
+    if phase:
+        sampled["phase"] = phase
+    return sampled
+
+
+def test_malformed_samples_are_skipped(mqtt, config, caplog):
+    load_manager = SiteLoadManager(32, min_current=6)
+
+    async def run():
+        cp = EVChargePoint("CP_1", NullConnection(), mqtt, config, load_manager=load_manager)
+        meter_value = [
+            {"timestamp": 1700000000, "sampled_value": [
+                sample("abc", "Power.Active.Import", unit="W"),
+                sample(None, "Current.Import", "L2"),
+                sample("nan", "Current.Import", "L3"),
+                sample("7", "Current.Import", "L1"),
+            ]},
+            {"timestamp": "2024-01-01T00:00:00Z", "sampled_value": [
+                sample("1500", "Power.Active.Import", unit="W"),
+                sample("x", "Energy.Active.Import.Register", unit="Wh"),
+            ]},
+        ]
+        response = await cp.on_meter_values(1, meter_value)
+        # The same garbage again is not logged again
+        await cp.on_meter_values(1, meter_value[:1])
+        cp.coalescer.cancel()
+        return cp, response
+
+    cp, response = asyncio.run(run())
+    assert response is not None
+    points = cp.history.query("power_active_import", 0, 2e9, resolution=0)
+    assert [value for _, value in points] == [1500.0]
+    assert load_manager.allocation("CP_1") is not None
+    assert load_manager._sessions["CP_1"].phases == ("L1",)
+    warnings = [r for r in caplog.records if "skipping non-numeric" in r.getMessage()]
+    assert len(warnings) == 4
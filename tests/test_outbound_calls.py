@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import pytest
+from ocpp.messages import CallError, CallResult
+
+from conftest import NullConnection
+from evcharger_handler import EVChargePoint
+from outbound_calls import OutboundCallError, OutboundCallManager, RetryPolicy
+
+
+class FakeChargePoint:
+    """
+    Records the frames the manager sends; `answer` decides the response to each (None: no answer).
+    """
+
+    def __init__(self, answer=None):
+        self.id = "CP_1"
+        self.sent = []
+        self.answer = answer
+        self.manager = None
+
+    async def _send(self, frame):
+        message = json.loads(frame)
+        self.sent.append(message)
+        response = self.answer(message) if self.answer else None
+        if response is not None:
+            asyncio.get_running_loop().call_soon(self.manager.resolve, response)
+
+
+def accept(message):
+    return CallResult(message[1], {"status": "Accepted"})
+
+
+def manager_for(charge_point, **kwargs):
+    charge_point.manager = OutboundCallManager(charge_point, **kwargs)
+    return charge_point.manager
+
+
+def test_response_is_correlated_and_typed():
+    async def run():
+        manager = manager_for(FakeChargePoint(accept))
+        return await manager.call("ChangeAvailability", {"connectorId": 0, "type": "Operative"}), manager
+
+    result, manager = asyncio.run(run())
+    assert result.status == "Accepted"
+    assert len(manager) == 0
+    assert manager.latency["ChangeAvailability"].count == 1
+
+
+def test_one_call_in_flight():
+    async def run():
+        charge_point = FakeChargePoint()
+        manager = manager_for(charge_point)
+        first = asyncio.create_task(manager.call("UnlockConnector", {"connectorId": 1}))
+        second = asyncio.create_task(manager.call("UnlockConnector", {"connectorId": 1}))
+        await asyncio.sleep(0.01)
+        # OCPP 1.6: the second call waits until the first is answered
+        assert len(charge_point.sent) == 1
+        manager.resolve(accept(charge_point.sent[0]))
+        await first
+        await asyncio.sleep(0.01)
+        assert len(charge_point.sent) == 2
+        manager.resolve(accept(charge_point.sent[1]))
+        await second
+
+    asyncio.run(run())
+
+
+def test_timeout_is_retried_and_late_response_ignored():
+    timeouts = []
+
+    async def run():
+        attempts = []
+
+        def answer(message):
+            attempts.append(message[1])
+            return accept(message) if len(attempts) > 1 else None
+
+        manager = manager_for(FakeChargePoint(answer), timeout=0.05, on_timeout=timeouts.append,
+                              retry_policy=RetryPolicy(attempts=2, backoff=0.01))
+        result = await manager.call("UnlockConnector", {"connectorId": 1})
+        # The first attempt's answer arrives after it timed out
+        late = manager.resolve(CallResult(attempts[0], {"status": "Unlocked"}))
+        return result, late, manager
+
+    result, late, manager = asyncio.run(run())
+    assert result.status == "Accepted"
+    assert late is False
+    assert timeouts == ["UnlockConnector"]
+    assert manager.timeouts == {"UnlockConnector": 1}
+
+
+def test_call_error_raises():
+    def answer(message):
+        return CallError(message[1], "NotSupported", "nope", {})
+
+    async def run():
+        manager = manager_for(FakeChargePoint(answer), retry_policy=RetryPolicy(attempts=3, backoff=0.01))
+        with pytest.raises(OutboundCallError) as error:
+            await manager.call("GetConfiguration", {})
+        return error.value, manager
+
+    error, manager = asyncio.run(run())
+    assert error.error_code == "NotSupported"
+    # Not in retry_on_errors: no retries
+    assert manager.errors == {"GetConfiguration": 1}
+
+
+def test_cancel_all_fails_pending_calls():
+    async def run():
+        manager = manager_for(FakeChargePoint())
+        call = asyncio.create_task(manager.call("UnlockConnector", {"connectorId": 1}))
+        await asyncio.sleep(0.01)
+        manager.cancel_all()
+        with pytest.raises(ConnectionError):
+            await call
+        return manager
+
+    assert len(asyncio.run(run())) == 0
+
+
+def test_unmatched_response_is_dropped(mqtt, config):
+    async def run():
+        cp = EVChargePoint("CP_1", NullConnection(), mqtt, config)
+        for i in range(10):
+            await cp.route_message(json.dumps([3, f"spoofed-{i}", {"status": "Accepted"}]))
+        cp.coalescer.cancel()
+        return cp
+
+    cp = asyncio.run(run())
+    assert cp._response_queue.qsize() == 0
@@ -0,0 +1,110 @@
+import os
+import warnings
+
+from outbox import Outbox
+
+COMMAND, STATE, METER = 0, 1, 2
+
+
+def test_latest_payload_per_topic(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.bin"))
+    outbox.put("a", "1", STATE)
+    outbox.put("b", "1", STATE)
+    outbox.put("a", "2", STATE)
+    assert outbox.take(10) == [("b", b"1", STATE), ("a", b"2", STATE)]
+
+
+def test_eviction_order_and_commands_kept(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.bin"), max_messages=3)
+    outbox.put("state", "s", STATE)
+    outbox.put("meter1", "m", METER)
+    outbox.put("meter2", "m", METER)
+    # Full: the oldest meter value makes room, then the next one, then the state
+    outbox.put("cmd1", "c", COMMAND)
+    outbox.put("cmd2", "c", COMMAND)
+    outbox.put("cmd3", "c", COMMAND)
+    assert [topic for topic, _, _ in outbox.take(10)] == ["cmd1", "cmd2", "cmd3"]
+    assert outbox.dropped == [0, 1, 2]
+    # Nothing less important left: a meter value is dropped, a command goes over the bound
+    for topic in ("x", "y", "z"):
+        outbox.put(topic, "c", COMMAND)
+    assert not outbox.put("meter3", "m", METER)
+    assert outbox.put("cmd4", "c", COMMAND)
+    assert len(outbox) == 4
+
+
+def test_replay_after_restart(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path)
+    outbox.put("a", "1", STATE)
+    outbox.put("b", "1", METER)
+    outbox.put("a", "2", COMMAND)
+    outbox.close()
+    reloaded = Outbox(path)
+    assert reloaded.take(10) == [("a", b"2", COMMAND), ("b", b"1", METER)]
+
+
+def test_replay_applies_bound(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path, max_messages=3)
+    for i in range(4):
+        outbox.put(f"meter{i}", "m", METER)
+    assert len(outbox) == 3
+    outbox.close()
+    reloaded = Outbox(path, max_messages=3)
+    assert [topic for topic, _, _ in reloaded.take(10)] == ["meter1", "meter2", "meter3"]
+
+
+def test_torn_last_record_ignored(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path)
+    outbox.put("a", "1", STATE)
+    outbox.put("b", "2", STATE)
+    outbox.close()
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert Outbox(path).take(10) == [("a", b"1", STATE)]
+
+
+def test_taken_batch_survives_crash_until_done(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path)
+    outbox.put("a", "1", STATE)
+    outbox.put("b", "1", STATE)
+    batch = outbox.take(10)
+    assert len(outbox) == 0
+    # Crash before the batch was confirmed: it is still on disk
+    outbox.close()
+    reloaded = Outbox(path)
+    assert len(reloaded) == 2
+    batch = reloaded.take(10)
+    reloaded.requeue(*batch[1])
+    reloaded.done(batch)
+    assert os.path.getsize(path) > 0
+    reloaded.done(reloaded.take(10))
+    assert os.path.getsize(path) == 0
+
+
+def test_compaction_keeps_in_flight(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path)
+    outbox.put("flying", "1", STATE)
+    outbox.take(1)
+    for i in range(1200):
+        outbox.put("hot", str(i), METER)
+    # Compacted once past 1000 records: far less than 1200 records (~17 KB)
+    assert os.path.getsize(path) < 5000
+    outbox.close()
+    reloaded = Outbox(path)
+    assert sorted(reloaded.take(10)) == [("flying", b"1", STATE), ("hot", b"1199", METER)]
+
+
+def test_reopen_does_not_leak_file_handle(tmp_path):
+    path = str(tmp_path / "outbox.bin")
+    outbox = Outbox(path)
+    outbox.put("a", "1", STATE)
+    outbox.close()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        Outbox(path).close()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
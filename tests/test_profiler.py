@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from profiler import RuntimeProfiler
+
+
+@pytest.mark.parametrize("seconds", ["nan", "inf", "-5", "0", "abc", "", [1]])
+def test_invalid_durations_rejected(tmp_path, seconds):
+    async def run():
+        profiler = RuntimeProfiler(str(tmp_path))
+        return profiler.start(seconds), profiler.running
+
+    assert asyncio.run(run()) == (False, False)
+
+
+def test_profiles_and_writes_report(tmp_path):
+    async def run():
+        profiler = RuntimeProfiler(str(tmp_path), max_seconds=0.05)
+        assert profiler.start("3600")
+        assert not profiler.start(None)
+        await asyncio.sleep(0.1)
+        assert not profiler.running
+        for _ in range(100):
+            if profiler.last_report:
+                break
+            await asyncio.sleep(0.02)
+        return profiler.last_report
+
+    report = asyncio.run(run())
+    assert report is not None and report.endswith(".txt")
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".prof", ".txt"]
@@ -0,0 +1,107 @@
+"""
+server.on_connect cleanup: a charger whose setup fails after registration must not
+stay registered, watched or counted as connected, and the cleanup of a replaced
+connection must leave the new one alone.
+
+    python -m pytest -q tests
+"""
+import asyncio
+from types import SimpleNamespace
+
+import websockets.exceptions
+
+CURRENT_IMPORT = [{
+    "timestamp": "2024-01-01T00:00:00Z",
+    "sampledValue": [{"value": "10", "measurand": "Current.Import", "phase": "L1", "unit": "A"}],
+}]
+
+
+class FakeWebSocket:
+    """
+    A charger connection that stays open until the test lets the server's close() through.
+    """
+
+    def __init__(self, path="/CP_TEST"):
+        self.request = SimpleNamespace(path=path)
+        self.remote_address = ("127.0.0.1", 0)
+        self.close_requested = False
+        self.closed = asyncio.Event()
+
+    async def recv(self):
+        await self.closed.wait()
+        raise websockets.exceptions.ConnectionClosedOK(None, None)
+
+    async def send(self, message):
+        pass
+
+    async def close(self, code=1000, reason=""):
+        self.close_requested = True
+
+
+def test_failing_setup_is_cleaned_up(server, monkeypatch):
+    def publish_connection(self, online):
+        if online:
+            raise ValueError("Publish topic cannot contain wildcards")
+
+    monkeypatch.setattr(server.EVChargePoint, "publish_connection", publish_connection)
+
+    async def connect():
+        await server.on_connect(FakeWebSocket())
+        await server.session_store.close()
+
+    asyncio.run(connect())
+
+    assert len(server.charge_points) == 0
+    assert len(server.liveness) == 0
+    assert server.server_metrics.connected == 0
+    assert server.charge_points.route_command("suspend_CP_TEST/set") is None
+
+
+def test_reconnect_cleanup_keeps_new_session(import_server):
+    server = import_server({"site": {"budget": 32, "min_current": 6}})
+
+    async def reconnect():
+        old_ws, new_ws = FakeWebSocket("/CP_R"), FakeWebSocket("/CP_R")
+        old_task = asyncio.create_task(server.on_connect(old_ws))
+        await asyncio.sleep(0)
+        old = server.charge_points.get("CP_R")
+        await old.on_meter_values(1, CURRENT_IMPORT)
+
+        # Reconnect; the new connection reports before the old one's cleanup has run
+        new_task = asyncio.create_task(server.on_connect(new_ws))
+        await asyncio.sleep(0)
+        new = server.charge_points.get("CP_R")
+        assert new is not old
+        await new.on_meter_values(1, CURRENT_IMPORT)
+        new.apply_site_limit(16)
+        await asyncio.sleep(0)
+        assert old_ws.close_requested
+
+        old_ws.closed.set()
+        await old_task
+        assert server.charge_points.get("CP_R") is new
+        assert server.load_manager.allocation("CP_R") is not None
+        assert new.site_limit == 16
+        assert new in server.liveness.wheel
+
+        new_ws.closed.set()
+        await new_task
+        await server.session_store.close()
+
+    asyncio.run(reconnect())
+
+    assert len(server.charge_points) == 0
+    assert server.load_manager.allocation("CP_R") is None
+    assert server.server_metrics.connected == 0
+
+
+def test_close_task_is_kept_until_done(server):
+    async def run():
+        websocket = FakeWebSocket()
+        server.close_connection(SimpleNamespace(_connection=websocket), "idle timeout")
+        assert len(server._close_tasks) == 1
+        await asyncio.sleep(0)
+        return websocket
+
+    assert asyncio.run(run()).close_requested
+    assert not server._close_tasks
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import sqlite3
+
+from session_store import SessionStore
+
+
+def test_sessions_survive_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def first_run():
+        store = SessionStore(path)
+        a = store.start_transaction("CP_1", 1, "tag", 100, "2024-01-01T00:00:00Z")
+        b = store.start_transaction("CP_2", 1, "tag", 200, "2024-01-01T00:00:00Z")
+        store.stop_transaction("CP_1", a.transaction_id, 1100, "2024-01-01T01:00:00Z", "Local")
+        store.record_energy(a.transaction_id, 1000.0, 0.31)
+        await store.close()
+        return a, b
+
+    a, b = asyncio.run(first_run())
+    assert b.transaction_id > a.transaction_id
+
+    async def second_run():
+        store = SessionStore(path)
+        try:
+            assert store.active_transaction("CP_1") is None
+            assert store.active_transaction("CP_2").transaction_id == b.transaction_id
+            # Ids keep increasing across restarts
+            assert store.start_transaction("CP_3").transaction_id > b.transaction_id
+            return await store.history("CP_1")
+        finally:
+            await store.close()
+
+    (stopped,) = asyncio.run(second_run())
+    assert (stopped.meter_start, stopped.meter_stop, stopped.stop_reason) == (100, 1100, "Local")
+    assert (stopped.energy_wh, stopped.cost) == (1000.0, 0.31)
+
+
+def test_writes_are_batched(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path / "sessions.db"))
+        for i in range(50):
+            store.start_transaction(f"CP_{i}")
+        await store.flush()
+        commits = store.commits
+        await store.close()
+        return commits
+
+    assert asyncio.run(run()) < 50
+
+
+def test_adopt_and_unknown_stop(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path / "sessions.db"))
+        store.adopt_transaction("CP_1", 4242)
+        assert store.active_transaction("CP_1").transaction_id == 4242
+        # A stop for a transaction we never saw is still recorded
+        store.stop_transaction("CP_1", 77, 10)
+        assert store.active_transaction("CP_1").transaction_id == 4242
+        store.stop_transaction("CP_1", 4242, 20)
+        assert store.active_transaction("CP_1") is None
+        assert store.start_transaction("CP_1").transaction_id > 4242
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_legacy_import_and_added_columns(tmp_path):
+    # A database from before energy accounting, plus the old persist.json
+    path = str(tmp_path / "sessions.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (transaction_id INTEGER PRIMARY KEY, charge_point_id TEXT NOT NULL, "
+                 "connector_id INTEGER, id_tag TEXT, meter_start INTEGER, start_time TEXT, meter_stop INTEGER, "
+                 "stop_time TEXT, stop_reason TEXT)")
+    conn.close()
+    legacy = tmp_path / "persist.json"
+    legacy.write_text(json.dumps({"current_transaction_id": 1234}))
+
+    async def run():
+        store = SessionStore(path, legacy_file=str(legacy), legacy_charge_point_id="FH_CHARGE")
+        assert store.active_transaction("FH_CHARGE").transaction_id == 1234
+        store.record_energy(1234, 5.0, 1.0)
+        await store.close()
+
+    asyncio.run(run())
+    # Imported only while the database is empty
+    store = SessionStore(path, legacy_file=str(legacy), legacy_charge_point_id="OTHER")
+    assert store.active_transaction("OTHER") is None
+    assert store.active_transaction("FH_CHARGE").energy_wh == 5.0
+    asyncio.run(store.close())
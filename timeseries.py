@@ -0,0 +1,281 @@
+import math
+import time
+from array import array
+from datetime import datetime
+
+AGGREGATES = ("min", "max", "avg", "last", "count")
+
+# Measurands (normalized, as in SensorDescriptor.measurand) kept by default
+DEFAULT_MEASURANDS = ("power_active_import", "energy_active_import_register")
+
+# Sensors stored as float64: energy registers count Wh since commissioning, and
+# float32 stops resolving whole Wh above ~16.7 MWh
+DOUBLE_PREFIXES = ("energy_",)
+
+
+def parse_timestamp(value, default=None):
+    """
+    Epoch seconds of an OCPP timestamp; `default` (or now) when missing or malformed.
+    """
+    if value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return default if default is not None else time.time()
+
+
+class RingSeries:
+    """
+    Raw samples in a fixed-capacity ring: float64 timestamps, float32 values
+    (float64 with typecode "d").
+    """
+    __slots__ = ("capacity", "ts", "values", "head", "size", "last_ts")
+
+    def __init__(self, capacity, typecode="f"):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.values = array(typecode, bytes(array(typecode).itemsize * capacity))
+        self.head = 0  # index of the oldest sample
+        self.size = 0
+        self.last_ts = -math.inf
+
+    def append(self, ts, value):
+        if ts < self.last_ts:
+            return False  # out of order (charger clock jumped back); keep the ring sorted
+        self.last_ts = ts
+        size = self.size
+        if size < self.capacity:
+            i = (self.head + size) % self.capacity
+            self.size = size + 1
+        else:
+            i = self.head
+            self.head = (i + 1) % self.capacity
+        self.ts[i] = ts
+        self.values[i] = value
+        return True
+
+    def _at(self, k):
+        return (self.head + k) % self.capacity
+
+    def _lower(self, t):
+        # First logical position with ts >= t (binary search over the ring)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._at(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def oldest(self):
+        return self.ts[self.head] if self.size else math.inf
+
+    def samples(self, start, end):
+        for k in range(self._lower(start), self.size):
+            i = self._at(k)
+            if self.ts[i] >= end:
+                break
+            yield self.ts[i], self.values[i]
+
+    def nbytes(self):
+        return self.ts.itemsize * len(self.ts) + self.values.itemsize * len(self.values)
+
+
+class AggregateTier:
+    """
+    Fixed-width time buckets (e.g. 1 or 15 minutes) in a ring of aggregate columns.
+
+    Buckets are contiguous in time, so a bucket's start is implied by its position;
+    gaps show up as empty buckets (count 0).
+    """
+    __slots__ = ("width", "capacity", "min", "max", "sum", "last", "count",
+                 "first_bucket", "last_bucket", "current", "size")
+
+    def __init__(self, width, capacity, typecode="f"):
+        self.width = width
+        self.capacity = capacity
+        itemsize = array(typecode).itemsize
+        self.min = array(typecode, bytes(itemsize * capacity))
+        self.max = array(typecode, bytes(itemsize * capacity))
+        self.last = array(typecode, bytes(itemsize * capacity))
+        self.sum = array("d", bytes(8 * capacity))
+        self.count = array("H", bytes(2 * capacity))
+        self.first_bucket = None  # bucket number (ts // width) of the oldest bucket
+        self.last_bucket = None
+        self.current = 0  # ring index of last_bucket
+        self.size = 0
+
+    def add(self, ts, value):
+        bucket = int(ts // self.width)
+        if bucket != self.last_bucket:
+            if not self._open(bucket):
+                return
+        i = self.current
+        n = self.count[i]
+        if n == 0:
+            self.min[i] = self.max[i] = value
+        elif value < self.min[i]:
+            self.min[i] = value
+        elif value > self.max[i]:
+            self.max[i] = value
+        self.sum[i] += value
+        self.last[i] = value
+        if n < 65535:
+            self.count[i] = n + 1
+
+    def _open(self, bucket):
+        if self.first_bucket is None:
+            self.first_bucket, self.size = bucket, 1
+            self._clear(bucket % self.capacity)
+        elif bucket < self.last_bucket:
+            return False
+        else:
+            # Open new buckets, clearing those that roll over the ring
+            for b in range(max(self.last_bucket + 1, bucket - self.capacity + 1), bucket + 1):
+                self._clear(b % self.capacity)
+            self.size = min(self.capacity, self.size + bucket - self.last_bucket)
+            self.first_bucket = bucket - self.size + 1
+        self.last_bucket = bucket
+        self.current = bucket % self.capacity
+        return True
+
+    def _clear(self, i):
+        self.min[i] = self.max[i] = self.last[i] = 0.0
+        self.sum[i] = 0.0
+        self.count[i] = 0
+
+    def oldest(self):
+        return self.first_bucket * self.width if self.first_bucket is not None else math.inf
+
+    def buckets(self, start, end):
+        """
+        Yield (bucket_start, index) of non-empty buckets overlapping [start, end).
+        """
+        if self.first_bucket is None:
+            return
+        first = max(self.first_bucket, int(start // self.width))
+        last = min(self.last_bucket, int(math.ceil(end / self.width)) - 1)
+        for b in range(first, last + 1):
+            i = b % self.capacity
+            if self.count[i]:
+                yield b * self.width, i
+
+    def value(self, i, agg):
+        if agg == "avg":
+            return self.sum[i] / self.count[i]
+        return getattr(self, agg)[i]
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.min, self.max, self.last, self.sum, self.count))
+
+
+class MeterSeries:
+    """
+    One sensor's history: raw ring plus automatically downsampled 1-min and 15-min tiers.
+    """
+
+    def __init__(self, raw_capacity=2880, minute_capacity=2880, quarter_capacity=2880, typecode="f"):
+        self.raw = RingSeries(raw_capacity, typecode)
+        self.tiers = (AggregateTier(60, minute_capacity, typecode), AggregateTier(900, quarter_capacity, typecode))
+
+    def append(self, ts, value):
+        if self.raw.append(ts, value):
+            for tier in self.tiers:
+                tier.add(ts, value)
+
+    def query(self, start, end, agg="avg", resolution=None):
+        """
+        Points in [start, end) as (timestamp, value).
+
+        resolution None/0 returns raw samples when still retained; 60 or 900 selects a
+        tier. Without a resolution the finest source still covering `start` is used.
+        """
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {agg!r}, expected one of {AGGREGATES}")
+        if not resolution and self.raw.oldest() <= start:
+            return list(self.raw.samples(start, end))
+        tier = self._tier(start, resolution)
+        return [(ts, tier.value(i, agg)) for ts, i in tier.buckets(start, end)]
+
+    def aggregate(self, start, end, agg="avg"):
+        """
+        Single aggregate over [start, end), from the finest source covering `start`.
+        """
+        if agg not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {agg!r}, expected one of {AGGREGATES}")
+        if self.raw.oldest() <= start:
+            points = [(v, v, v, v, 1) for _, v in self.raw.samples(start, end)]
+        else:
+            tier = self._tier(start, None)
+            points = [
+                (tier.min[i], tier.max[i], tier.sum[i], tier.last[i], tier.count[i])
+                for _, i in tier.buckets(start, end)
+            ]
+        if not points:
+            return None
+        if agg == "min":
+            return min(p[0] for p in points)
+        if agg == "max":
+            return max(p[1] for p in points)
+        if agg == "last":
+            return points[-1][3]
+        count = sum(p[4] for p in points)
+        if agg == "count":
+            return count
+        return sum(p[2] for p in points) / count
+
+    def _tier(self, start, resolution):
+        if resolution:
+            for tier in self.tiers:
+                if tier.width == resolution:
+                    return tier
+            raise ValueError(f"No tier with resolution {resolution}s")
+        for tier in self.tiers:
+            if tier.oldest() <= start:
+                return tier
+        return self.tiers[-1]
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(t.nbytes() for t in self.tiers)
+
+
+class MeterHistory:
+    """
+    Per-charger meter history: one MeterSeries per sensor of the tracked measurands.
+
+    Memory is allocated up front per sensor, so it is fixed once the sensors are known.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        measurands = config.get("measurands", DEFAULT_MEASURANDS)
+        self.measurands = None if measurands == "all" else frozenset(measurands)
+        self.capacities = (
+            config.get("raw_capacity", 2880),      # 24 h of 30 s samples
+            config.get("minute_capacity", 2880),   # 48 h of 1 min buckets
+            config.get("quarter_capacity", 2880),  # 30 days of 15 min buckets
+        )
+        self.series = {}
+
+    def tracks(self, measurand):
+        return self.measurands is None or measurand in self.measurands
+
+    def append(self, sensor_name, ts, value):
+        series = self.series.get(sensor_name)
+        if series is None:
+            typecode = "d" if sensor_name.startswith(DOUBLE_PREFIXES) else "f"
+            series = self.series[sensor_name] = MeterSeries(*self.capacities, typecode=typecode)
+        series.append(ts, value)
+
+    def query(self, sensor_name, start, end, agg="avg", resolution=None):
+        series = self.series.get(sensor_name)
+        return series.query(start, end, agg, resolution) if series is not None else []
+
+    def aggregate(self, sensor_name, start, end, agg="avg"):
+        series = self.series.get(sensor_name)
+        return series.aggregate(start, end, agg) if series is not None else None
+
+    def nbytes(self):
+        return sum(s.nbytes() for s in self.series.values())
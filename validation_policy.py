@@ -0,0 +1,104 @@
+import logging
+import ocpp.messages
+from ocpp.messages import MessageType, get_validator
+
+MODES = ("full", "sample", "off")
+# The library loads these schemas with Decimal floats; its cache key ignores that,
+# so they must not be preloaded with the default float parser
+DECIMAL_SCHEMAS = ("SetChargingProfile", "RemoteStartTransaction", "GetCompositeSchedule")
+
+
+class ValidationPolicy:
+    """
+    Decides per inbound CALL whether the ocpp library checks it (and our response)
+    against the OCPP JSON schema.
+
+      "full"    every message (the library default)
+      "sample"  the first `first` messages per action, then 1 in `sample_every`
+      "off"     never, for trusted hardware
+
+    Flipping `_skip_schema_validation` in the charge point's own route_map applies
+    the decision; the route map is built per instance, so chargers do not affect
+    each other.
+    """
+
+    def __init__(self, mode="full", first=20, sample_every=10):
+        if mode not in MODES:
+            raise ValueError(f"Unknown validation mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.first = first
+        self.sample_every = max(1, sample_every)
+        # action -> inbound calls seen
+        self._seen = {}
+        self.validated = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, config, charge_point_id=None):
+        """
+        Policy for one charger from the "validation" config section; a per-charger
+        mode in "chargers" overrides the default one.
+        """
+        config = config or {}
+        mode = config.get("chargers", {}).get(charge_point_id, config.get("mode", "full"))
+        return cls(mode, config.get("first", 20), config.get("sample_every", 10))
+
+    def should_validate(self, action):
+        if self.mode == "full":
+            self.validated += 1
+            return True
+        if self.mode == "off":
+            self.skipped += 1
+            return False
+        seen = self._seen.get(action, 0)
+        self._seen[action] = seen + 1
+        if seen < self.first or (seen - self.first) % self.sample_every == 0:
+            self.validated += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def apply(self, route_map, action):
+        """
+        Set the route's _skip_schema_validation for the call about to be handled.
+        Routes decorated with @on(..., skip_schema_validation=True) stay skipped.
+        """
+        handlers = route_map.get(action)
+        if handlers is None:
+            return
+        always_skip = handlers.get("_always_skip_schema_validation")
+        if always_skip is None:
+            always_skip = handlers["_always_skip_schema_validation"] = handlers.get("_skip_schema_validation", False)
+        handlers["_skip_schema_validation"] = always_skip or not self.should_validate(action)
+
+    def stats(self):
+        return {"mode": self.mode, "validated": self.validated, "skipped": self.skipped}
+
+
+def configure_validation(config):
+    """
+    Process-wide part of the "validation" section. The ocpp library validates in an
+    executor thread by default (two thread hops per message); "inline": true
+    validates on the event loop instead, which is cheaper for small payloads.
+    """
+    config = config or {}
+    if "inline" in config:
+        ocpp.messages.ASYNC_VALIDATION = not config["inline"]
+
+
+def preload_validators(actions, ocpp_version="1.6"):
+    """
+    Load the request and response schemas of `actions` into the library's shared
+    validator cache, so the first message of each action does not read them from disk.
+    """
+    loaded = 0
+    for action in actions:
+        if action in DECIMAL_SCHEMAS:
+            continue
+        for message_type in (MessageType.Call, MessageType.CallResult):
+            try:
+                get_validator(message_type, action, ocpp_version)
+                loaded += 1
+            except (OSError, ValueError) as e:
+                logging.warning(f"No {ocpp_version} schema for {action}: {e}")
+    return loaded